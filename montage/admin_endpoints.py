@@ -7,21 +7,28 @@ import datetime
 from clastic import GET, POST, Response
 from clastic.errors import Forbidden
 from boltons.strutils import slugify
+from boltons.iterutils import chunked_iter
 
 from .utils import (format_date,
                    get_threshold_map,
+                   get_advancing_count,
                    InvalidAction,
                    NotImplementedResponse,
                    js_isoparse)
 
 from .rdb import (FINALIZED_STATUS,
+                 AUTODQ_RULES,
+                 RoundEntry,
                  CoordinatorDAO,
                  MaintainerDAO,
-                 OrganizerDAO)
+                 OrganizerDAO,
+                 PublicDAO)
+from .public_endpoints import save_report_html
 
 CATEGORY_METHOD = 'category'
 ROUND_METHOD = 'round'
 SELECTED_METHOD = 'selected'
+CSV_CHUNK_SIZE = 500
 
 
 # These are populated at the bottom of the module
@@ -104,26 +111,46 @@ def get_round_entries(user_dao, round_id):
     return {'file_infos': entry_infos}
 
 
-def download_round_entries_csv(user_dao, round_id):
-    coord_dao = CoordinatorDAO.from_round(user_dao, round_id)
-    rnd = coord_dao.get_round(round_id)
-    entries = coord_dao.get_round_entries(round_id)
-    entry_infos = [e.to_export_dict() for e in entries]
-    if not entry_infos:
-        raise InvalidAction('no entries in round, cannot export CSV')
-    output_name = 'montage_entries-%s.csv' % slugify(rnd.name, ascii=True).decode('ascii')
+ENTRY_EXPORT_FIELDNAMES = ['file_id', 'img_height', 'img_id', 'img_major_mime',
+                           'img_minor_mime', 'img_name', 'img_timestamp',
+                           'img_user', 'img_user_text', 'img_width',
+                           'source_method', 'source_params']
+
+
+def _iter_csv_chunks(fieldnames, rows, **kw):
+    # Generates the CSV a chunk of rows at a time, so big exports can
+    # go out as a streamed response instead of being built in memory.
     output = io.BytesIO()
-    csv_fieldnames = sorted(entry_infos[0].keys())
-    csv_writer = unicodecsv.DictWriter(output, fieldnames=csv_fieldnames)
+    csv_writer = unicodecsv.DictWriter(output, fieldnames=fieldnames, **kw)
     csv_writer.writeheader()
-    csv_writer.writerows(entry_infos)
-    ret = output.getvalue()
-    resp = Response(ret, mimetype='text/csv')
+    for row_chunk in chunked_iter(rows, CSV_CHUNK_SIZE):
+        csv_writer.writerows(row_chunk)
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    if output.tell():
+        yield output.getvalue()
+
+
+def _make_csv_response(chunk_iter, output_name):
+    resp = Response(chunk_iter, mimetype='text/csv')
     resp.mimetype_params['charset'] = 'utf-8'
     resp.headers['Content-Disposition'] = 'attachment; filename=%s' % (output_name,)
     return resp
 
 
+def download_round_entries_csv(user_dao, round_id):
+    coord_dao = CoordinatorDAO.from_round(user_dao, round_id)
+    rnd = coord_dao.get_round(round_id)
+    if not coord_dao.query(RoundEntry.id).filter_by(round_id=round_id,
+                                                    dq_reason=None).first():
+        raise InvalidAction('no entries in round, cannot export CSV')
+    output_name = 'montage_entries-%s.csv' % slugify(rnd.name, ascii=True).decode('ascii')
+    entry_infos = coord_dao.iter_round_entry_exports(round_id)
+    return _make_csv_response(_iter_csv_chunks(ENTRY_EXPORT_FIELDNAMES, entry_infos),
+                              output_name)
+
+
 def disqualify_entry(user_dao, round_id, entry_id, request_dict):
     if not request_dict:
         request_dict = {}
@@ -169,9 +196,13 @@ def edit_series(user_dao, series_id, request_dict):
     return {'data': new_series}
 
 
-def publish_report(user_dao, campaign_id):
+def publish_report(user_dao, campaign_id, config, ashes_renderer):
     coord_dao = CoordinatorDAO.from_campaign(user_dao, campaign_id)
     coord_dao.publish_report()
+    if config.get('report_html_path'):
+        report = PublicDAO(user_dao.rdb_session).get_report(campaign_id)
+        if report:
+            save_report_html(config, ashes_renderer, report)
 
 
 def unpublish_report(user_dao, campaign_id):
@@ -194,7 +225,7 @@ def make_admin_round_details(rnd, rnd_stats):
            'deadline_date': format_date(rnd.deadline_date),
            'status': rnd.status,
            'quorum': rnd.quorum,
-           'total_entries': len(rnd.entries),
+           'total_entries': rnd_stats['total_round_entries'],
            'total_tasks': rnd_stats['total_tasks'],
            'total_open_tasks': rnd_stats['total_open_tasks'],
            'percent_tasks_open': rnd_stats['percent_tasks_open'],
@@ -202,7 +233,7 @@ def make_admin_round_details(rnd, rnd_stats):
            'campaign': rnd.campaign.to_info_dict(),
            'stats': rnd_stats,
            'jurors': [rj.to_details_dict() for rj in rnd.round_jurors],
-           'is_closable': rnd.check_closability()}
+           'is_closable': rnd.check_closability(rnd_stats)}
     return ret
 
 
@@ -338,6 +369,9 @@ def import_entries(user_dao, round_id, request_dict):
 
     # loader warnings
     import_warnings = list()
+    # csv warnings are collected as the import streams through
+    # add_round_entries, the rest are known up front
+    warnings = []
 
     if import_method == 'csv' or import_method == 'gistcsv':
         if import_method == 'gistcsv':
@@ -348,9 +382,6 @@ def import_entries(user_dao, round_id, request_dict):
         entries, warnings = coord_dao.add_entries_from_csv(round_id,
                                                            csv_url)
         params = {'csv_url': csv_url}
-        if warnings:
-            msg = u'unable to load {} files ({!r})'.format(len(warnings), warnings)
-            import_warnings.append(msg)
     elif import_method == CATEGORY_METHOD:
         cat_name = request_dict['category']
         entries = coord_dao.add_entries_from_cat(round_id, cat_name)
@@ -364,12 +395,6 @@ def import_entries(user_dao, round_id, request_dict):
     elif import_method == SELECTED_METHOD:
         file_names = request_dict['file_names']
         entries, warnings = coord_dao.add_entries_by_name(round_id, file_names)
-        if warnings:
-            formatted_warnings = u'\n'.join([
-                u'- {}'.format(warning) for warning in warnings
-            ])
-            msg = u'unable to load {} files:\n{}'.format(len(warnings), formatted_warnings)
-            import_warnings.append({'import issues', msg})
         params = {'file_names': file_names}
     else:
         raise NotImplementedResponse()
@@ -377,19 +402,29 @@ def import_entries(user_dao, round_id, request_dict):
     new_entry_stats = coord_dao.add_round_entries(round_id, entries,
                                                   method=import_method,
                                                   params=params)
+    if warnings and import_method == SELECTED_METHOD:
+        formatted_warnings = u'\n'.join([
+            u'- {}'.format(warning) for warning in warnings
+        ])
+        msg = u'unable to load {} files:\n{}'.format(len(warnings), formatted_warnings)
+        import_warnings.append({'import issues', msg})
+    elif warnings:
+        msg = u'unable to load {} files ({!r})'.format(len(warnings), warnings)
+        import_warnings.append(msg)
     new_entry_stats['warnings'] = import_warnings
 
-    if not entries:
+    entry_count = new_entry_stats['new_entry_count']
+    if not entry_count:
         new_entry_stats['warnings'].append({'empty import':
                                             'no entries imported'})
-    elif not new_entry_stats.get('new_entry_count'):
+    elif not new_entry_stats['new_round_entry_count']:
         new_entry_stats['warnings'].append({'duplicate import':
                                             'no new entries imported'})
 
     # automatically disqualify entries based on round config
     auto_dq = autodisqualify(user_dao, round_id, request_dict={})
     new_entry_stats['disqualified'] = auto_dq['data']
-    if len(new_entry_stats['disqualified']) >= len(entries):
+    if len(new_entry_stats['disqualified']) >= entry_count:
         new_entry_stats['warnings'].append({'all disqualified':
                   'all entries disqualified by round settings'})
 
@@ -504,7 +539,7 @@ def create_round(user_dao, campaign_id, request_dict):
     rnd = coord_dao.create_round(**rnd_params)
 
     data = rnd.to_details_dict()
-    data['progress'] = rnd.get_count_map()
+    data['progress'] = data['stats']
 
     return {'data': data}
 
@@ -530,12 +565,14 @@ def cancel_round(user_dao, round_id):
     return {'data': stats}
 
 
-def get_round_results_preview(user_dao, round_id):
+def get_round_results_preview(user_dao, round_id, request):
+    """For rating rounds, pass a threshold to also get the
+    advancing_count at that threshold."""
     coord_dao = CoordinatorDAO.from_round(user_dao, round_id)
     rnd = coord_dao.get_round(round_id)
 
     round_counts = rnd.get_count_map()
-    is_closeable = rnd.check_closability()
+    is_closeable = rnd.check_closability(round_counts)
 
     data = {'round': rnd.to_info_dict(),
             'counts': round_counts,
@@ -548,6 +585,10 @@ def get_round_results_preview(user_dao, round_id):
         except:
             # import pdb;pdb.post_mortem()
             raise
+        threshold = request.values.get('threshold', type=float)
+        if threshold is not None:
+            data['advancing_count'] = get_advancing_count(data['ratings'],
+                                                          threshold)
     elif rnd.vote_method == 'ranking':
         completed_votes_count = round_counts.get('total_tasks', 0) - round_counts.get('total_open_tasks', 0)
         if not is_closeable or not completed_votes_count:
@@ -617,7 +658,7 @@ def advance_round(user_dao, round_id, request_dict):
     # been performed the first round.
 
     next_rnd_dict = next_rnd.to_details_dict()
-    next_rnd_dict['progress'] = next_rnd.get_count_map()
+    next_rnd_dict['progress'] = next_rnd_dict['stats']
 
     msg = ('%s advanced campaign %r (#%s) from %s round "%s" to %s round "%s"'
            % (user_dao.user.username, rnd.campaign.name, rnd.campaign.id,
@@ -769,32 +810,27 @@ def download_results_csv(user_dao, round_id, request_dict):
     # TODO: Confirm round is finalized
     # raise DoesNotExist('round results not yet finalized')
 
-    results_by_name = coord_dao.make_vote_table(round_id)
-
-    output = io.BytesIO()
-    csv_fieldnames = ['filename', 'average'] + [r.username for r in rnd.jurors]
-    csv_writer = unicodecsv.DictWriter(output, fieldnames=csv_fieldnames,
-                                       restval=None)
+    juror_names = [r.username for r in rnd.jurors]
+    # include anyone who has since been removed from the round, too
+    voter_names = coord_dao.get_round_voter_names(round_id)
+    juror_names += sorted(set(voter_names) - set(juror_names))
+    csv_fieldnames = ['filename', 'average'] + juror_names
     # na means this entry wasn't assigned
 
-    csv_writer.writeheader()
+    def iter_csv_rows():
+        for filename, ratings in coord_dao.iter_vote_table(round_id):
+            csv_row = {'filename': filename}
+            valid_ratings = [r for r in ratings.values() if type(r) is not str]
+            if valid_ratings:
+                # TODO: catch if there are more than a quorum of votes
+                ratings['average'] = sum(valid_ratings) / len(valid_ratings)
+            else:
+                ratings['average'] = 'na'
+            csv_row.update(ratings)
+            yield csv_row
 
-    for filename, ratings in results_by_name.items():
-        csv_row = {'filename': filename}
-        valid_ratings = [r for r in ratings.values() if type(r) is not str]
-        if valid_ratings:
-            # TODO: catch if there are more than a quorum of votes
-            ratings['average'] = sum(valid_ratings) / len(valid_ratings)
-        else:
-            ratings['average'] = 'na'
-        csv_row.update(ratings)
-        csv_writer.writerow(csv_row)
-
-    ret = output.getvalue()
-    resp = Response(ret, mimetype='text/csv')
-    resp.mimetype_params['charset'] = 'utf-8'
-    resp.headers['Content-Disposition'] = 'attachment; filename=%s' % output_name
-    return resp
+    chunk_iter = _iter_csv_chunks(csv_fieldnames, iter_csv_rows(), restval=None)
+    return _make_csv_response(chunk_iter, output_name)
 
 
 def autodisqualify(user_dao, round_id, request_dict):
@@ -809,15 +845,13 @@ def autodisqualify(user_dao, round_id, request_dict):
     dq_by_uploader = request_dict.get('dq_by_uploader')
     dq_by_filetype = request_dict.get('dq_by_filetype')
 
-    round_entries = []
+    rules = []
 
     if rnd.config.get('dq_by_upload_date') or dq_by_upload_date:
-        dq_upload_date = coord_dao.autodisqualify_by_date(round_id)
-        round_entries += dq_upload_date
+        rules.append('upload_date')
 
     if rnd.config.get('dq_by_resolution') or dq_by_resolution:
-        dq_resolution = coord_dao.autodisqualify_by_resolution(round_id)
-        round_entries += dq_resolution
+        rules.append('resolution')
 
     if (
         rnd.config.get('dq_by_uploader') or
@@ -826,14 +860,13 @@ def autodisqualify(user_dao, round_id, request_dict):
         rnd.config.get('dq_organizers') or
         rnd.config.get('dq_maintainers')
     ):
-        dq_uploader = coord_dao.autodisqualify_by_uploader(round_id)
-        round_entries += dq_uploader
+        rules.append('uploader')
 
     if rnd.config.get('dq_by_filetype') or dq_by_filetype:
-        dq_filetype = coord_dao.autodisqualify_by_filetype(round_id)
-        round_entries += dq_filetype
+        rules.append('filetype')
 
-    data = [re.to_dq_details() for re in round_entries]
+    # all enabled rules are evaluated and applied together
+    data = coord_dao.autodisqualify(round_id, rules)
 
     return {'data': data}
 
@@ -846,21 +879,10 @@ def preview_disqualification(user_dao, round_id):
     rnd = coord_dao.get_round(round_id)
     ret = {'config': rnd.config}
 
-    by_upload_date = coord_dao.autodisqualify_by_date(round_id, preview=True)
-    ret['by_upload_date'] = [re.entry.to_details_dict(with_uploader=True)
-                             for re in by_upload_date]
-
-    by_resolution = coord_dao.autodisqualify_by_resolution(round_id, preview=True)
-    ret['by_resolution'] = [re.entry.to_details_dict(with_uploader=True)
-                            for re in by_resolution]
-
-    by_uploader = coord_dao.autodisqualify_by_uploader(round_id, preview=True)
-    ret['by_uploader'] = [re.entry.to_details_dict(with_uploader=True)
-                          for re in by_uploader]
-
-    by_filetype = coord_dao.autodisqualify_by_filetype(round_id, preview=True)
-    ret['by_filetype'] = [re.entry.to_details_dict(with_uploader=True)
-                          for re in by_filetype]
+    matches = coord_dao.get_autodq_matches(round_id, AUTODQ_RULES)
+    for rule, rule_matches in matches.items():
+        ret['by_' + rule] = [entry.to_details_dict(with_uploader=True)
+                             for _, entry in rule_matches]
 
     return {'data': ret}
 
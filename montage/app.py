@@ -24,8 +24,11 @@ from .mw import (UserMiddleware,
                 DBSessionMiddleware,
                 MessageMiddleware,
                 SQLProfilerMiddleware)
-from .rdb import Base, bootstrap_maintainers, ensure_series
+from .rdb import Base, bootstrap_maintainers, ensure_series, track_vote_counts
 from .utils import get_env_name, load_env_config
+from .labs import (configure_replica_pool,
+                   REPLICA_POOL_SIZE,
+                   REPLICA_POOL_RECYCLE)
 from .check_rdb import get_schema_errors, ping_connection
 
 from .meta_endpoints import META_API_ROUTES, META_UI_ROUTES
@@ -69,7 +72,7 @@ def create_app(env_name='prod', config=None):
     print('==  loaded config file: %s' % (config['__file__'],))
 
     engine = create_engine(config.get('db_url', DEFAULT_DB_URL), pool_recycle=60)
-    session_type = sessionmaker()
+    session_type = track_vote_counts(sessionmaker())
     session_type.configure(bind=engine)
     tmp_rdb_session = session_type()
 
@@ -98,6 +101,9 @@ def create_app(env_name='prod', config=None):
     if not config.get('db_disable_ping'):
         event.listen(engine, 'engine_connect', ping_connection)
 
+    configure_replica_pool(size=config.get('replica_pool_size', REPLICA_POOL_SIZE),
+                           recycle=config.get('replica_pool_recycle', REPLICA_POOL_RECYCLE))
+
     renderer = AshesRenderFactory(TEMPLATES_PATH)
 
     cookie_secret = config['cookie_secret']
@@ -125,7 +131,7 @@ def create_app(env_name='prod', config=None):
 
         return engine
 
-    blank_session_type = sessionmaker()
+    blank_session_type = track_vote_counts(sessionmaker())
 
     middlewares = [TimingMiddleware(),
                    UserIPMiddleware(),
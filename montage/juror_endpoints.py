@@ -1,21 +1,31 @@
 
 from __future__ import absolute_import
+import hmac
+import time
+import hashlib
 from itertools import groupby
 
 from clastic import GET, POST
 from clastic.errors import Forbidden
+from clastic.middleware.cookie import JSONCookie
 from boltons.strutils import slugify
 
-from .rdb import JurorDAO
+from .rdb import JurorDAO, RANKING_MAX
 from .utils import format_date, PermissionDenied, InvalidAction
 import six
 import html
 
 
 MAX_RATINGS_SUBMIT = 100
+# rankings are submitted all at once, however many entries the round has
+MAX_RANKINGS_SUBMIT = max(MAX_RATINGS_SUBMIT, RANKING_MAX)
 VALID_RATINGS = (0.0, 0.25, 0.5, 0.75, 1.0)
 VALID_YESNO = (0.0, 1.0)
 
+# leased task batches, see get_tasks_from_round()
+TASK_LEASE_SIZE = MAX_RATINGS_SUBMIT
+TASK_LEASE_SECONDS = 60 * 60
+
 
 # these are set at the bottom of the module
 JUROR_API_ROUTES, JUROR_UI_ROUTES = None, None
@@ -124,28 +134,83 @@ def get_round(user_dao, round_id):
     return {'data': data}
 
 
-def get_tasks_from_round(user_dao, round_id, request):
+def get_tasks_from_round(user_dao, round_id, request, config):
+    """Pass lease=true to get a batch of TASK_LEASE_SIZE tasks along
+    with a lease_token, which can be submitted with the ratings for
+    those tasks, in as many submissions as needed. Leased submissions
+    skip loading the round and the votes (see submit_ratings). Ranking
+    rounds are submitted all at once, so they can't be leased."""
     count = request.values.get('count', 15)
     offset = request.values.get('offset', 0)
     # TODO: remove offset once it's removed from the client
+    # the id of the last task the client already has, for fetching more
+    after = request.values.get('after', type=int)
+    lease = request.values.get('lease', '').lower() in ('1', 'true')
     juror_dao = JurorDAO(user_dao)
     juror_dao.confirm_active(round_id)
     rnd = juror_dao.get_round(round_id)
     if rnd.vote_method == 'ranking':
-        count = MAX_RATINGS_SUBMIT  # TODO: better constant
+        if lease:
+            raise InvalidAction('ranking rounds are submitted all at once,'
+                                ' and cannot be leased')
+        count = MAX_RANKINGS_SUBMIT
+    elif lease:
+        count = TASK_LEASE_SIZE
     tasks = juror_dao.get_tasks_from_round(round_id,
                                            num=count,
-                                           offset=offset)
+                                           offset=offset,
+                                           after=after)
     stats = juror_dao.get_round_task_counts(round_id)
     data = {'stats': stats,
             'tasks': []}
 
-    for task in tasks:
-        data['tasks'].append(task.to_details_dict())
+    data['tasks'] = make_vote_details(juror_dao, tasks)
+    if lease:
+        expires = int(time.time()) + TASK_LEASE_SECONDS
+        data['lease_token'] = make_task_lease(config, user_dao.user, rnd,
+                                              [t.id for t in tasks], expires)
+        data['lease_expires'] = expires
 
     return {'data': data}
 
 
+def get_lease_secret(config):
+    """Leases are signed with a key derived from the cookie_secret, so
+    that session cookies can't pass for leases, or vice versa."""
+    cookie_secret = config['cookie_secret']
+    if not isinstance(cookie_secret, bytes):
+        cookie_secret = cookie_secret.encode('utf8')
+    return hmac.new(cookie_secret, b'montage task lease',
+                    hashlib.sha256).hexdigest()
+
+
+def make_task_lease(config, user, rnd, vote_ids, expires):
+    lease = JSONCookie({'user_id': user.id,
+                        'round_id': rnd.id,
+                        'vote_method': rnd.vote_method,
+                        'vote_ids': vote_ids},
+                       secret_key=get_lease_secret(config))
+    return lease.serialize(expires=expires).decode('ascii')
+
+
+def check_task_lease(config, user, lease_token):
+    "Returns the lease's contents, if it's valid and not yet expired."
+    lease = JSONCookie.unserialize(lease_token, get_lease_secret(config))
+    if lease.get('user_id') != user.id or 'vote_ids' not in lease:
+        raise InvalidAction('invalid or expired lease_token')
+    return lease
+
+
+def make_vote_details(juror_dao, votes):
+    """Serialize many of the juror's votes with a single favorites
+    query. Load votes with their round_entry and entry to keep the
+    rest query-free."""
+    entry_ids = [v.round_entry.entry_id for v in votes]
+    fave_entry_ids = juror_dao.get_fave_entry_ids(entry_ids)
+    return [v.to_details_dict(is_fave=v.round_entry.entry_id in fave_entry_ids)
+            for v in votes]
+
+
 def get_votes_from_round(user_dao, round_id, request, rnd=None):
     count = request.values.get('count', 15)
     offset = request.values.get('offset', 0)
@@ -160,10 +225,10 @@ def get_votes_from_round(user_dao, round_id, request, rnd=None):
                                                    offset=offset,
                                                    sort=sort,
                                                    order_by=order_by)
-        data = [r.to_details_dict() for r in ratings]
+        data = make_vote_details(juror_dao, ratings)
     else:
         rankings = juror_dao.get_rankings_from_round(round_id)
-        data = [r.to_details_dict() for r in rankings]
+        data = make_vote_details(juror_dao, rankings)
         data.sort(key=lambda x: x['value'])
     return {'data': data}
 
@@ -233,23 +298,34 @@ def get_faves(user_dao, request_dict):
     return {'data': [f.to_details_dict() for f in faves]}
 
 
-def submit_ratings(user_dao, request_dict):
+def submit_ratings(user_dao, request_dict, config):
     """message format:
 
     {"ratings": [{"vote_id": 10, "value": 0.0}, {"vote_id": 11, "value": 1.0}]}
 
     this function is used to submit ratings _and_ rankings. when
     submitting rankings does not support ranking ties at the moment
+
+    ratings for leased tasks (see get_tasks_from_round) may include
+    the "lease_token", which is returned with the acknowledged vote
+    ids. The lease stands in for the round lookup and permission
+    checks, so those submissions are written without loading the
+    round or the votes.
     """
 
     # TODO: can jurors change their vote?
     juror_dao = JurorDAO(user_dao)
 
+    lease = None
+    lease_token = request_dict.get('lease_token')
+    if lease_token:
+        lease = check_task_lease(config, user_dao.user, lease_token)
+
     r_dicts = request_dict['ratings']
 
-    if len(r_dicts) > MAX_RATINGS_SUBMIT:
-        raise InvalidAction('can submit up to 100 ratings at once, not %r'
-                            % len(r_dicts))
+    if len(r_dicts) > MAX_RANKINGS_SUBMIT:
+        raise InvalidAction('can submit up to %s rankings at once, not %r'
+                            % (MAX_RANKINGS_SUBMIT, len(r_dicts)))
     elif not r_dicts:
         return {}  # submitting no ratings = immediate return
 
@@ -271,7 +347,23 @@ def submit_ratings(user_dao, request_dict):
         # fallback for old versions
         id_map = dict([(r['task_id'], r['value']) for r in r_dicts])
     if not len(id_map) == len(r_dicts):
-        pass  # duplicate values
+        raise InvalidAction('each vote can only be submitted once, got %s'
+                            ' submissions for %s votes'
+                            % (len(r_dicts), len(id_map)))
+
+    if lease:
+        unleased_ids = set(id_map.keys()) - set(lease['vote_ids'])
+        if unleased_ids:
+            raise InvalidAction('votes %r are not part of this lease'
+                                % sorted(unleased_ids))
+        _validate_ratings(lease['vote_method'], r_dicts, id_map)
+        ratings = [{'vote_id': vote_id,
+                    'value': value,
+                    'review': review_map.get(vote_id)}
+                   for vote_id, value in id_map.items()]
+        juror_dao.apply_leased_ratings(lease['round_id'], ratings)
+        return {'data': {'lease_token': lease_token,
+                         'acknowledged': sorted(id_map.keys())}}
 
     tasks = juror_dao.get_tasks_by_id(list(id_map.keys()))
     task_map = dict([(t.id, t) for t in tasks])
@@ -285,16 +377,8 @@ def submit_ratings(user_dao, request_dict):
     style = rnd.vote_method
 
     # validation
-    if style == 'rating':
-        invalid = [r for r in id_map.values() if r not in VALID_RATINGS]
-        if invalid:
-            raise InvalidAction('rating expected one of %s, not %r'
-                                % (VALID_RATINGS, sorted(set(invalid))))
-    elif style == 'yesno':
-        invalid = [r not in VALID_YESNO for r in id_map.values()]
-        if not all([r in VALID_YESNO for r in id_map.values()]):
-            raise InvalidAction('yes/no rating expected one of %s, not %r'
-                                % (VALID_YESNO, sorted(set(invalid))))
+    if style in ('rating', 'yesno'):
+        _validate_ratings(style, r_dicts, id_map)
     elif style == 'ranking':
         invalid = [r for r in id_map.values() if r != int(r) or r < 0]
         if invalid:
@@ -313,10 +397,10 @@ def submit_ratings(user_dao, request_dict):
                                 % (len_rnd_entries, len(id_map)))
 
     if style in ('rating', 'yesno'):
-        for t in tasks:
-            val = id_map[t.id]
-            review = review_map.get(t.id)
-            juror_dao.edit_rating(t, val, review=review)
+        ratings = [{'vote': t,
+                    'value': id_map[t.id],
+                    'review': review_map.get(t.id)} for t in tasks]
+        juror_dao.apply_ratings(ratings)
 
     elif style == 'ranking':
         # This part is designed to support ties ok though
@@ -327,12 +411,13 @@ def submit_ratings(user_dao, request_dict):
         """
         ballot = []
         is_edit = False
-        for rd in r_dicts:
-            cur = dict(rd)
-            vote_id = rd.get('vote_id')
-            if not vote_id:
-                vote_id = rd.get('task_id')  # fallback for old versions of the client
-            cur['vote'] = task_map[vote_id]
+        for vote_id, value in id_map.items():
+            if vote_id not in task_map:
+                raise InvalidAction('vote %s does not exist for this user'
+                                    % vote_id)
+            cur = {'vote': task_map[vote_id],
+                   'value': value,
+                   'review': review_map.get(vote_id)}
             if cur['vote'].status == 'complete':
                 is_edit = True
             elif is_edit:
@@ -343,6 +428,24 @@ def submit_ratings(user_dao, request_dict):
 
     return {}  # TODO?
 
+
+def _validate_ratings(style, r_dicts, id_map):
+    "Checks a rating or yes/no round submission's size and values."
+    if len(r_dicts) > MAX_RATINGS_SUBMIT:
+        raise InvalidAction('can submit up to %s ratings at once, not %r'
+                            % (MAX_RATINGS_SUBMIT, len(r_dicts)))
+    if style == 'rating':
+        invalid = [r for r in id_map.values() if r not in VALID_RATINGS]
+        if invalid:
+            raise InvalidAction('rating expected one of %s, not %r'
+                                % (VALID_RATINGS, sorted(set(invalid))))
+    elif style == 'yesno':
+        invalid = [r for r in id_map.values() if r not in VALID_YESNO]
+        if invalid:
+            raise InvalidAction('yes/no rating expected one of %s, not %r'
+                                % (VALID_YESNO, sorted(set(invalid))))
+    return
+
 def skip_rating(user_dao, round_id, request, request_dict):
     juror_dao = JurorDAO(user_dao)
     
@@ -1,5 +1,11 @@
 from __future__ import absolute_import
 import os
+import threading
+
+from boltons.iterutils import chunked_iter
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.pool import QueuePool
 
 try:
     import pymysql
@@ -9,6 +15,21 @@ except ImportError:
 
 DB_CONFIG = os.path.expanduser('~/replica.my.cnf')
 
+# All replica queries share one pool of connections per process,
+# rather than connecting per query. The replicas close idle
+# connections, hence the recycling and the ping on checkout.
+REPLICA_POOL_SIZE = 4
+REPLICA_POOL_MAX_OVERFLOW = 4
+REPLICA_POOL_RECYCLE = 300  # seconds
+REPLICA_POOL_TIMEOUT = 30  # seconds to wait for a free connection
+
+# Filenames per IN (...) lookup; Commons filenames run up to 240
+# bytes, so this stays well under max_allowed_packet.
+FILE_INFO_CHUNK_SIZE = 500
+
+_replica_pool = None
+_replica_pool_lock = threading.Lock()
+
 
 FILE_COLS = ['fr.fr_width AS img_width',
              'fr.fr_height AS img_height',
@@ -46,7 +67,7 @@ class MissingMySQLClient(RuntimeError):
     pass
 
 
-def fetchall_from_commonswiki(query, params):
+def connect_commonswiki():
     if pymysql is None:
         raise MissingMySQLClient('could not import pymysql, check your'
                                  ' environment and restart the service')
@@ -56,16 +77,80 @@ def fetchall_from_commonswiki(query, params):
                                  host=db_host,
                                  read_default_file=DB_CONFIG,
                                  charset='utf8')
-    cursor = connection.cursor(pymysql.cursors.DictCursor)
-    cursor.execute(query, params)
-    res = cursor.fetchall()
+    return connection
+
+
+def _ping_replica_connection(dbapi_connection, connection_record,
+                             connection_proxy):
+    # health check on checkout; raising DisconnectionError makes the
+    # pool discard the connection and retry with a fresh one
+    try:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+    except Exception:
+        raise DisconnectionError()
+
+
+def make_replica_pool(connect=None,
+                      size=REPLICA_POOL_SIZE,
+                      max_overflow=REPLICA_POOL_MAX_OVERFLOW,
+                      recycle=REPLICA_POOL_RECYCLE,
+                      timeout=REPLICA_POOL_TIMEOUT):
+    """Build a pool of replica connections. *connect* is a
+    zero-argument callable returning a DB-API connection, defaulting
+    to connect_commonswiki. Any DB-API module works, e.g., sqlite3 for
+    testing without the wikireplicas.
+    """
+    pool = QueuePool(connect or connect_commonswiki,
+                     pool_size=size,
+                     max_overflow=max_overflow,
+                     recycle=recycle,
+                     timeout=timeout)
+    event.listen(pool, 'checkout', _ping_replica_connection)
+    return pool
+
+
+def configure_replica_pool(**kw):
+    """Replace the shared replica pool, e.g., with different sizing
+    from the app config, or a local stand-in. Takes the same
+    arguments as make_replica_pool().
+    """
+    global _replica_pool
+    new_pool = make_replica_pool(**kw)
+    with _replica_pool_lock:
+        old_pool, _replica_pool = _replica_pool, new_pool
+    if old_pool is not None:
+        old_pool.dispose()
+    return new_pool
+
+
+def get_replica_pool():
+    global _replica_pool
+    with _replica_pool_lock:
+        if _replica_pool is None:
+            _replica_pool = make_replica_pool()
+        return _replica_pool
+
+
+def fetchall_from_commonswiki(query, params):
+    connection = get_replica_pool().connect()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        col_names = [col[0] for col in cursor.description]
+        res = cursor.fetchall()
+        cursor.close()
+    finally:
+        # returns the connection to the pool
+        connection.close()
 
     # looking at the schema on labs, it's all varbinary, not varchar,
     # so this block converts values
     ret = []
     for rec in res:
         new_rec = {}
-        for k, v in rec.items():
+        for k, v in zip(col_names, rec):
             if isinstance(v, bytes):
                 v = v.decode('utf8')
             new_rec[k] = v
@@ -98,8 +183,17 @@ def get_files(category_name):
     return fetchall_from_commonswiki(query, params)
 
 
-def get_file_info(filename):
-    query = '''
+def _normalize_filename(filename):
+    return filename.replace(' ', '_')
+
+
+def get_files_info(filenames, chunk_size=FILE_INFO_CHUNK_SIZE):
+    """Look up file info for many filenames, one query per chunk of
+    *chunk_size* names. Returns a tuple of (file_infos, no_info),
+    where file_infos follows the order of *filenames* (duplicates
+    dropped) and no_info lists the names which were not found.
+    """
+    query_tmpl = '''
         SELECT {cols}
         FROM commonswiki_p.file AS file
         JOIN commonswiki_p.filerevision AS fr ON fr.fr_id = file.file_latest
@@ -107,14 +201,39 @@ def get_file_info(filename):
         LEFT JOIN actor AS ci ON fr.fr_actor = ci.actor_id
         LEFT JOIN commonswiki_p.filetypes AS ft ON file.file_type = ft.ft_id
         {earliest_rev}
-        WHERE file.file_name = %s
+        WHERE file.file_name IN ({placeholders})
           AND file.file_deleted = 0
-    '''.format(cols=', '.join(FILE_COLS),
-               earliest_rev=_EARLIEST_REVISION_SUBQUERY)
-    params = (filename.replace(' ', '_'),)
-    results = fetchall_from_commonswiki(query, params)
-    if results:
-        return results[0]
+    '''
+    db_names = []
+    seen = set()
+    for filename in filenames:
+        db_name = _normalize_filename(filename)
+        if db_name in seen:
+            continue
+        seen.add(db_name)
+        db_names.append((filename, db_name))
+
+    info_map = {}
+    for names_chunk in chunked_iter([n for _, n in db_names], chunk_size):
+        query = query_tmpl.format(cols=', '.join(FILE_COLS),
+                                  earliest_rev=_EARLIEST_REVISION_SUBQUERY,
+                                  placeholders=', '.join(['%s'] * len(names_chunk)))
+        for file_info in fetchall_from_commonswiki(query, tuple(names_chunk)):
+            info_map.setdefault(file_info['img_name'], file_info)
+
+    file_infos, no_info = [], []
+    for filename, db_name in db_names:
+        if db_name in info_map:
+            file_infos.append(info_map[db_name])
+        else:
+            no_info.append(filename)
+    return file_infos, no_info
+
+
+def get_file_info(filename):
+    file_infos, _ = get_files_info([filename])
+    if file_infos:
+        return file_infos[0]
     else:
         return None
 
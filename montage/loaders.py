@@ -2,19 +2,38 @@
 from __future__ import absolute_import
 import datetime
 
-from io import BytesIO, StringIO
+import itertools
 import json
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
 
 from boltons.iterutils import chunked_iter
 from unicodecsv import DictReader
 
 import montage.rdb  # TODO: circular import
-from .labs import get_files, get_file_info
-from .utils import unicode, requests_get, requests_post
+from .labs import get_files, get_files_info
+from .utils import (requests_get,
+                    requests_post,
+                    make_requests_session)
 
 REMOTE_UTILS_URL = 'https://montage.toolforge.org/v1/utils/'
 
+# Remote filename lookups are fetched a few chunks at a time over a
+# shared session. Failed chunks are retried with exponential backoff.
+REMOTE_FETCH_WORKERS = 4
+REMOTE_FETCH_RETRIES = 3
+REMOTE_FETCH_BACKOFF = 1.0  # seconds, doubled on each retry
+REMOTE_FETCH_TIMEOUT = 60  # seconds
+
+# CSV imports are streamed: downloaded this many bytes at a time,
+# with filenames looked up in batches of this many names
+CSV_STREAM_CHUNK_SIZE = 64 * 1024
+NAME_LOOKUP_BATCH_SIZE = 1000
+IMPORT_PROGRESS_INTERVAL = 1000  # rows
+
 GSHEET_URL = 'https://docs.google.com/spreadsheets/d/%s/gviz/tq?tqx=out:csv'
 
 CSV_FULL_COLS = ['img_name',
@@ -77,123 +96,169 @@ def make_entry(edict):
     return montage.rdb.Entry(**raw_entry)
 
 
-def load_full_csv(csv_file_obj, source='remote'):
-    # TODO: streaming this for big CSVs is an unnecessary headache
-
-    ret = []
-    warnings = []
-
-    dr = DictReader(csv_file_obj)
-
-    if 'filename' in dr.fieldnames:
-        return load_partial_csv(dr, source=source)
-
-    for key in CSV_FULL_COLS:
-        if key not in dr.fieldnames:
-            raise ValueError('missing required column "%s" in csv file' % key)
-
-    for edict in dr:
+def iter_response_lines(resp, chunk_size=CSV_STREAM_CHUNK_SIZE):
+    """Yield the lines of a streamed requests response as bytes, line
+    endings included, without holding the whole body in memory."""
+    pending = b''
+    for chunk in resp.iter_content(chunk_size):
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+
+def _clean_filename(filename, strip_quotes=False):
+    if isinstance(filename, bytes):
+        filename = filename.decode('utf8')
+    filename = filename.strip()
+    if strip_quotes:
+        filename = filename.strip('"')
+    if filename.startswith('File:'):
+        filename = filename[5:]
+    return filename
+
+
+def _make_entries(edicts, warnings):
+    for edict in edicts:
         try:
             entry = make_entry(edict)
-        except TypeError as e:
+        except (TypeError, ValueError) as e:
             warnings.append((edict, e))
         else:
-            ret.append(entry)
-
-    return ret, warnings
+            yield entry
 
 
-def load_partial_csv(dr, source='remote'):
-    ret = []
-    warnings = []
-    file_names = [r['filename'] for r in dr]
-    if not file_names or isinstance(file_names[0], unicode):
-        file_names_obj = StringIO('\n'.join(file_names))
+def _lookup_filenames(filenames, source, warnings,
+                      batch_size=NAME_LOOKUP_BATCH_SIZE):
+    # the lookups themselves are chunked further, this just bounds
+    # how many names are held at once
+    for filenames_batch in chunked_iter(filenames, batch_size):
+        if source == 'remote':
+            file_infos, no_info = get_by_filename_remote(filenames_batch)
+        else:
+            file_infos, no_info = get_files_info(filenames_batch)
+        warnings.extend(no_info or [])
+        for file_info in file_infos:
+            yield file_info
+
+
+def _track_progress(rows, on_progress, interval=IMPORT_PROGRESS_INTERVAL):
+    count = 0
+    for row in rows:
+        count += 1
+        if on_progress and not count % interval:
+            on_progress(count)
+        yield row
+    if on_progress and count % interval:
+        on_progress(count)
+
+
+def iter_entries_from_lines(lines, source='local', warnings=None,
+                            on_progress=None, strip_quotes=False):
+    """Generate Entries from an iterable of CSV lines, in a pipeline:
+    rows are parsed, files are looked up if need be, and entries are
+    built and validated one batch at a time, so memory stays bounded
+    no matter the size of the CSV.
+
+    Three formats are accepted: a full CSV with all of CSV_FULL_COLS,
+    a CSV with a "filename" column, or a bare list of filenames, one
+    per line. Rows which can't be made into entries are appended to
+    *warnings*, and *on_progress* is called with the count of rows
+    read every IMPORT_PROGRESS_INTERVAL rows, and once at the end.
+    """
+    if warnings is None:
+        warnings = []
+    lines = iter(lines)
+    first_line = next(lines, None)
+    if first_line is None:
+        return
+    dr = DictReader(itertools.chain([first_line], lines))
+    fieldnames = dr.fieldnames or []
+
+    if 'filename' in fieldnames:
+        rows = _track_progress(dr, on_progress)
+        filenames = (_clean_filename(r['filename']) for r in rows)
+        edicts = _lookup_filenames((fn for fn in filenames if fn),
+                                   source, warnings)
+    elif all(key in fieldnames for key in CSV_FULL_COLS):
+        edicts = _track_progress(dr, on_progress)
     else:
-        file_names_obj = BytesIO(b'\n'.join(file_names))
-
-    return load_name_list(file_names_obj, source=source)
-
-
-def load_name_list(file_obj, source='local'):
-    """ Just the file names, and we'll look up the rest"""
-
-    ret = []
-    warnings = []
+        # no header, just the file names, and we'll look up the rest
+        rows = _track_progress(itertools.chain([first_line], lines),
+                               on_progress)
+        filenames = (_clean_filename(r, strip_quotes) for r in rows)
+        edicts = _lookup_filenames((fn for fn in filenames if fn),
+                                   source, warnings)
 
-    rl = file_obj.readlines()
+    for entry in _make_entries(edicts, warnings):
+        yield entry
 
-    # clean up the filenames
-    for i, filename in enumerate(rl):
-        if isinstance(filename, bytes):
-            filename = filename.decode('utf8')
-        filename = filename.strip()
-        if filename.startswith('File:'):
-            filename = filename[5:]
-        rl[i] = filename
 
-    edicts = []
-
-    if source == 'remote':
-        edicts, warnings = get_by_filename_remote(rl)
+def open_csv_lines(raw_url):
+    """Start downloading a CSV from a Google Sheet or a GitHub gist,
+    returning an iterator over its lines. Raises a ValueError if the
+    URL isn't usable."""
+    if 'google.com' in raw_url:
+        doc_id = parse_doc_id(raw_url)
+        resp = requests_get(GSHEET_URL % doc_id, stream=True)
+        if not 'text/csv' in resp.headers['content-type']:
+            resp.close()
+            raise ValueError('cannot load Google Sheet "%s" (is link sharing on?)' % raw_url)
     else:
-        for filename in rl:
-            file_info = get_file_info(filename)
-            if file_info is not None:
-                edict, warnings = file_info
-                edicts.append(edict)
+        if 'githubusercontent' not in raw_url:
+            raw_url = raw_url.replace('gist.github.com',
+                                      'gist.githubusercontent.com') + '/raw'
+        resp = requests_get(raw_url, stream=True)
+    return iter_response_lines(resp)
+
+
+def iter_entries_from_csv(raw_url, source='local', warnings=None,
+                          on_progress=None):
+    """Stream Entries out of the CSV at *raw_url*. The download starts
+    (and any ValueError is raised) before this returns, but entries are
+    only read as the returned generator is consumed. See
+    iter_entries_from_lines() for the rest."""
+    lines = open_csv_lines(raw_url)
+    # Sheets quote every field, even in one-column filename lists
+    strip_quotes = 'google.com' in raw_url
+    return iter_entries_from_lines(lines,
+                                   source=source,
+                                   warnings=warnings,
+                                   on_progress=on_progress,
+                                   strip_quotes=strip_quotes)
 
-    for edict in edicts:
-        try:
-            entry = make_entry(edict)
-        except TypeError as e:
-            warnings.append((edict, e))
-        else:
-            ret.append(entry)
 
+def load_full_csv(csv_file_obj, source='remote'):
+    warnings = []
+    ret = list(iter_entries_from_lines(csv_file_obj,
+                                       source=source,
+                                       warnings=warnings))
     return ret, warnings
 
-def get_entries_from_csv(raw_url, source='local'):
-    if 'google.com' in raw_url:
-        return get_entries_from_gsheet(raw_url, source)
-    return get_entries_from_gist(raw_url, source)
-
-def get_entries_from_gist(raw_url, source='local'):
-    if 'githubusercontent' not in raw_url:
-        raw_url = raw_url.replace('gist.github.com',
-                                  'gist.githubusercontent.com') + '/raw'
-    resp = requests_get(raw_url)
-
-    try:
-        ret, warnings = load_full_csv(BytesIO(resp.content))
-    except ValueError as e:
-        # not a full csv
-        ret, warnings = load_name_list(BytesIO(resp.content), source=source)
 
+def load_name_list(file_obj, source='local'):
+    """ Just the file names, and we'll look up the rest"""
+    warnings = []
+    filenames = (_clean_filename(fn) for fn in file_obj)
+    edicts = _lookup_filenames((fn for fn in filenames if fn),
+                               source, warnings)
+    ret = list(_make_entries(edicts, warnings))
     return ret, warnings
 
 
-def get_entries_from_gsheet(raw_url, source='local'):
-    #TODO: add support for sheet tabs
-    doc_id = parse_doc_id(raw_url)
-    url = GSHEET_URL % doc_id
-    resp = requests_get(url)
+def get_entries_from_csv(raw_url, source='local'):
+    warnings = []
+    ret = list(iter_entries_from_csv(raw_url,
+                                     source=source,
+                                     warnings=warnings))
+    return ret, warnings
 
-    if not 'text/csv' in resp.headers['content-type']:
-        raise ValueError('cannot load Google Sheet "%s" (is link sharing on?)' % raw_url)
 
-    try:
-        ret, warnings = load_full_csv(BytesIO(resp.content), source=source)
-    except ValueError:
-        try:
-            ret, warnings = load_partial_csv(resp)  # TODO: load_partial_csv expects a dictreader, did this ever work?
-        except (ValueError, TypeError):
-            resp_content = resp.content.decode('utf8')
-            file_names = [fn.strip('\"') for fn in resp_content.split('\n')]
-            file_names_obj = StringIO('\n'.join(file_names))
-            ret, warnings = load_name_list(file_names_obj, source=source)
-
-    return ret, warnings
+get_entries_from_gist = get_entries_from_csv
+get_entries_from_gsheet = get_entries_from_csv
 
 
 def load_by_filename(filenames, source='local'):
@@ -202,16 +267,12 @@ def load_by_filename(filenames, source='local'):
     if source == 'remote':
         files, warnings = get_by_filename_remote(filenames)
     else:
-        files = []
-        for filename in filenames:
-            file_info = get_file_info(filename)
-            if file_info is not None:
-                files.append(file_info)
-            else:
-                warnings.append(
-                    'file "%s" does not exist, please check that its name is spelled correctly, '
-                    'that it has not been renamed or removed' % (filename,)
-                )
+        files, no_info = get_files_info(filenames)
+        for filename in no_info:
+            warnings.append(
+                'file "%s" does not exist, please check that its name is spelled correctly, '
+                'that it has not been renamed or removed' % (filename,)
+            )
     for edict in files:
         entry = make_entry(edict)
         entries.append(entry)
@@ -237,23 +298,61 @@ def get_from_category_remote(category_name):
     file_infos, _ = get_from_remote(url, params)
     return file_infos
 
-def get_from_remote(url, params):
+def get_from_remote(url, params, session=None):
     headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
     data = json.dumps(params)
-    response = requests_post(url, data=data, headers=headers)
+    if session is None:
+        response = requests_post(url, data=data, headers=headers)
+    else:
+        response = session.post(url, data=data, headers=headers,
+                                timeout=REMOTE_FETCH_TIMEOUT)
+        response.raise_for_status()
     resp_json = response.json()
     file_infos = resp_json['file_infos']
     no_infos = resp_json.get('no_info')
     return file_infos, no_infos
 
 
-def get_by_filename_remote(filenames, chunk_size=200):
+def _get_from_remote_with_retry(url, params, session,
+                                retries=REMOTE_FETCH_RETRIES,
+                                backoff=REMOTE_FETCH_BACKOFF):
+    for attempt in range(retries + 1):
+        try:
+            return get_from_remote(url, params, session=session)
+        except requests.HTTPError as e:
+            if attempt >= retries or e.response.status_code < 500:
+                raise
+        except (requests.ConnectionError, requests.Timeout, ValueError):
+            # ValueError covers truncated or otherwise undecodable JSON
+            if attempt >= retries:
+                raise
+        time.sleep(backoff * (2 ** attempt))
+
+
+def get_by_filename_remote(filenames, chunk_size=200,
+                           max_workers=REMOTE_FETCH_WORKERS,
+                           backoff=REMOTE_FETCH_BACKOFF):
     file_infos = []
     warnings = []
-    for filenames_chunk in chunked_iter(filenames, chunk_size):
-        params = {'names': filenames_chunk}
-        url = REMOTE_UTILS_URL + '/file'
-        resp, no_infos = get_from_remote(url, params)
+    url = REMOTE_UTILS_URL + '/file'
+    chunks = list(chunked_iter(filenames, chunk_size))
+    if not chunks:
+        return file_infos, warnings
+
+    def fetch_chunk(filenames_chunk):
+        return _get_from_remote_with_retry(url, {'names': filenames_chunk},
+                                           session, backoff=backoff)
+
+    # executor.map yields results in chunk order, regardless of which
+    # request finishes first
+    session = make_requests_session()
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            results = list(executor.map(fetch_chunk, chunks))
+    finally:
+        session.close()
+
+    for resp, no_infos in results:
         if no_infos:
             warnings += no_infos
         file_infos += resp
@@ -116,7 +116,7 @@ def post_frontend_error_log(user, config, request_dict):
     now_str = now.isoformat()
 
     username = user.username if user else '<nouser>'
-    err_str = json.dumps(request_dict, sort_keys=True, indent=2)
+    err_str = json.dumps(dict(request_dict or {}), sort_keys=True, indent=2)
     err_str = indent(err_str, '  ')
     with open(feel_path, 'a') as feel_file:
         feel_file.write('Begin error at %s:\n\n' % now_str)
@@ -1,20 +1,32 @@
 
 from __future__ import absolute_import
+import os
+import sys
 import json
 import time
+import atexit
 import os.path
 import datetime
+import threading
+import contextvars
+from collections import Counter
+from collections.abc import MutableMapping
 
 import clastic
-from clastic import Middleware, BaseResponse
+from clastic import Middleware, BaseResponse, Response
 from clastic.route import NullRoute
-from clastic.render import render_basic
+from clastic.errors import RequestEntityTooLarge
+from clastic.render import BasicRender
 from boltons.tbutils import ExceptionInfo
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import set_committed_value
 
-from montage.rdb import User, UserDAO
+from montage.rdb import User, UserDAO, UserCache, update_last_active_dates
 from montage.utils import MontageError, basestring
+from montage.simple_serdes import json_dumps, json_loads, json_default
 
 from .sqlprof import SQLProfilerMiddleware
+from .logwriter import BufferedLogWriter, BufferedLogEmitter
 
 
 def public(endpoint_func):
@@ -25,6 +37,100 @@ def public(endpoint_func):
 
     return endpoint_func
 
+def _api_json_default(obj):
+    try:
+        return json_default(obj)
+    except TypeError:
+        return repr(obj)  # as clastic's renderer does in dev_mode
+
+
+def render_json(context):
+    resp = Response(json_dumps(context, default=_api_json_default),
+                    mimetype='application/json')
+    resp.mimetype_params['charset'] = 'utf-8'
+    return resp
+
+
+# same content negotiation as clastic's render_basic, with a faster,
+# compact JSON renderer
+render_basic = BasicRender(json_render=render_json)
+
+
+REQUEST_BODY_MAX_SIZE = 16 * 1024 * 1024  # bytes
+
+
+class LazyRequestDict(MutableMapping):
+    """The request's JSON body, if any, updated with the query string
+    arguments. The body is only read and parsed the first time the
+    mapping is used, so requests whose endpoints never look at
+    request_dict (and bodiless GETs) never go through the JSON parser.
+
+    Bodies over *max_body_size* bytes raise a 413, and bodies that
+    aren't JSON objects are ignored.
+    """
+    def __init__(self, request, max_body_size=REQUEST_BODY_MAX_SIZE):
+        self.request = request
+        self.max_body_size = max_body_size
+        self._data = None
+
+    @property
+    def is_loaded(self):
+        return self._data is not None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._load()
+        return self._data
+
+    def _read_body(self):
+        request = self.request
+        too_large_msg = 'request body may not exceed %s bytes' % self.max_body_size
+        if request.content_length is not None:
+            if request.content_length > self.max_body_size:
+                raise RequestEntityTooLarge(too_large_msg)
+            return request.get_data()
+        # no Content-Length (e.g., chunked), so read one byte past the
+        # limit to tell whether it was reached
+        body = request.stream.read(self.max_body_size + 1)
+        if len(body) > self.max_body_size:
+            raise RequestEntityTooLarge(too_large_msg)
+        return body
+
+    def _load(self):
+        ret = {}
+        raw_body = self._read_body()
+        if raw_body:
+            try:
+                body = json_loads(raw_body)
+            except Exception:
+                body = None
+            if isinstance(body, dict):
+                ret.update(body)
+        ret.update(self.request.args.items())
+        return ret
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        if self._data is None:
+            return '<%s (not loaded)>' % self.__class__.__name__
+        return '<%s %r>' % (self.__class__.__name__, self._data)
+
+
 class MessageMiddleware(Middleware):
     """Manages the data format consistency and serialization for all
     endpoints.
@@ -36,25 +142,16 @@ class MessageMiddleware(Middleware):
     """
     provides = ('response_dict', 'request_dict')
 
-    def __init__(self, raise_errors=True, use_ashes=False, debug_errors=False):
+    def __init__(self, raise_errors=True, use_ashes=False, debug_errors=False,
+                 max_body_size=REQUEST_BODY_MAX_SIZE):
         self.raise_errors = raise_errors
         self.use_ashes = use_ashes
         self.debug_errors = debug_errors
+        self.max_body_size = max_body_size
 
     def request(self, next, request):
         response_dict = {'errors': [], 'status': 'success'}
-
-        try:
-            request_data = request.get_data()
-            request_dict = json.loads(request_data)
-        except Exception:
-            request_dict = None
-        if request.args:
-            if request_dict:
-                request_dict.update(list(request.args.items()))
-            else:
-                request_dict = dict(list(request.args.items()))
-
+        request_dict = LazyRequestDict(request, self.max_body_size)
         return next(response_dict=response_dict, request_dict=request_dict)
 
     def endpoint(self, next, response_dict, request, _route):
@@ -100,6 +197,68 @@ class MessageMiddleware(Middleware):
         return ret
 
 
+LAST_ACTIVE_FLUSH_INTERVAL = 30  # seconds
+
+
+class LastActiveFlusher(object):
+    """Collects users' last_active_dates and writes them out in one
+    batch every *interval* seconds, from a background thread, so that
+    serving a request never has to write to the users table.
+
+    Multiple updates for the same user between flushes are coalesced,
+    and anything still pending is written at exit. Like
+    BufferedLogWriter, the thread is started on first use in each
+    process, so this is safe to create before a server forks.
+    """
+    def __init__(self, interval=LAST_ACTIVE_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending = {}  # engine -> {user_id: last_active_date}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def record(self, engine, user_id, last_active_date):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            engine_pending = self._pending.setdefault(engine, {})
+            cur_date = engine_pending.get(user_id)
+            if cur_date is None or cur_date < last_active_date:
+                engine_pending[user_id] = last_active_date
+        return
+
+    def _start(self):
+        # dates pending in a parent process are the parent's to write
+        self._pending = {}
+        self._pid = os.getpid()
+        thread = threading.Thread(target=self._run,
+                                  name='last_active_flusher')
+        thread.daemon = True
+        thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            pending, self._pending = self._pending, {}
+        for engine, last_active_map in pending.items():
+            try:
+                with engine.begin() as conn:
+                    update_last_active_dates(conn, last_active_map)
+            except Exception:
+                sys.stderr.write('failed to write last active dates in %s\n'
+                                 % os.getpid())
+                sys.stderr.flush()
+                for user_id, last_active_date in last_active_map.items():
+                    self.record(engine, user_id, last_active_date)
+        return
+
+
 class UserMiddleware(Middleware):
     """The UserMiddleware looks up the logged in user and provides a
     database interface (UserDAO). Sessions are authenticated through
@@ -112,6 +271,14 @@ class UserMiddleware(Middleware):
     """
     endpoint_provides = ('user', 'user_dao')
 
+    def __init__(self, user_cache=None, last_active_flusher=None):
+        if user_cache is None:
+            user_cache = UserCache()
+        if last_active_flusher is None:
+            last_active_flusher = LastActiveFlusher()
+        self.user_cache = user_cache
+        self.last_active_flusher = last_active_flusher
+
     def endpoint(self, next, cookie, rdb_session, _route, config,
                  request_dict, response_dict, timings_dict, sentry_scope=None):
         # endpoints are default non-public
@@ -140,7 +307,9 @@ class UserMiddleware(Middleware):
                     response_dict['errors'].append(err)
                     return {}
 
-        user = rdb_session.query(User).filter(User.id == userid).first()
+        # lets the session drop users it modifies from the cache
+        rdb_session.info['user_cache'] = self.user_cache
+        user = self.user_cache.get(rdb_session, userid)
 
         if user is None and not ep_is_public:
             err = 'unknown cookie userid, try logging in again'
@@ -163,8 +332,10 @@ class UserMiddleware(Middleware):
         now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
         last_minute = now - datetime.timedelta(seconds=60)
         if not user.last_active_date or user.last_active_date < last_minute:
-            # updates only up to once a minute
-            user.last_active_date = now
+            # updates only up to once a minute, written in the background
+            self.last_active_flusher.record(rdb_session.get_bind(),
+                                            user.id, now)
+            set_committed_value(user, 'last_active_date', now)
 
         response_dict['user'] = user.to_dict() if user else user
         user_dao = UserDAO(rdb_session=rdb_session, user=user)
@@ -214,16 +385,70 @@ class UserIPMiddleware(Middleware):
 
 
 
+N_PLUS_ONE_THRESHOLD = 25  # executions of the same statement per request
+
+_request_db_stats = contextvars.ContextVar('request_db_stats', default=None)
+
+
+class RequestDBStats(object):
+    "Counts the statements run while serving a request, and their time."
+    def __init__(self):
+        self.query_count = 0
+        self.query_time = 0.0
+        self.statement_counts = Counter()
+
+    def get_most_repeated(self):
+        "Returns the most executed statement and its count, or (None, 0)."
+        if not self.statement_counts:
+            return None, 0
+        return self.statement_counts.most_common(1)[0]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters,
+                           context, executemany):
+    if _request_db_stats.get() is not None:
+        conn.info['query_start_time'] = time.time()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters,
+                          context, executemany):
+    db_stats = _request_db_stats.get()
+    start_time = conn.info.pop('query_start_time', None)
+    if db_stats is None or start_time is None:
+        return
+    db_stats.query_count += 1
+    db_stats.query_time += time.time() - start_time
+    db_stats.statement_counts[statement] += 1
+
+
+def listen_for_request_queries(engine):
+    """Sets up *engine* to count statements and time towards the
+    RequestDBStats of the request being served (see TimingMiddleware).
+    Statements run outside of a request aren't counted.
+    """
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
 class TimingMiddleware(Middleware):
     provides = ('timings_dict',)
 
-    def request(self, next, response_dict):
+    def __init__(self, n_plus_one_threshold=N_PLUS_ONE_THRESHOLD):
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    def request(self, next, response_dict, api_act=None):
         response_dict['timings'] = timings_dict = {}
+        db_stats = RequestDBStats()
+        db_stats_token = _request_db_stats.set(db_stats)
         start_time = time.time()
         try:
             ret = next(timings_dict=timings_dict)
         finally:
+            _request_db_stats.reset(db_stats_token)
             timings_dict['request'] = round(time.time() - start_time, 3)
+            self._add_db_timings(timings_dict, db_stats)
+            if api_act is not None:
+                self._log_db_stats(api_act, db_stats)
         return ret
 
     def endpoint(self, next, timings_dict):
@@ -232,12 +457,31 @@ class TimingMiddleware(Middleware):
             ret = next()
         finally:
             timings_dict['endpoint'] = round(time.time() - start_time, 3)
+            # the request totals also include the commit, but are only
+            # known after the response is rendered
+            db_stats = _request_db_stats.get()
+            if db_stats is not None:
+                self._add_db_timings(timings_dict, db_stats)
         if (isinstance(ret, BaseResponse)
             and getattr(ret, 'mimetype', '').startswith('text/html')
             and isinstance(ret.data, basestring)):
             ret.data += ('<!-- Timings: ' + json.dumps(timings_dict) + ' -->')
         return ret
 
+    def _add_db_timings(self, timings_dict, db_stats):
+        timings_dict['db_queries'] = db_stats.query_count
+        timings_dict['db_time'] = round(db_stats.query_time, 3)
+
+    def _log_db_stats(self, api_act, db_stats):
+        api_act['db_queries'] = db_stats.query_count
+        api_act['db_time_ms'] = round(db_stats.query_time * 1000, 1)
+        statement, count = db_stats.get_most_repeated()
+        if count > self.n_plus_one_threshold:
+            statement = ' '.join(statement.split())
+            if len(statement) > 200:
+                statement = statement[:197] + '...'
+            api_act['n_plus_one_suspected'] = '%sx %s' % (count, statement)
+
 
 class DBSessionMiddleware(Middleware):
     provides = ('rdb_session',)
@@ -252,6 +496,7 @@ class DBSessionMiddleware(Middleware):
         if not self.engine:
             # lazy initialization because uwsgi config
             self.engine = self.get_engine()
+            listen_for_request_queries(self.engine)
             self.session_type.configure(bind=self.engine)
 
         rdb_session = self.session_type()
@@ -271,7 +516,6 @@ class DBSessionMiddleware(Middleware):
 
 
 from lithoxyl import (Logger,
-                      StreamEmitter,
                       SensibleSink,
                       SensibleFilter,
                       SensibleFormatter)
@@ -308,8 +552,7 @@ class LoggingMiddleware(Middleware):
         except Exception:
             exc_info = ExceptionInfo.from_current()
             text = u'\n\n' + exc_info.get_formatted() + '\n\n'
-            self.exc_log_file_obj.write(text.encode('utf8'))
-            self.exc_log_file_obj.flush()
+            self.exc_log_writer.write(text)
             raise
         return ret
 
@@ -322,12 +565,12 @@ class LoggingMiddleware(Middleware):
         return ret
 
     def _setup_api_log(self):
-        self.log_file_obj = open(self.log_path, 'ab')
-        self.exc_log_file_obj = open(self.exc_log_path, 'ab')
+        self.log_writer = BufferedLogWriter(self.log_path)
+        self.exc_log_writer = BufferedLogWriter(self.exc_log_path)
 
         self.api_log = Logger(self.act_name.lower() + '_log')
         self._api_fmtr = SensibleFormatter(API_LOG_FMT)
-        self._api_emtr = StreamEmitter(self.log_file_obj)
+        self._api_emtr = BufferedLogEmitter(self.log_writer)
         self._api_fltr = SensibleFilter(success='info',
                                         failure='debug',
                                         exception='debug')
@@ -336,7 +579,7 @@ class LoggingMiddleware(Middleware):
                                       filters=[self._api_fltr])
         self.api_log.add_sink(self._api_sink)
 
-        self._exc_emtr = StreamEmitter(self.exc_log_file_obj)
+        self._exc_emtr = BufferedLogEmitter(self.exc_log_writer)
         self._exc_fltr = SensibleFilter(success=None,
                                         failure=None,
                                         exception='info')
@@ -353,16 +596,29 @@ import uuid
 import socket
 
 
+def _dump_replay_entry(data):
+    return json.dumps(data, sort_keys=True) + '\n'
+
+
+def _snapshot_request_dict(request_dict, request):
+    "Copies request_dict for the replay log, without loading a lazy one."
+    if request_dict is not None and getattr(request_dict, 'is_loaded', True):
+        return dict(request_dict) or None
+    return dict(request.args.items()) or None
+
+
 class ReplayLogMiddleware(Middleware):
     def __init__(self, log_path):
         self.log_path = os.path.abspath(log_path)
-        self.log_file = open(self.log_path, 'a')
+        # serialization happens on the writer thread
+        self.log_writer = BufferedLogWriter(self.log_path,
+                                            serialize=_dump_replay_entry)
         self.start_timestamp = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None).isoformat()
         self.hostname = socket.gethostname()
 
     def endpoint(self, next, user, request_dict, request):
         cur_id = str(uuid.uuid4())
-        log_file = self.log_file
+        log_writer = self.log_writer
         data = {'id': cur_id,
                 'timestamp': datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None).isoformat(),
                 'start_timestamp': self.start_timestamp,
@@ -370,24 +626,18 @@ class ReplayLogMiddleware(Middleware):
                 'pid': os.getpid(),
                 'path': request.path,
                 'method': request.method,
-                'request_dict': request_dict,
                 'user': getattr(user, 'username', None)}
-        try:
-            log_file.write(json.dumps(data, sort_keys=True) + '\n')
-            log_file.flush()
-        except Exception:
-            sys.stderr.write('failed to write replay log in %s\n'
-                             % os.getpid())
-            sys.stderr.flush()
+        exc_data = None
         try:
             ret = next()
         except Exception as e:
             exc_data = {'id': cur_id, 'exception': repr(e)}
-            try:
-                log_file.write(json.dumps(exc_data, sort_keys=True) + '\n')
-            except Exception:
-                sys.stderr.write('failed to write replay log exc in %s\n'
-                                 % os.getpid())
-                sys.stderr.flush()
             raise
+        finally:
+            # logged once the endpoint is done, so the body can be
+            # included if the endpoint read it, without parsing it here
+            data['request_dict'] = _snapshot_request_dict(request_dict, request)
+            log_writer.write(data)
+            if exc_data:
+                log_writer.write(exc_data)
         return ret
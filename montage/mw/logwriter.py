@@ -0,0 +1,180 @@
+"""
+Buffered log writing for the API, exception, and replay logs.
+
+Request threads only enqueue log entries. A background thread per log
+file serializes them and writes them out in batches, so disk latency
+(and, for the replay log, JSON serialization) stays off the request
+path.
+"""
+
+import os
+import sys
+import time
+import queue
+import atexit
+import threading
+
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 256
+LOG_FLUSH_INTERVAL = 1.0  # seconds
+LOG_CLOSE_TIMEOUT = 5.0  # seconds
+
+_STOP = object()
+
+
+class BufferedLogWriter(object):
+    """Appends entries to the file at *path* from a background thread.
+
+    write() never blocks. Entries are written out in batches of up to
+    *batch_size*, no later than *flush_interval* seconds after the
+    first entry of a batch arrives. If more than *max_size* entries are
+    waiting (i.e., the disk can't keep up), new entries are dropped and
+    counted instead of holding up requests.
+
+    Entries may be text or bytes. If *serialize* is passed, it's called
+    on each entry on the writer thread, and should return text or
+    bytes. Anything still queued is written on close(), which is also
+    registered to run at exit.
+
+    The file, the queue, and the writer thread are only set up on the
+    first write(), and are set up again if write() is called from a
+    different process. That way, a writer created in a pre-forking
+    server's master process (e.g., uWSGI without lazy-apps) still
+    works in every worker.
+    """
+    def __init__(self, path, serialize=None, max_size=LOG_QUEUE_SIZE,
+                 batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL):
+        self.path = os.path.abspath(path)
+        self.serialize = serialize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.written_count = 0
+        self.dropped_count = 0
+        self.error_count = 0
+
+        self.max_size = max_size
+
+        self._pid = None
+        self._queue = None
+        self._file = None
+        self._thread = None
+        self._count_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            # anything queued in the parent process is the parent's to
+            # write, so each process starts with its own queue and thread
+            self.written_count = self.dropped_count = self.error_count = 0
+            self._queue = queue.Queue(maxsize=self.max_size)
+            self._file = open(self.path, 'ab')
+            self._thread = threading.Thread(target=self._run,
+                                            args=(self._queue, self._file),
+                                            name='log_writer:%s' % self.path)
+            self._thread.daemon = True
+            self._thread.start()
+            atexit.register(self.close)
+            self._pid = pid
+        return
+
+    def write(self, entry):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._count_lock:
+                self.dropped_count += 1
+        return
+
+    def flush(self):
+        # entries are flushed by the writer thread after every batch
+        return
+
+    def close(self, timeout=LOG_CLOSE_TIMEOUT):
+        "Writes out everything queued so far and stops the writer thread."
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        return
+
+    def get_stats(self):
+        return {'written': self.written_count,
+                'dropped': self.dropped_count,
+                'errors': self.error_count,
+                'queued': self._queue.qsize() if self._queue else 0}
+
+    def _run(self, log_queue, log_file):
+        stopping = False
+        while not stopping:
+            batch = [log_queue.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(log_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP:
+                stopping = True
+                batch.pop()
+            self._write_batch(log_file, batch)
+        log_file.close()
+        return
+
+    def _write_batch(self, log_file, batch):
+        chunks = []
+        for entry in batch:
+            try:
+                if self.serialize is not None:
+                    entry = self.serialize(entry)
+                if not isinstance(entry, bytes):
+                    entry = entry.encode('utf8', 'backslashreplace')
+            except Exception:
+                self._report_error(1)
+                continue
+            chunks.append(entry)
+        if not chunks:
+            return
+        try:
+            log_file.write(b''.join(chunks))
+            log_file.flush()
+        except Exception:
+            self._report_error(len(chunks))
+        else:
+            with self._count_lock:
+                self.written_count += len(chunks)
+        return
+
+    def _report_error(self, count):
+        with self._count_lock:
+            self.error_count += count
+        sys.stderr.write('failed to write %s entries to %s in %s\n'
+                         % (count, self.path, os.getpid()))
+        sys.stderr.flush()
+
+
+class BufferedLogEmitter(object):
+    "A lithoxyl emitter which hands entries off to a BufferedLogWriter."
+    def __init__(self, writer, sep=os.linesep):
+        self.writer = writer
+        self.sep = sep
+
+    def emit_entry(self, event, entry):
+        self.writer.write(entry + self.sep)
+
+    on_begin = on_warn = on_end = on_comment = emit_entry
+
+    def __repr__(self):
+        return '<%s writer=%r>' % (self.__class__.__name__, self.writer.path)
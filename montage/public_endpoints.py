@@ -3,12 +3,16 @@
 from __future__ import annotations
 
 import os
+import glob
 import datetime
 import json
 from typing import Any, Callable
 
+from boltons.cacheutils import LRU
+from boltons.fileutils import atomic_save, mkdir_p
 from clastic import redirect, render_basic, Response
 from clastic.errors import BadRequest
+from werkzeug.http import is_resource_modified
 from mwoauth import Handshaker, RequestToken
 from markdown import Markdown
 from markdown.extensions.codehilite import CodeHiliteExtension
@@ -17,7 +21,7 @@ from sqlalchemy import text
 
 from .mw import public
 from .rdb import User, PublicDAO
-from .labs import get_files, get_file_info
+from .labs import get_files, get_files_info
 
 from .utils import get_env_name, DoesNotExist, InvalidAction
 
@@ -35,13 +39,20 @@ MD_EXTENSIONS = ['markdown.extensions.def_list',
 
 env_name = get_env_name()
 
+REPORT_TEMPLATE = 'report.html'
+REPORT_CACHE_SIZE = 32
+
+# published reports only change on (re)publish, which bumps their
+# modified_date, so rendered reports are keyed by (campaign_id, modified_date)
+_report_cache = LRU(max_size=REPORT_CACHE_SIZE)
+
 
 def get_public_routes() -> tuple[list[Any], list[Any]]:
     ui = [('/', home),
           ('/login', login),
           ('/logout', logout),
           ('/complete_login', complete_login),
-          ('/campaign/<campaign_id:int>', get_report, 'report.html'),
+          ('/campaign/<campaign_id:int>', get_report),
           ('/docs/<path*>', get_doc, render_basic)]
     api = [('/campaign', get_all_reports),
            ('/series/<series_id?int>', get_series),
@@ -128,14 +139,7 @@ def get_files_info_by_name(request_dict: dict[str, Any]) -> dict[str, list[Any]]
         file_names = request_dict['names']
     except Exception:
         raise InvalidAction('must provide a list of names')
-    files = []
-    no_info = []
-    for file_name in file_names:
-        file_info = get_file_info(file_name)
-        if not file_info:
-            no_info.append(file_name)
-        else:
-            files.append(file_info)
+    files, no_info = get_files_info(file_names)
     return {'file_infos': files,
             'no_info': no_info}
 
@@ -245,15 +249,88 @@ def get_entry_info(rdb_session: Any, entry_name: str) -> dict[str, Any]:
     return {'data': ret}
 
 
+def get_report_date(report: Any) -> datetime.datetime:
+    return report.modified_date or report.create_date
+
+
+def get_report_etag(report: Any) -> str:
+    report_date = get_report_date(report)
+    return 'report-%s-%s' % (report.campaign_id,
+                             report_date.strftime('%Y%m%d%H%M%S'))
+
+
+def _get_report_html_path(config: dict[str, Any], report: Any) -> str | None:
+    report_html_dir = config.get('report_html_path')
+    if not report_html_dir:
+        return None
+    return os.path.join(report_html_dir, '%s.html' % get_report_etag(report))
+
+
+def render_report_html(ashes_renderer: Callable, report: Any) -> str:
+    ctx = dict(report.summary)
+    ctx['use_ashes'] = True
+    return ashes_renderer.env.render(REPORT_TEMPLATE, ctx)
+
+
+def save_report_html(config: dict[str, Any], ashes_renderer: Callable,
+                     report: Any) -> str | None:
+    """Pre-render a published report to the configured report_html_path,
+    clearing out any earlier renderings of that campaign's report.
+    """
+    html_path = _get_report_html_path(config, report)
+    if not html_path:
+        return None
+    html = render_report_html(ashes_renderer, report)
+    mkdir_p(os.path.dirname(html_path))
+    with atomic_save(html_path, text_mode=True) as f:
+        f.write(html)
+    stale_glob = 'report-%s-*.html' % report.campaign_id
+    for stale_path in glob.glob(os.path.join(os.path.dirname(html_path),
+                                             stale_glob)):
+        if stale_path != html_path:
+            os.remove(stale_path)
+    _report_cache[(report.campaign_id, get_report_date(report))] = html
+    return html_path
+
+
+def get_report_html(config: dict[str, Any], ashes_renderer: Callable,
+                    report: Any) -> str:
+    cache_key = (report.campaign_id, get_report_date(report))
+    try:
+        return _report_cache[cache_key]
+    except KeyError:
+        pass
+    html = None
+    html_path = _get_report_html_path(config, report)
+    if html_path:
+        try:
+            with open(html_path, 'r', encoding='utf-8') as f:
+                html = f.read()
+        except OSError:
+            pass
+    if html is None:
+        html = render_report_html(ashes_renderer, report)
+    _report_cache[cache_key] = html
+    return html
+
+
 @public
-def get_report(rdb_session: Any, campaign_id: int) -> dict[str, Any]:
+def get_report(rdb_session: Any, request: Any, config: dict[str, Any],
+               ashes_renderer: Callable, campaign_id: int) -> Response:
     dao = PublicDAO(rdb_session)
     report = dao.get_report(campaign_id)
     if not report:
         raise DoesNotExist('no report for this campaign')
-    ctx = report.summary
-    ctx['use_ashes'] = True
-    return ctx
+    etag, report_date = get_report_etag(report), get_report_date(report)
+    if is_resource_modified(request.environ, etag=etag,
+                            last_modified=report_date):
+        html = get_report_html(config, ashes_renderer, report)
+        resp = Response(html, mimetype='text/html')
+    else:
+        resp = Response(status=304)
+    resp.set_etag(etag)
+    resp.last_modified = report_date
+    return resp
 
 
 @public
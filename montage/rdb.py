@@ -3,17 +3,17 @@
 # Relational database models for Montage
 from __future__ import absolute_import
 from __future__ import print_function
+import copy
 import json
 import time
+import threading
 import random
 import datetime
 import itertools
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict, defaultdict
 from math import ceil
 from itertools import zip_longest
 
-from py3votecore.schulze_npr import SchulzeNPR
-
 from sqlalchemy import (Text,
                         Column,
                         String,
@@ -24,16 +24,28 @@ from sqlalchemy import (Text,
                         DateTime,
                         TIMESTAMP,
                         ForeignKey,
-                        inspect)
-from sqlalchemy.sql import func, asc
-from sqlalchemy.orm import relationship, joinedload
-from sqlalchemy.sql.expression import select
+                        Index,
+                        inspect,
+                        event,
+                        type_coerce)
+from sqlalchemy.sql import func, asc, case
+from sqlalchemy.orm import (relationship, joinedload, defer, Session,
+                            sessionmaker, make_transient_to_detached)
+from sqlalchemy.sql.expression import (select,
+                                      bindparam,
+                                      or_,
+                                      and_,
+                                      exists,
+                                      literal)
+from sqlalchemy.dialects import mysql, postgresql
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.util import identity_key
 
 from boltons.strutils import slugify
-from boltons.iterutils import chunked, first, unique_iter, bucketize
+from boltons.cacheutils import LRU
+from boltons.iterutils import chunked, chunked_iter, first, unique_iter, bucketize
 from boltons.statsutils import mean
 
 from clastic.errors import Forbidden
@@ -50,6 +62,7 @@ from .utils import (format_date,
                     js_isoparse)
 
 from .imgutils import make_mw_img_url
+from .schulze import get_schulze_npr_order
 from . import loaders
 from .simple_serdes import DictableBase, JSONEncodedDict
 
@@ -58,6 +71,15 @@ Base = declarative_base(cls=DictableBase)
 ONE_MEGAPIXEL = 1e6
 DEFAULT_MIN_RESOLUTION = 2 * ONE_MEGAPIXEL
 IMPORT_CHUNK_SIZE = 200
+TASK_INSERT_CHUNK_SIZE = 1000
+ENTRY_UPSERT_CHUNK_SIZE = 1000
+EXPORT_CHUNK_SIZE = 1000
+# Most entries a ranking round will take. Jurors submit a ranking all
+# at once, and juror_endpoints sizes ranking submissions to match. A
+# worst-case (random ballots) Schulze NPR tally of 100 entries takes
+# about 2s in pure Python and 0.1s with numpy; 200 would take 25s
+# without numpy.
+RANKING_MAX = 100
 UPPERCASE = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 
 # By default, srounds will support all the file types allowed on
@@ -65,6 +87,15 @@ UPPERCASE = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 DEFAULT_ALLOWED_FILETYPES = ['jpeg', 'png', 'gif', 'svg', 'tiff',
                              'xcf', 'webp']
 
+# Autodisqualification rules, in the order they are applied. Each has
+# a dq_by_<rule> round config flag.
+AUTODQ_RULES = ('upload_date', 'resolution', 'uploader', 'filetype')
+# audit log action names, which predate the rule names
+AUTODQ_LOG_ACTIONS = {'upload_date': 'autodisqualify_by_date',
+                      'resolution': 'autodisqualify_by_resolution',
+                      'uploader': 'autodisqualify_by_uploader',
+                      'filetype': 'autodisqualify_by_filetype'}
+
 # Some basic config settings
 DEFAULT_ROUND_CONFIG = {'show_link': True,
                         'show_filename': True,
@@ -181,6 +212,9 @@ class User(Base):
         return ret
 
 
+users_t = User.__table__
+
+
 class Series(Base):
     __tablename__ = 'series'
     # defaults: wlm, unofficial
@@ -323,9 +357,12 @@ class Round(Base):
             self.config = {}
         self.config['show_stats'] = value
 
-    def check_closability(self):
-        task_count = self._get_task_count()
-        open_task_count = self._get_open_task_count()
+    def check_closability(self, count_map=None):
+        # accepts a precomputed get_count_map() result to save queries
+        if count_map is None:
+            count_map = self.get_vote_status_counts()
+        task_count = count_map['total_tasks']
+        open_task_count = count_map['total_open_tasks']
 
         if task_count == 0:
             return 100
@@ -343,46 +380,41 @@ class Round(Base):
         return rdb_session
 
 
-    def _get_open_task_count(self, rdb_session=None):
+    def get_vote_status_counts(self, rdb_session=None):
+        """Task totals for the round, read from the round_task_counts
+        table. Keys match the task portion of get_count_map().
+        """
         if not rdb_session:
             rdb_session = self._get_rdb_session()
-        ret = (rdb_session.query(Vote)
-                        .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)
-                        .filter(RoundEntry.round_id == self.id,
-                                Vote.status == ACTIVE_STATUS)
-                        .count())
-        return ret
+        status_counts = get_task_status_counts(rdb_session, self.id)
+        return _make_task_count_map(status_counts)
 
-    def _get_task_count(self, rdb_session=None):
+    def get_entry_counts(self, rdb_session=None):
+        """Round entry totals (all, disqualified, distinct uploaders of
+        qualified entries) in one aggregate pass over round_entries.
+        """
         if not rdb_session:
             rdb_session = self._get_rdb_session()
-        ret = (rdb_session.query(Vote)
-                        .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)
-                        .filter(RoundEntry.round_id == self.id,
-                                Vote.status != CANCELLED_STATUS)
-                        .count())
-        return ret
+        qualified_uploader = case([(RoundEntry.dq_user_id == None,
+                                    Entry.upload_user_id)])
+        row = (rdb_session.query(func.count(RoundEntry.id),
+                                 func.count(RoundEntry.dq_reason),
+                                 func.count(func.distinct(qualified_uploader)))
+                          .join(Entry, Entry.id == RoundEntry.entry_id)
+                          .filter(RoundEntry.round_id == self.id)
+                          .one())
+        re_count, dq_entry_count, uploader_count = row
+        return {'total_round_entries': re_count,
+                'total_disqualified_entries': dq_entry_count,
+                'total_uploaders': uploader_count}
 
     def get_count_map(self):
-        # TODO TODO TODO
-        # when more info is needed, can get session with
-        # inspect(self).session (might be None if not attached), only
-        # disadvantage is that user is not available to do permissions
-        # checking.
+        # This used to be a stack of separate COUNT queries plus full
+        # loads of round_entries and uploaders; now it's two aggregate
+        # passes and the (small) distinct mime list.
         rdb_session = self._get_rdb_session()
-        re_count = len(self.round_entries)
-
-        open_task_count = self._get_open_task_count(rdb_session=rdb_session)
-        task_count = self._get_task_count(rdb_session=rdb_session)
-        cancelled_task_count = rdb_session.query(Vote)\
-                                        .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)\
-                                        .filter(RoundEntry.round_id == self.id,
-                                                Vote.status == CANCELLED_STATUS)\
-                                        .count()
-        dq_entry_count = rdb_session.query(RoundEntry)\
-                                    .filter_by(round_id=self.id)\
-                                    .filter(RoundEntry.dq_reason != None)\
-                                    .count()
+        task_counts = self.get_vote_status_counts(rdb_session=rdb_session)
+        entry_counts = self.get_entry_counts(rdb_session=rdb_session)
         all_mimes = rdb_session.query(Entry.mime_minor)\
                                     .join(RoundEntry)\
                                     .distinct(Entry.mime_minor)\
@@ -390,18 +422,20 @@ class Round(Base):
                                     .filter(RoundEntry.dq_reason == None)\
                                     .all()
 
+        task_count = task_counts['total_tasks']
+        open_task_count = task_counts['total_open_tasks']
         if task_count:
             percent_open = round((100.0 * open_task_count) / task_count, 3)
         else:
             percent_open = 0.0
 
-        return {'total_round_entries': re_count,  # TODO: sync with total_entries
+        return {'total_round_entries': entry_counts['total_round_entries'],  # TODO: sync with total_entries
                 'total_tasks': task_count,
                 'total_open_tasks': open_task_count,
                 'percent_tasks_open': percent_open,
-                'total_cancelled_tasks': cancelled_task_count,
-                'total_disqualified_entries': dq_entry_count,
-                'total_uploaders': len(self.get_uploaders()),
+                'total_cancelled_tasks': task_counts['total_cancelled_tasks'],
+                'total_disqualified_entries': entry_counts['total_disqualified_entries'],
+                'total_uploaders': entry_counts['total_uploaders'],
                 'all_mimes': all_mimes}
 
     def get_uploaders(self):
@@ -450,11 +484,12 @@ class Round(Base):
 
     def to_details_dict(self):
         ret = self.to_info_dict()
-        ret['is_closable'] = self.check_closability()
+        count_map = self.get_count_map()
+        ret['is_closable'] = self.check_closability(count_map)
         ret['campaign'] = self.campaign.to_info_dict()
         ret['quorum'] = self.quorum
-        ret['total_round_entries'] = len(self.round_entries)
-        ret['stats'] = self.get_count_map()
+        ret['total_round_entries'] = count_map['total_round_entries']
+        ret['stats'] = count_map
         ret['juror_details'] = [rj.to_details_dict() for rj in self.round_jurors],
         return ret
 
@@ -496,35 +531,16 @@ class RoundJuror(Base):
             # TODO: just make a session
             raise RuntimeError('cannot get counts for detached Round')
 
-        task_count = rdb_session.query(Vote)\
-                                .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)\
-                                .filter(RoundEntry.round_id == self.round_id,
-                                        Vote.user_id == self.user_id,
-                                        Vote.status != CANCELLED_STATUS)\
-                                .count()
-
-        open_task_count = rdb_session.query(Vote)\
-                                    .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)\
-                                    .filter(RoundEntry.round_id == self.round_id,
-                                            Vote.user_id == self.user_id,
-                                            Vote.status == ACTIVE_STATUS)\
-                                    .count()
-
-        cancelled_task_count = rdb_session.query(Vote)\
-                                        .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)\
-                                        .filter(RoundEntry.round_id == self.round_id,
-                                                Vote.user_id == self.user_id,
-                                                Vote.status == CANCELLED_STATUS)\
-                                        .count()
+        status_counts = get_task_status_counts(rdb_session, self.round_id,
+                                              user_id=self.user_id)
+        ret = _make_task_count_map(status_counts)
+        task_count = ret['total_tasks']
         if task_count:
-            percent_open = round((100.0 * open_task_count) / task_count, 3)
+            percent_open = round((100.0 * ret['total_open_tasks']) / task_count, 3)
         else:
             percent_open = 0.0
-
-        return {'total_tasks': task_count,
-                'total_open_tasks': open_task_count,
-                'percent_tasks_open': percent_open,
-                'total_cancelled_tasks': cancelled_task_count}
+        ret['percent_tasks_open'] = percent_open
+        return ret
 
     def to_info_dict(self):
         ret = {'id': self.user.id,
@@ -608,6 +624,9 @@ class Entry(Base):
         return ret
 
 
+entries_t = Entry.__table__
+
+
 class RoundEntry(Base):
     __tablename__ = 'round_entries'
 
@@ -622,6 +641,11 @@ class RoundEntry(Base):
     # TODO: dq_date?
     flags = Column(JSONEncodedDict)
 
+    # running totals of the entry's completed votes, kept up to date
+    # alongside round_task_counts (see adjust_round_entry_ratings)
+    vote_sum = Column(Float, nullable=False, default=0, server_default='0')
+    vote_count = Column(Integer, nullable=False, default=0, server_default='0')
+
     entry = relationship(Entry, back_populates='entered_rounds')
     round = relationship(Round, back_populates='round_entries')
     votes = relationship('Vote', back_populates='round_entry')
@@ -661,6 +685,33 @@ class RoundSource(Base):
     flags = Column(JSONEncodedDict)
 
 
+round_sources_t = RoundSource.__table__
+
+
+class EntryCampaign(Base):
+    """Index of the campaigns each entry has been entered in, backing
+    the public entry info lookup. Each row points at the entry's first
+    round entry in the campaign.
+
+    Rows are added by CoordinatorDAO.add_round_entries, and
+    results_published follows publish_report/unpublish_report. See
+    rebuild_entry_campaigns() to recompute it from the round entries.
+    """
+    __tablename__ = 'entry_campaigns'
+
+    entry_id = Column(Integer, ForeignKey('entries.id'), primary_key=True)
+    campaign_id = Column(Integer, ForeignKey('campaigns.id'), primary_key=True,
+                         index=True)
+    round_entry_id = Column(Integer, ForeignKey('round_entries.id'),
+                            nullable=False)
+    results_published = Column(Boolean, nullable=False, default=False,
+                               server_default='0')
+    create_date = Column(TIMESTAMP, server_default=func.now())
+
+
+entry_campaigns_t = EntryCampaign.__table__
+
+
 class Flag(Base):
     __tablename__ = 'flags'
 
@@ -737,6 +788,10 @@ class Vote(Base):
 
     flags = Column(JSONEncodedDict)
 
+    # covers a juror's open tasks, see JurorDAO.get_tasks_from_round
+    __table_args__ = (Index('ix_votes_user_status_round_entry',
+                            'user_id', 'status', 'round_entry_id'),)
+
     def __init__(self, **kw):
         self.flags = kw.pop('flags', {})
         super(Vote, self).__init__(**kw)
@@ -756,19 +811,23 @@ class Vote(Base):
         return len(faves) > 0
 
 
-    def to_info_dict(self):
+    def to_info_dict(self, is_fave=None):
+        # pass is_fave when serializing many votes, see
+        # JurorDAO.get_fave_entry_ids()
+        if is_fave is None:
+            is_fave = self.check_fave()
         info = {'id': self.id,
                 'name': self.entry.name,
                 'user': self.user.username,
                 'value': self.value,
                 'date': format_date(self.modified_date),
                 'round_id': self.round_entry.round_id,
-                'is_fave': self.check_fave()}
+                'is_fave': is_fave}
         info['review'] = self.flags.get('review')  # TODO
         return info
 
-    def to_details_dict(self):
-        ret = self.to_info_dict()
+    def to_details_dict(self, is_fave=None):
+        ret = self.to_info_dict(is_fave=is_fave)
         ret['entry'] = self.entry.to_details_dict()
         return ret
 
@@ -776,6 +835,48 @@ class Vote(Base):
 votes_t = Vote.__table__
 
 
+class RoundTaskCount(Base):
+    """Denormalized count of a juror's votes in a round, by status.
+
+    Kept in step with the votes table by the session flush hook
+    (_track_vote_count_changes) and by adjust_round_task_counts() for
+    bulk statements that bypass the ORM, so that progress stats are
+    primary key lookups. If it ever drifts, rebuild with
+    rebuild_round_task_counts() (see tools/admin.py round reconcile-counts).
+    """
+    __tablename__ = 'round_task_counts'
+
+    round_id = Column(Integer, ForeignKey('rounds.id'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    status = Column(String(255), primary_key=True)
+    task_count = Column(Integer, nullable=False, default=0)
+
+
+round_task_counts_t = RoundTaskCount.__table__
+
+
+class VoteSkip(Base):
+    """A task the juror chose to "vote later". Skipped tasks are served
+    only once the juror has no other open tasks in the round.
+
+    This replaces the skipped_ids list in RoundJuror.flags, which is
+    migrated by migrate_legacy_vote_skips() (see tools/admin.py round
+    migrate-skips).
+    """
+    __tablename__ = 'vote_skips'
+
+    vote_id = Column(Integer, ForeignKey('votes.id'), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    round_id = Column(Integer, ForeignKey('rounds.id'), nullable=False)
+    create_date = Column(TIMESTAMP, server_default=func.now())
+
+    __table_args__ = (Index('ix_vote_skips_user_round',
+                            'user_id', 'round_id', 'vote_id'),)
+
+
+vote_skips_t = VoteSkip.__table__
+
+
 class FinalEntryRanking(object):
     """This is just for organizing ranking information as calculated at
     the end of a ranking round.
@@ -906,7 +1007,9 @@ class PublicDAO(object):
         return series
 
     def get_report(self, campaign_id):
+        # the summary itself is only loaded if the report needs rendering
         summary = (self.query(RoundResultsSummary)
+                   .options(defer('summary'))
                    .filter_by(campaign_id=campaign_id,
                               status=PUBLISHED_STATUS)
                    .one_or_none())
@@ -929,35 +1032,34 @@ class PublicDAO(object):
     def get_public_entry_info(self, entry_name):
         entry = self._get_entry_by_name(entry_name)
         ret = entry.to_details_dict()
+        # one row per campaign, from the entry's first round in it
+        query = (select([entry_campaigns_t.c.campaign_id,
+                         campaigns_t.c.name,
+                         campaigns_t.c.status,
+                         entry_campaigns_t.c.results_published,
+                         round_entries_t.c.dq_reason,
+                         round_sources_t.c.params])
+                 .select_from(entry_campaigns_t
+                              .join(campaigns_t,
+                                    campaigns_t.c.id == entry_campaigns_t.c.campaign_id)
+                              .join(round_entries_t,
+                                    round_entries_t.c.id == entry_campaigns_t.c.round_entry_id)
+                              .outerjoin(round_sources_t,
+                                         round_sources_t.c.id == round_entries_t.c.round_source_id))
+                 .where(entry_campaigns_t.c.entry_id == entry.id)
+                 .order_by(entry_campaigns_t.c.round_entry_id))
         ret['campaigns'] = []
-        round_entries = entry.entered_rounds
-        for round_entry in round_entries:
-            campaign_id = round_entry.round.campaign.id,
-            disqualified = False
-            results_published = False
-            if campaign_id in [c['campaign_id'] for c in ret['campaigns']]:
-                # Only need the first round in a campaign
-                continue
-            if round_entry.dq_reason:
-                disqualified = True  # Should montage let people see
-                                     # if their photo was dq'ed?
-            summary = round_entry.round.campaign.results_summary
-            if summary:
-                summary = summary[0]
-                results_published = True  # If it's published, you can
-                                          # visit the campaign report
-                                          # to see the results
-                '''
-                # TODO: show the ranking, if it's a winner?
-                winners = [(e['entry']['name'],
-                            e['ranking']) for e in results['winners']]
-                '''
-            re_info = {'campaign_id': campaign_id,
-                       'campaign_name': round_entry.round.campaign.name,
-                       'campaign_status': round_entry.round.campaign.status,
-                       'campaign_results_published': results_published,
-                       'disqualified': disqualified,
-                       'source': round_entry.round_source.params}
+        for row in self.rdb_session.execute(query):
+            # TODO: show the ranking, if it's a winner? If it's
+            # published, you can visit the campaign report to see the
+            # results. (Also, should montage let people see if their
+            # photo was dq'ed?)
+            re_info = {'campaign_id': row.campaign_id,
+                       'campaign_name': row.name,
+                       'campaign_status': row.status,
+                       'campaign_results_published': row.results_published,
+                       'disqualified': bool(row.dq_reason),
+                       'source': row.params}
             ret['campaigns'].append(re_info)
         return ret
 
@@ -1166,20 +1268,11 @@ class CoordinatorDAO(UserDAO):
         # the fact that these are identical for two DAOs shows it
         # should be on the Round model or somewhere else shared
         re_count = self.query(RoundEntry).filter_by(round_id=round_id).count()
-
-        total_tasks = self.query(Vote)\
-                        .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)\
-                        .filter(RoundEntry.round_id == round_id,
-                                Vote.user_id == self.user.id,
-                                Vote.status != CANCELLED_STATUS)\
-                        .count()
-
-        total_open_tasks = self.query(Vote)\
-                            .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)\
-                            .filter(RoundEntry.round_id == round_id,
-                                    Vote.user_id == self.user.id,
-                                    Vote.status == ACTIVE_STATUS)\
-                            .count()
+        status_counts = get_task_status_counts(self.rdb_session, round_id,
+                                              user_id=self.user.id)
+        task_count_map = _make_task_count_map(status_counts)
+        total_tasks = task_count_map['total_tasks']
+        total_open_tasks = task_count_map['total_open_tasks']
 
         if total_tasks:
             percent_open = round((100.0 * total_open_tasks) / total_tasks, 3)
@@ -1190,6 +1283,15 @@ class CoordinatorDAO(UserDAO):
                 'total_open_tasks': total_open_tasks,
                 'percent_tasks_open': percent_open}
 
+    def get_entry_id_map(self, entry_ids):
+        ret = {}
+        for id_chunk in chunked(list(entry_ids), IMPORT_CHUNK_SIZE):
+            entries = self.query(Entry)\
+                          .filter(Entry.id.in_(id_chunk))\
+                          .all()
+            ret.update([(entry.id, entry) for entry in entries])
+        return ret
+
     def get_entry_name_map(self, filenames):
         entries = self.query(Entry)\
                       .filter(Entry.name.in_(filenames))\
@@ -1312,48 +1414,223 @@ class CoordinatorDAO(UserDAO):
         self.log_action('edit_round', round=rnd, message=msg)
         return new_val_map
 
-    def autodisqualify_by_date(self, round_id, preview=False):
+    def _get_autodq_rules(self, rnd, rules):
+        """Returns a list of (rule, condition, make_reason, log_message)
+        for the given rule names, in order. condition is a SQL
+        expression over Entry, or None if the rule can't apply.
+        """
+        ret = []
+        for rule in rules:
+            if rule == 'upload_date':
+                min_date = self.campaign.open_date
+                max_date = self.campaign.close_date
+                if not min_date or not max_date:
+                    ret.append((rule, None, None,
+                                '%s disqualified 0 entries by date due to missing, '
+                                'campaign open or close date' % (self.user.username,)))
+                    continue
+                cond = (Entry.upload_date < min_date) | (Entry.upload_date > max_date)
+
+                def make_reason(entry, min_date=min_date, max_date=max_date):
+                    return ('upload date %s is out of campaign date range %s - %s'
+                            % (entry.upload_date, min_date, max_date))
+                log_msg = ('%s disqualified %%s entries outside of date range %s - %s'
+                           % (self.user.username, min_date, max_date))
+            elif rule == 'resolution':
+                # TODO: get from config
+                min_res = rnd.config.get('min_resolution', DEFAULT_MIN_RESOLUTION)
+                min_res_str = round(min_res / ONE_MEGAPIXEL, 2)
+                cond = Entry.resolution < min_res
+
+                def make_reason(entry, min_res_str=min_res_str):
+                    entry_res_str = round(entry.resolution / ONE_MEGAPIXEL, 2)
+                    return ('resolution %s is less than %s minimum '
+                            % (entry_res_str, min_res_str))
+                log_msg = ('%s disqualified %%s entries smaller than %s megapixels'
+                           % (self.user.username, min_res_str))
+            elif rule == 'uploader':
+                dq_group = self._get_dq_uploader_groups(rnd)
+                cond = Entry.upload_user_text.in_(set(dq_group))
+
+                def make_reason(entry, dq_group=dq_group):
+                    upload_user = entry.upload_user_text
+                    return 'upload user %s is %s' % (upload_user, dq_group[upload_user])
+                log_msg = ('%s disqualified %%s entries based on upload user'
+                           % (self.user.username,))
+            elif rule == 'filetype':
+                allowed_filetypes = rnd.config.get('allowed_filetypes')
+                cond = ~Entry.mime_minor.in_(allowed_filetypes)
+
+                def make_reason(entry, allowed_filetypes=allowed_filetypes):
+                    return ('mime %s is not in %s' % (entry.mime_minor,
+                                                      allowed_filetypes))
+                log_msg = ('%s disqualified %%s entries by filetype not in %s'
+                           % (self.user.username, allowed_filetypes))
+            else:
+                raise ValueError('unknown autodisqualification rule: %r' % rule)
+            ret.append((rule, cond, make_reason, log_msg))
+        return ret
+
+    def _get_dq_uploader_groups(self, rnd):
+        # later groups win for users in more than one
+        dq_group = {}
+        for juror in rnd.jurors:
+            dq_group[juror.username] = 'juror'
+
+        if rnd.config.get('dq_coords'):
+            for coord in self.campaign.coords:
+                dq_group[coord.username] = 'coordinator'
+
+        if rnd.config.get('dq_organizers'):
+            organizer_rows = self.query(User.username)\
+                                 .filter_by(is_organizer=True)\
+                                 .all()
+            for (username,) in organizer_rows:
+                dq_group[username] = 'organizer'
+
+        if rnd.config.get('dq_maintainers'):
+            for username in MAINTAINERS:
+                dq_group[username] = 'maintainer'
+        return dq_group
+
+    def get_autodq_matches(self, round_id, rules=AUTODQ_RULES):
+        """Evaluates the given autodisqualification rules against a
+        round in a single joined read. Returns an OrderedDict of rule
+        name to a list of (round_entry_id, entry) pairs it matches,
+        without changing anything.
+        """
         rnd = self.get_round(round_id)
-        min_date = self.campaign.open_date
-        max_date = self.campaign.close_date
+        rule_specs = self._get_autodq_rules(rnd, rules)
+        return self._get_autodq_matches(rnd, rule_specs)
 
-        if (not min_date or not max_date):
-            round_entries = []
+    def _get_autodq_matches(self, rnd, rule_specs):
+        ret = OrderedDict([(spec[0], []) for spec in rule_specs])
+        active_specs = [spec for spec in rule_specs if spec[1] is not None]
+        if not active_specs:
+            return ret
+        # SQL evaluates each rule, so matching (NULLs and all) is the
+        # same as it was with one query per rule
+        rule_flags = [case([(spec[1], 1)], else_=0) for spec in active_specs]
+        rows = (self.query(RoundEntry.id, Entry, *rule_flags)
+                    .join(Entry, Entry.id == RoundEntry.entry_id)
+                    .filter(RoundEntry.round_id == rnd.id)
+                    .filter(or_(*[spec[1] for spec in active_specs]))
+                    .order_by(RoundEntry.id)
+                    .all())
+        for row in rows:
+            round_entry_id, entry, flags = row[0], row[1], row[2:]
+            for spec, flag in zip(active_specs, flags):
+                if flag:
+                    ret[spec[0]].append((round_entry_id, entry))
+        return ret
 
-            if not preview:
-                msg = ('%s disqualified 0 entries by date due to missing, '
-                       'campaign open or close date' % (self.user.username,))
-                self.log_action('autodisqualify_by_date', round=rnd, message=msg)
+    def autodisqualify(self, round_id, rules=AUTODQ_RULES):
+        """Set-based autodisqualification: evaluates all the given rules
+        in one pass, then disqualifies the matching round entries and
+        cancels their votes with bulk UPDATEs.
 
-            return round_entries
+        Returns a list of to_dq_details()-style dicts, one per match per
+        rule (in rule order). When several rules match an entry, the
+        last one's reason is the one recorded, as before.
+        """
+        matches, dq_reason_map = self._apply_autodq(round_id, rules)
+        ret = []
+        for rule in matches:
+            for round_entry_id, entry in matches[rule]:
+                ret.append({'entry': entry.to_details_dict(),
+                            'dq_reason': dq_reason_map[round_entry_id],
+                            'dq_user_id': self.user.id})
+        return ret
 
-        round_entries = self.query(RoundEntry)\
-                            .join(Entry)\
-                            .filter(RoundEntry.round_id == round_id)\
-                            .filter((Entry.upload_date < min_date) |
-                                    (Entry.upload_date > max_date))\
-                            .all()
+    def _apply_autodq(self, round_id, rules):
+        rnd = self.get_round(round_id)
+        rule_specs = self._get_autodq_rules(rnd, rules)
+        matches = self._get_autodq_matches(rnd, rule_specs)
 
-        if preview:
-            return round_entries
+        dq_reason_map = OrderedDict()
+        for rule, cond, make_reason, log_msg in rule_specs:
+            for round_entry_id, entry in matches[rule]:
+                dq_reason_map[round_entry_id] = make_reason(entry)
 
+        if dq_reason_map:
+            self._bulk_disqualify(rnd, dq_reason_map)
+
+        for rule, cond, make_reason, log_msg in rule_specs:
+            if cond is not None:
+                log_msg = log_msg % len(matches[rule])
+            self.log_action(AUTODQ_LOG_ACTIONS[rule], round=rnd,
+                            message=log_msg)
+
+        return matches, dq_reason_map
+
+    def _bulk_disqualify(self, rnd, dq_reason_map):
+        session = self.rdb_session
         cancel_date = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        round_entry_ids = list(dq_reason_map)
+
+        # dq reasons are per-entry, so this one is an executemany
+        # all the entries' votes get cancelled, leaving none completed
+        re_update = (round_entries_t.update()
+                     .where(round_entries_t.c.id == bindparam('_re_id'))
+                     .values(dq_reason=bindparam('_dq_reason'),
+                             dq_user_id=self.user.id,
+                             vote_sum=0,
+                             vote_count=0))
+        session.execute(re_update,
+                        [{'_re_id': re_id, '_dq_reason': reason}
+                         for re_id, reason in dq_reason_map.items()])
+
+        count_deltas = Counter()
+        for id_chunk in chunked(round_entry_ids, IMPORT_CHUNK_SIZE):
+            vote_filter = (votes_t.c.round_entry_id.in_(id_chunk)
+                           & (votes_t.c.status != CANCELLED_STATUS))
+            count_rows = session.execute(
+                select([votes_t.c.user_id, votes_t.c.status,
+                        func.count(votes_t.c.id)])
+                .where(vote_filter)
+                .group_by(votes_t.c.user_id, votes_t.c.status))
+            for user_id, status, count in count_rows:
+                count_deltas[(rnd.id, user_id, status)] -= count
+                count_deltas[(rnd.id, user_id, CANCELLED_STATUS)] += count
+            session.execute(votes_t.update()
+                            .where(vote_filter)
+                            .values(status=CANCELLED_STATUS,
+                                    modified_date=cancel_date))
+        adjust_round_task_counts(session, count_deltas)
+
+        # the identity map doesn't see Core updates
+        re_id_set = set(round_entry_ids)
+        for obj in list(session.identity_map.values()):
+            if ((isinstance(obj, RoundEntry) and obj.id in re_id_set)
+                    or (isinstance(obj, Vote) and obj.round_entry_id in re_id_set)):
+                session.expire(obj)
+        return
 
-        for round_entry in round_entries:
-            dq_reason = ('upload date %s is out of campaign date range %s - %s'
-                         % (round_entry.entry.upload_date, min_date, max_date))
-            round_entry.dq_reason = dq_reason
-            round_entry.dq_user_id = self.user.id
+    def _autodisqualify_by(self, rule, round_id, preview=False):
+        # single-rule form of autodisqualify(), returning RoundEntries
+        if preview:
+            matches = self.get_autodq_matches(round_id, [rule])
+        else:
+            matches, _ = self._apply_autodq(round_id, [rule])
+        round_entry_ids = [re_id for re_id, _ in matches[rule]]
+        if not round_entry_ids:
+            return []
+        return (self.query(RoundEntry)
+                    .options(joinedload('entry'))
+                    .filter(RoundEntry.id.in_(round_entry_ids))
+                    .all())
+
+    def autodisqualify_by_date(self, round_id, preview=False):
+        return self._autodisqualify_by('upload_date', round_id, preview=preview)
 
-            for vote in round_entry.votes:
-                vote.status = CANCELLED_STATUS
-                vote.modified_date = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    def autodisqualify_by_resolution(self, round_id, preview=False):
+        return self._autodisqualify_by('resolution', round_id, preview=preview)
 
-        msg = ('%s disqualified %s entries outside of date range %s - %s'
-               % (self.user.username, len(round_entries), min_date, max_date))
-        self.log_action('autodisqualify_by_date', round=rnd, message=msg)
+    def autodisqualify_by_filetype(self, round_id, preview=False):
+        return self._autodisqualify_by('filetype', round_id, preview=preview)
 
-        return round_entries
+    def autodisqualify_by_uploader(self, round_id, preview=False):
+        return self._autodisqualify_by('uploader', round_id, preview=preview)
 
     def disqualify(self, round_id, entry_id, reason=None):
         rnd = self.get_round(round_id)
@@ -1406,125 +1683,6 @@ class CoordinatorDAO(UserDAO):
         self.log_action('requalify', round_id=round_id, message=msg)
         return round_entry
 
-    def autodisqualify_by_resolution(self, round_id, preview=False):
-        # TODO: get from config
-        rnd = self.get_round(round_id)
-        min_res = rnd.config.get('min_resolution', DEFAULT_MIN_RESOLUTION)
-        round_entries = self.query(RoundEntry)\
-                            .join(Entry)\
-                            .filter(RoundEntry.round_id == round_id)\
-                            .filter(Entry.resolution < min_res)\
-                            .all()
-
-        if preview:
-            return round_entries
-
-        min_res_str = round(min_res / ONE_MEGAPIXEL, 2)
-        cancel_date = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-
-        for r_ent in round_entries:
-            entry_res_str = round(r_ent.entry.resolution / ONE_MEGAPIXEL, 2)
-            dq_reason = ('resolution %s is less than %s minimum '
-                         % (entry_res_str, min_res_str))
-            r_ent.dq_reason = dq_reason
-            r_ent.dq_user_id = self.user.id
-
-            for vote in r_ent.votes:
-                vote.status = CANCELLED_STATUS
-                vote.modified_date = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-
-        msg = ('%s disqualified %s entries smaller than %s megapixels'
-               % (self.user.username, len(round_entries), min_res_str))
-        self.log_action('autodisqualify_by_resolution', round=rnd, message=msg)
-
-        return round_entries
-
-    def autodisqualify_by_filetype(self, round_id, preview=False):
-        rnd = self.get_round(round_id)
-        allowed_filetypes = rnd.config.get('allowed_filetypes')
-        round_entries = self.query(RoundEntry)\
-                            .join(Entry)\
-                            .filter(RoundEntry.round_id == round_id)\
-                            .filter(~Entry.mime_minor.in_(allowed_filetypes))\
-                            .all()
-
-        if preview:
-            return round_entries
-
-        cancel_date = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-
-        for r_ent in round_entries:
-            dq_reason = ('mime %s is not in %s' % (r_ent.entry.mime_minor,
-                                                   allowed_filetypes))
-            r_ent.dq_reason = dq_reason
-            r_ent.dq_user_id = self.user.id
-
-            for vote in r_ent.votes:
-                vote.status = CANCELLED_STATUS
-                vote.modified_date = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-
-        msg = ('%s disqualified %s entries by filetype not in %s'
-               % (self.user.username, len(round_entries), allowed_filetypes))
-        self.log_action('autodisqualify_by_filetype', round=rnd, message=msg)
-        return round_entries
-
-    def autodisqualify_by_uploader(self, round_id, preview=False):
-        dq_group = {}
-        rnd = self.get_round(round_id)
-        dq_usernames = [j.username for j in rnd.jurors]
-
-        for username in dq_usernames:
-            dq_group[username] = 'juror'
-
-        if rnd.config.get('dq_coords'):
-            coord_usernames = [c.username for c in self.campaign.coords]
-            dq_usernames += coord_usernames
-            for username in coord_usernames:
-                dq_group[username] = 'coordinator'
-
-        if rnd.config.get('dq_organizers'):
-            organizers = self.query(User)\
-                             .filter_by(is_organizer=True)\
-                             .all()
-            organizer_usernames = [u.username for u in organizers]
-            dq_usernames += organizer_usernames
-            for username in organizer_usernames:
-                dq_group[username] = 'organizer'
-
-        if rnd.config.get('dq_maintainers'):
-            dq_usernames += MAINTAINERS
-            for username in MAINTAINERS:
-                dq_group[username] = 'maintainer'
-
-        dq_usernames = set(dq_usernames)
-
-        round_entries = self.query(RoundEntry)\
-                            .join(Entry)\
-                            .filter(RoundEntry.round_id == round_id)\
-                            .filter(Entry.upload_user_text.in_(dq_usernames))\
-                            .all()
-        if preview:
-            return round_entries
-
-        cancel_date = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-
-        for round_entry in round_entries:
-            upload_user = round_entry.entry.upload_user_text
-            dq_reason = 'upload user %s is %s'\
-                        % (upload_user, dq_group[upload_user])
-            round_entry.dq_reason = dq_reason
-            round_entry.dq_user_id = self.user.id
-
-            for vote in round_entry.votes:
-                vote.status = CANCELLED_STATUS
-                vote.modified_date = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-
-        msg = ('%s disqualified %s entries based on upload user'
-               % (self.user.username, len(round_entries)))
-        self.log_action('autodisqualify_by_uploader', round=rnd, message=msg)
-
-        return round_entries
-
     def pause_round(self, round_id):
         rnd = self.user_dao.get_round(round_id)
         rnd.status = PAUSED_STATUS
@@ -1543,11 +1701,11 @@ class CoordinatorDAO(UserDAO):
             raise InvalidAction('can only activate round in a paused state,'
                                 ' not %r' % (rnd.status,))
 
-        tasks = create_initial_tasks(self.rdb_session, rnd)
+        task_count = create_initial_tasks(self.rdb_session, rnd)
         rnd.open_date = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
 
         msg = ('%s opened round %s with %s tasks'
-               % (self.user.username, rnd.name, len(tasks)))
+               % (self.user.username, rnd.name, task_count))
         self.log_action('open_round', round=rnd, message=msg)
 
         rnd.status = ACTIVE_STATUS
@@ -1558,36 +1716,35 @@ class CoordinatorDAO(UserDAO):
         return
 
     def add_entries_from_cat(self, round_id, cat_name):
+        """Returns an iterator over the rows (id and name) of the
+        category's entries, which are added to the database as it's
+        consumed, e.g., by add_round_entries().
+        """
         rnd = self.user_dao.get_round(round_id)
         if ENV_NAME == 'dev':
             source = 'remote'
         else:
             source = 'local'
         entries = loaders.load_category(cat_name, source=source)
-        entries, new_entry_count = self.add_entries(rnd, entries)
-
-        msg = ('%s loaded %s entries from category (%s), %s new entries added'
-               % (self.user.username, len(entries), cat_name, new_entry_count))
-        self.log_action('add_entries', message=msg, round=rnd)
-
-        return entries
+        return self.add_entries(rnd, entries,
+                                source_desc='category (%s)' % cat_name)
 
     def add_entries_by_name(self, round_id, file_names):
+        "Like add_entries_from_cat(), also returning a list of warnings."
         rnd = self.user_dao.get_round(round_id)
         if ENV_NAME == 'dev':
             source = 'remote'
         else:
             source = 'local'
         entries, warnings = loaders.load_by_filename(file_names, source=source)
-        entries, new_entry_count = self.add_entries(rnd, entries)
-
-        msg = ('%s loaded %s entries from filenames, %s new entries added'
-               % (self.user.username, len(entries), new_entry_count))
-        self.log_action('add_entries', message=msg, round=rnd)
-
-        return entries, warnings
+        entry_rows = self.add_entries(rnd, entries, source_desc='filenames')
+        return entry_rows, warnings
 
-    def add_entries_from_csv(self, round_id, csv_url):
+    def add_entries_from_csv(self, round_id, csv_url, on_progress=None):
+        """Like add_entries_from_cat(), also returning a list of warnings.
+        The csv is streamed, so warnings are only complete once the
+        returned iterator has been consumed.
+        """
         # NOTE: this no longer creates RoundEntries, use
         # add_round_entries to do this.
         rnd = self.user_dao.get_round(round_id)
@@ -1595,19 +1752,18 @@ class CoordinatorDAO(UserDAO):
             source = 'remote'
         else:
             source = 'local'
+        warnings = []
         try:
-            entries, warnings = loaders.get_entries_from_csv(csv_url,
-                                                             source=source)
+            entry_iter = loaders.iter_entries_from_csv(csv_url,
+                                                       source=source,
+                                                       warnings=warnings,
+                                                       on_progress=on_progress)
         except ValueError:
             raise InvalidAction('unable to load csv "%s"' % csv_url)
-
-        entries, new_entry_count = self.add_entries(rnd, entries)
-
-        msg = ('%s loaded %s entries from csv (%r), %s new entries added'
-               % (self.user.username, len(entries), csv_url, new_entry_count))
-        self.log_action('add_entries', message=msg, round=rnd)
-
-        return entries, warnings
+        entry_rows = self.add_entries(rnd,
+                                      _iter_csv_entries(entry_iter, csv_url),
+                                      source_desc='csv (%r)' % csv_url)
+        return entry_rows, warnings
 
     def get_round_sources(self, round_id, import_method):
         round_sources = (self.query(RoundSource)
@@ -1632,73 +1788,116 @@ class CoordinatorDAO(UserDAO):
         return round_source
 
 
-    def add_entries(self, rnd, entries):
+    def add_entries(self, rnd, entries, source_desc=None):
+        """Bulk insert new entries, skipping the ones already in the
+        database, with a few statements per ENTRY_UPSERT_CHUNK_SIZE
+        entries. *entries* may be any iterable, including a generator
+        streaming from a large import.
+
+        This is a generator: entries are only read and inserted as it's
+        consumed, one chunk at a time, and it yields a row with the id
+        and name of each entry. Once it's exhausted, the counts are
+        written to the audit log.
+        """
         # TODO: you shouldn't be able to use this method to add
         # entries to anything other than the first round in a campaign
-
-        # Deduplicate case-insensitively before chunking. MySQL/MariaDB uses a
-        # case-insensitive collation (utf8mb4_unicode_ci) on entries.name, so
-        # two filenames differing only in case (e.g. Photo.JPG / photo.jpg)
-        # would collide on the unique index. Keep the first occurrence.
-        seen_lower = {}
-        deduped = []
-        for e in entries:
-            key = to_unicode(e.name).lower()
-            if key not in seen_lower:
-                seen_lower[key] = e.name
-                deduped.append(e)
-        entries = deduped
-
-        entry_chunks = chunked(entries, IMPORT_CHUNK_SIZE)
-        ret = []
-        new_entry_count = 0
-
-        for entry_chunk in entry_chunks:
+        entry_count, new_entry_count = 0, 0
+        insert_stmt = make_insert_ignore(self.rdb_session, entries_t)
+        name_col_query = select([entries_t.c.id, entries_t.c.name])
+
+        # Deduplicate case-insensitively. MySQL/MariaDB uses a
+        # case-insensitive collation (utf8mb4_unicode_ci) on
+        # entries.name, so two filenames differing only in case
+        # (e.g. Photo.JPG / photo.jpg) would collide on the unique
+        # index. Keep the first occurrence. unique_iter() remembers
+        # every name seen so far (only the names), so this holds
+        # across chunks while the import still streams.
+        entries = unique_iter(entries, key=lambda e: to_unicode(e.name).lower())
+        for entry_chunk in chunked_iter(entries, ENTRY_UPSERT_CHUNK_SIZE):
             entry_names = [to_unicode(e.name) for e in entry_chunk]
-            db_entries = self.get_entry_name_map(entry_names)
-
-            for entry in entry_chunk:
-                db_entry = db_entries.get(to_unicode(entry.name))
-                if db_entry:
-                    entry = db_entry
-                else:
-                    new_entry_count += 1
-                    self.rdb_session.add(entry)
-
-                ret.append(entry)
-
-        return ret, new_entry_count
+            name_filter = entries_t.c.name.in_(entry_names)
+            existing = self.rdb_session.execute(name_col_query
+                                                .where(name_filter)).fetchall()
+            existing_names = set([row.name for row in existing])
+            entry_count += len(entry_chunk)
+            new_entry_count += len(entry_chunk) - len(existing)
+
+            new_rows = [_make_entry_row(e) for e in entry_chunk
+                        if to_unicode(e.name) not in existing_names]
+            if new_rows:
+                # duplicates (e.g., from a concurrent import) are ignored
+                self.rdb_session.execute(insert_stmt, new_rows)
+                existing = (self.rdb_session.execute(name_col_query
+                                                     .where(name_filter))
+                            .fetchall())
+            for row in existing:
+                yield row
+
+        msg = '%s loaded %s entries' % (self.user.username, entry_count)
+        if source_desc:
+            msg += ' from %s' % source_desc
+        msg += ', %s new entries added' % new_entry_count
+        self.log_action('add_entries', message=msg, round=rnd)
+        return
 
     def add_round_entries(self, round_id, entries, method, params):
+        """Adds *entries* (anything with an id, e.g., the rows from
+        add_entries()) to the round, consuming them one chunk at a time.
+        Returns a dict of stats, where new_entry_count is the number of
+        entries passed in, and new_round_entry_count is how many of
+        those weren't already in the round.
+        """
         rnd = self.user_dao.get_round(round_id)
         if rnd.status != PAUSED_STATUS:
             raise InvalidAction('round must be paused to add new entries')
-        existing_names = (self.rdb_session.query(Entry.name)
-                          .join(RoundEntry)
-                          .filter_by(round=rnd)
-                          .all())
-        existing_names = set([n[0] for n in existing_names])
-        new_entries = [e for e
-                       in unique_iter(entries, key=lambda e: e.name)
-                       if e.name not in existing_names]
-        if not new_entries:
-            return dict()
-        round_source = self.get_or_create_round_source(round_id, method, params)
-        self.rdb_session.flush()
-        for new_entry in new_entries:
-            new_round_entry = RoundEntry(entry_id=new_entry.id,
-                                         round_id=round_id,
-                                         round_source_id=round_source.id)
-            self.rdb_session.add(new_round_entry)
-        msg = ('%s added %s round entries, %s new'
-               % (self.user.username, len(entries), len(new_entries)))
-        if method:
-            msg += ' (from %s)' % (method,)
-        self.log_action('add_round_entries', message=msg, round=rnd)
+        round_source = None
+        entry_count, new_round_entry_count = 0, 0
+        for entry_chunk in chunked_iter(entries, ENTRY_UPSERT_CHUNK_SIZE):
+            entry_count += len(entry_chunk)
+            id_chunk = [e.id for e in entry_chunk]
+            already_entered = (exists()
+                               .where(and_(round_entries_t.c.round_id == round_id,
+                                           round_entries_t.c.entry_id == entries_t.c.id)))
+            new_id_query = (select([entries_t.c.id])
+                            .where(entries_t.c.id.in_(id_chunk))
+                            .where(~already_entered))
+            if round_source is None:
+                if not self.rdb_session.execute(new_id_query.limit(1)).first():
+                    continue
+                round_source = self.get_or_create_round_source(round_id,
+                                                               method, params)
+                self.rdb_session.flush()
+
+            # INSERT ... SELECT, guarded against entries already in the
+            # round, including ones added by earlier chunks
+            to_insert = (select([entries_t.c.id,
+                                 literal(round_id),
+                                 literal(round_source.id)])
+                         .where(entries_t.c.id.in_(id_chunk))
+                         .where(~already_entered))
+            res = self.rdb_session.execute(round_entries_t.insert()
+                                           .from_select(['entry_id',
+                                                         'round_id',
+                                                         'round_source_id'],
+                                                        to_insert))
+            new_round_entry_count += res.rowcount
+
+        if new_round_entry_count:
+            self.rdb_session.expire(rnd, ['round_entries'])
+            index_entry_campaigns(self.rdb_session, round_id=round_id)
+
+            msg = ('%s added %s round entries, %s new'
+                   % (self.user.username, entry_count, new_round_entry_count))
+            if method:
+                msg += ' (from %s)' % (method,)
+            self.log_action('add_round_entries', message=msg, round=rnd)
+        total_entries = (self.query(func.count(RoundEntry.id))
+                         .filter_by(round_id=round_id)
+                         .scalar())
         new_entry_stats = {'round_id': rnd.id,
-                           'new_entry_count': len(entries),
-                           'new_round_entry_count': len(new_entries),
-                           'total_entries': len(rnd.entries)}
+                           'new_entry_count': entry_count,
+                           'new_round_entry_count': new_round_entry_count,
+                           'total_entries': total_entries}
         return new_entry_stats
 
     def cancel_round(self, round_id):
@@ -1751,6 +1950,109 @@ class CoordinatorDAO(UserDAO):
 
         return results_by_name
 
+    def _iter_streamed_rows(self, query):
+        # Runs a Core select on its own connection with a server-side
+        # cursor (where the driver supports it), yielding rows in
+        # chunks. The connection is independent of the request
+        # session, so the rows can be consumed while the response is
+        # being sent, after the session has been closed.
+        engine = self.rdb_session.get_bind()
+        with engine.connect() as conn:
+            result = (conn.execution_options(stream_results=True)
+                          .execute(query))
+            while True:
+                rows = result.fetchmany(EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+
+    def iter_round_entry_exports(self, round_id):
+        """Lazily yields a RoundEntry.to_export_dict()-shaped dict for
+        each qualified entry in the round, with the columns selected
+        in SQL. Permissions should be checked before iterating.
+        """
+        query = (select([entries_t.c.id,
+                         entries_t.c.name,
+                         entries_t.c.mime_major,
+                         entries_t.c.mime_minor,
+                         entries_t.c.width,
+                         entries_t.c.height,
+                         entries_t.c.upload_user_id,
+                         entries_t.c.upload_user_text,
+                         entries_t.c.upload_date,
+                         entries_t.c.file_id,
+                         round_sources_t.c.method,
+                         round_sources_t.c.params])
+                 .select_from(round_entries_t
+                              .join(entries_t,
+                                    entries_t.c.id == round_entries_t.c.entry_id)
+                              .outerjoin(round_sources_t,
+                                         round_sources_t.c.id == round_entries_t.c.round_source_id))
+                 .where((round_entries_t.c.round_id == round_id)
+                        & (round_entries_t.c.dq_reason == None))
+                 .order_by(round_entries_t.c.id))
+        for row in self._iter_streamed_rows(query):
+            yield {'img_id': row[entries_t.c.id],
+                   'img_name': row[entries_t.c.name],
+                   'img_major_mime': row[entries_t.c.mime_major],
+                   'img_minor_mime': row[entries_t.c.mime_minor],
+                   'img_width': row[entries_t.c.width],
+                   'img_height': row[entries_t.c.height],
+                   'img_user': row[entries_t.c.upload_user_id],
+                   'img_user_text': row[entries_t.c.upload_user_text],
+                   'img_timestamp': format_date(row[entries_t.c.upload_date]),
+                   'file_id': row[entries_t.c.file_id],
+                   'source_method': row[round_sources_t.c.method],
+                   'source_params': json.dumps(row[round_sources_t.c.params])}
+
+    def get_round_voter_names(self, round_id):
+        """Usernames of everyone with a non-cancelled task on a
+        qualified entry in the round."""
+        rows = (self.query(User.username)
+                    .join(Vote, Vote.user_id == User.id)
+                    .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)
+                    .filter(RoundEntry.round_id == round_id,
+                            RoundEntry.dq_user_id == None,
+                            Vote.status != CANCELLED_STATUS)
+                    .distinct()
+                    .all())
+        return [row[0] for row in rows]
+
+    def iter_vote_table(self, round_id):
+        """Lazily yields (filename, {username: rating}) for each entry in
+        the round, with the same values as make_vote_table() ('tbv' for
+        tasks not yet voted on), from a single streamed projection.
+        """
+        query = (select([votes_t.c.round_entry_id,
+                         entries_t.c.name,
+                         users_t.c.username,
+                         votes_t.c.status,
+                         votes_t.c.value])
+                 .select_from(votes_t
+                              .join(round_entries_t,
+                                    round_entries_t.c.id == votes_t.c.round_entry_id)
+                              .join(entries_t,
+                                    entries_t.c.id == round_entries_t.c.entry_id)
+                              .join(users_t, users_t.c.id == votes_t.c.user_id))
+                 .where((round_entries_t.c.round_id == round_id)
+                        & (round_entries_t.c.dq_user_id == None)
+                        & (votes_t.c.status != CANCELLED_STATUS))
+                 .order_by(votes_t.c.round_entry_id))
+        cur_re_id, cur_name, cur_ratings = None, None, None
+        for re_id, filename, username, status, value in self._iter_streamed_rows(query):
+            if re_id != cur_re_id:
+                if cur_re_id is not None:
+                    yield cur_name, cur_ratings
+                cur_re_id, cur_name, cur_ratings = re_id, filename, {}
+            if status == COMPLETED_STATUS:
+                cur_ratings[username] = value
+            else:
+                # tbv = to be voted
+                cur_ratings[username] = 'tbv'
+        if cur_re_id is not None:
+            yield cur_name, cur_ratings
+
     def finalize_rating_round(self, round_id, threshold):
         rnd = self.get_round(round_id)
         assert rnd.vote_method in ('rating', 'yesno')
@@ -1882,83 +2184,80 @@ class CoordinatorDAO(UserDAO):
 
         assert 0.0 <= threshold <= 1.0
 
-        avg = func.avg(Vote.value).label('average')
+        avg = RoundEntry.vote_sum / RoundEntry.vote_count
 
-        results = self.query(RoundEntry, Vote, avg)\
+        results = self.query(RoundEntry)\
                       .options(joinedload('entry'))\
                       .filter_by(dq_user_id=None, round_id=round_id)\
-                      .join(Vote)\
-                      .group_by(Vote.round_entry_id)\
-                      .having(avg >= threshold)\
+                      .filter(RoundEntry.vote_count > 0,
+                              avg >= threshold)\
                       .all()
 
-        entries = [res[0].entry for res in results]
+        entries = [res.entry for res in results]
 
         return entries
 
     def get_round_average_rating_map(self, round_id):
-        results = self.query(Vote, func.avg(Vote.value).label('average'))\
-                 .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)\
+        results = self.query(RoundEntry.vote_sum, RoundEntry.vote_count)\
                  .filter(RoundEntry.round_id == round_id,
-                         Vote.status == COMPLETED_STATUS)\
-                 .group_by(Vote.round_entry_id)\
+                         RoundEntry.vote_count > 0)\
                  .all()
 
         # thresh_counts = get_threshold_map(r[1] for r in ratings)
-        rating_ctr = Counter([r[1] for r in results])
+        rating_ctr = Counter([vote_sum / vote_count
+                              for vote_sum, vote_count in results])
 
         return dict(rating_ctr)
 
     def get_round_ranking_list(self, round_id, notation=None):
-        res = (self.query(Vote)
-                .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)
-                .options(joinedload('round_entry'))
-                .filter(RoundEntry.round_id == round_id,
-                        Vote.status == COMPLETED_STATUS)
-                .all())
+        # one projection over the completed rankings, rather than
+        # loading votes and looking up their users one by one
+        query = (select([votes_t.c.user_id,
+                         users_t.c.username,
+                         round_entries_t.c.entry_id,
+                         votes_t.c.value,
+                         votes_t.c.flags])
+                 .select_from(votes_t
+                              .join(round_entries_t,
+                                    round_entries_t.c.id == votes_t.c.round_entry_id)
+                              .join(users_t, users_t.c.id == votes_t.c.user_id))
+                 .where((round_entries_t.c.round_id == round_id)
+                        & (votes_t.c.status == COMPLETED_STATUS))
+                 .order_by(votes_t.c.id))
+        res = self.rdb_session.execute(query).fetchall()
         all_inputs = []
         by_juror_id = bucketize(res, lambda r: r.user_id)
         entry_user_review_map = {}
 
         for ranking in res:
-            user_id = ranking.user_id
-            entry_id = ranking.round_entry.entry_id
-            review = ranking.flags.get('review', '')
-            username = self.query(User).get(user_id).username
-
-            entry_user_review_map.setdefault(entry_id, {})[username] = review
+            review = (ranking.flags or {}).get('review', '')
+            (entry_user_review_map.setdefault(ranking.entry_id, {})
+             [ranking.username]) = review
 
         entry_rank_user_map = {}
         for user_id, rankings in by_juror_id.items():
             cur_ballot = []
             cur_input = {'count': 1, 'ballot': cur_ballot}
 
-            r_by_val = bucketize(rankings, lambda r: r.ranking_value)
+            r_by_val = bucketize(rankings, lambda r: int(r.value))
             lowest_rank = max(r_by_val.keys())
             for rank in range(0, lowest_rank + 1):
-                ranking_objs = r_by_val.get(rank, [])
-                cur_ballot.append([r.round_entry.entry_id
-                                   for r in ranking_objs])
-                for r in ranking_objs:
-                    (entry_rank_user_map.setdefault(r.round_entry.entry_id, {})
+                ranking_rows = r_by_val.get(rank, [])
+                cur_ballot.append([r.entry_id for r in ranking_rows])
+                for r in ranking_rows:
+                    (entry_rank_user_map.setdefault(r.entry_id, {})
                      .setdefault(rank, [])
-                     .append(self.query(User).get(user_id).username))
+                     .append(r.username))
 
             all_inputs.append(cur_input)
 
-        # If the following line errors, you have a the wrong version
-        # of python-vote-core. make sure you have the github version
-        # installed, referenced in the requirements.txt.
-        # # pip install -r requirements.txt
-        notation_style = SchulzeNPR.BALLOT_NOTATION_GROUPING  # see note above
-        snpr = SchulzeNPR(all_inputs, ballot_notation=notation_style)
-
-        snpr_res = snpr.as_dict()
+        ranking_order = get_schulze_npr_order(all_inputs)
 
         ret = []
+        entry_map = self.get_entry_id_map(ranking_order)
 
-        for i, entry_id in enumerate(snpr_res['order']):
-            entry = self.query(Entry).get(entry_id)
+        for i, entry_id in enumerate(ranking_order):
+            entry = entry_map[entry_id]
             ranking_map = entry_rank_user_map[entry_id]
             review_map = entry_user_review_map[entry_id]
             fer = FinalEntryRanking(i, entry, ranking_map, review_map)
@@ -2133,8 +2432,7 @@ class CoordinatorDAO(UserDAO):
         elif rnd.vote_method in ('yesno', 'rating'):
             new_tpe = new_quorum - old_quorum
             # I'm pretty sure this will fairly distribute tasks
-            created_tasks = create_initial_rating_tasks(session, rnd,
-                                                        tasks_per_entry=new_tpe)
+            create_initial_rating_tasks(session, rnd, tasks_per_entry=new_tpe)
             ret = reassign_rating_tasks(session, rnd, jurors,
                                         strategy=strategy, reassign_all=True)
         else:
@@ -2166,7 +2464,7 @@ class CoordinatorDAO(UserDAO):
 
         advancing_group = self.get_rating_advancing_group(prev_finalized_rnd.id)
 
-        assert 1 < len(advancing_group) <= 40  # TODO: configurable max
+        assert 1 < len(advancing_group) <= RANKING_MAX
 
         rnd = self.create_round(name=name,
                                 jurors=jurors,
@@ -2247,7 +2545,10 @@ class CoordinatorDAO(UserDAO):
         return ret
 
     def update_report(self, report_dict):
-        report_dict['modified_date'] = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        # whole seconds, like HTTP dates (and MySQL DATETIME columns), as
+        # the modified_date keys the report's ETag and rendering caches
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        report_dict['modified_date'] = now.replace(microsecond=0)
         ret = (self.query(RoundResultsSummary)
                .filter_by(campaign_id=self.campaign.id)
                .update(report_dict))
@@ -2256,11 +2557,19 @@ class CoordinatorDAO(UserDAO):
     def publish_report(self):
         report = {'status': PUBLISHED_STATUS}
         ret = self.update_report(report)
+        self._update_entry_campaigns(results_published=True)
         return ret
 
     def unpublish_report(self):
         report = {'status': PRIVATE_STATUS}
         ret = self.update_report(report)
+        self._update_entry_campaigns(results_published=False)
+        return ret
+
+    def _update_entry_campaigns(self, **kw):
+        ret = (self.query(EntryCampaign)
+               .filter_by(campaign_id=self.campaign.id)
+               .update(kw, synchronize_session=False))
         return ret
 
 
@@ -2530,18 +2839,11 @@ class JurorDAO(object):
         # the fact that these are identical for two DAOs shows it
         # should be on the Round model or somewhere else shared
         re_count = self.query(RoundEntry).filter_by(round_id=round_id).count()
-        total_tasks = self.query(Vote)\
-                          .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)\
-                          .filter(RoundEntry.round_id == round_id,
-                                  Vote.user_id == self.user.id,
-                                  Vote.status != CANCELLED_STATUS)\
-                          .count()
-        total_open_tasks = self.query(Vote)\
-                            .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)\
-                            .filter(RoundEntry.round_id == round_id,
-                                    Vote.user_id == self.user.id,
-                                    Vote.status == ACTIVE_STATUS)\
-                            .count()
+        status_counts = get_task_status_counts(self.rdb_session, round_id,
+                                              user_id=self.user.id)
+        task_count_map = _make_task_count_map(status_counts)
+        total_tasks = task_count_map['total_tasks']
+        total_open_tasks = task_count_map['total_open_tasks']
 
         if total_tasks:
             percent_open = round((100.0 * total_open_tasks) / total_tasks, 3)
@@ -2577,35 +2879,55 @@ class JurorDAO(object):
                .all())
         return ret
 
-    def get_tasks_from_round(self, round_id, num=1, offset=0):
+    def get_tasks_from_round(self, round_id, num=1, offset=0, after=None):
+        """Returns up to *num* of the juror's open tasks in the round, in
+        id order. Pass the id of the last task already seen as *after*
+        to page through them without an OFFSET scan. Skipped tasks are
+        left for last, once no other tasks remain, and are paged
+        through the same way.
+        """
         task_query = (
             self.query(Vote)
+            .options(joinedload('round_entry').joinedload('entry'))
             .filter_by(user=self.user, status=ACTIVE_STATUS)
             .join(RoundEntry, RoundEntry.id == Vote.round_entry_id)
             .filter(RoundEntry.round_id == round_id)
             .order_by(Vote.id)
         )
-        
-        round_juror = self._get_round_juror(round_id)
 
-        skipped_ids = []
-        if round_juror and round_juror.flags:
-            raw = round_juror.flags.get('skipped_ids')
-            if isinstance(raw, list):
-                skipped_ids = raw
-            elif isinstance(raw, int):
-                # Migrate legacy single-watermark format to list (#371)
-                skipped_ids = [raw]
-
-        if skipped_ids:
-            # First: serve non-skipped tasks (exclude all explicitly skipped IDs)
-            non_skipped = task_query.filter(~Vote.id.in_(skipped_ids)).limit(num).all()
-            if non_skipped:
-                return non_skipped
-            # All non-skipped tasks done — now serve skipped ones so juror can finish (#371)
-            return task_query.filter(Vote.id.in_(skipped_ids)).limit(num).all()
-
-        return task_query.limit(num).all()
+        is_skipped = exists().where(vote_skips_t.c.vote_id == Vote.id)
+        skipped_query = task_query.filter(is_skipped)
+        if after and self.query(VoteSkip).get(after) is not None:
+            # the client is already paging through the skipped tasks
+            return skipped_query.filter(Vote.id > after).limit(num).all()
+
+        non_skipped_query = task_query.filter(~is_skipped)
+        if after:
+            non_skipped_query = non_skipped_query.filter(Vote.id > after)
+        non_skipped = non_skipped_query.limit(num).all()
+        if non_skipped:
+            return non_skipped
+        # All non-skipped tasks done — now serve skipped ones so juror can finish (#371)
+        return skipped_query.limit(num).all()
+
+    def _add_vote_skip(self, vote_id, round_id):
+        if self.query(VoteSkip).get(vote_id):
+            return
+        self.rdb_session.add(VoteSkip(vote_id=vote_id,
+                                      user_id=self.user.id,
+                                      round_id=round_id))
+
+    def get_fave_entry_ids(self, entry_ids):
+        "Returns the subset of entry_ids which the juror has faved"
+        entry_ids = list(set(entry_ids))
+        if not entry_ids:
+            return set()
+        faves = (self.rdb_session.query(Favorite.entry_id)
+                 .filter(Favorite.entry_id.in_(entry_ids),
+                         Favorite.user == self.user,
+                         Favorite.status == ACTIVE_STATUS)
+                 .all())
+        return set([f[0] for f in faves])
 
     def get_faves(self, sort='desc', limit=10, offset=0):
         faves_query = (self.query(Favorite)
@@ -2631,7 +2953,7 @@ class JurorDAO(object):
                         .filter(Vote.user == self.user,
                                 Vote.status == COMPLETED_STATUS,
                                 RoundEntry.round_id == round_id)
-                        .options(joinedload('round_entry')))
+                        .options(joinedload('round_entry').joinedload('entry')))
         if order_by == 'value' and sort == 'desc':
             ratings_query = ratings_query.order_by(Vote.value.desc())
         elif order_by == 'value' and sort == 'asc':
@@ -2665,7 +2987,7 @@ class JurorDAO(object):
                        .filter(Vote.user == self.user,
                                Vote.status == COMPLETED_STATUS,
                                RoundEntry.round_id == round_id)\
-                       .options(joinedload('round_entry'))\
+                       .options(joinedload('round_entry').joinedload('entry'))\
                        .all()
         return rankings
 
@@ -2684,19 +3006,18 @@ class JurorDAO(object):
 
     def get_task_counts(self):
         re_count = self.query(RoundEntry).count()
-        total_tasks = self.query(Vote)\
-                          .filter(Vote.user_id == self.user.id,
-                                  Vote.status != CANCELLED_STATUS)\
-                          .count()
-        total_open_tasks = self.query(Vote)\
-                               .filter(Vote.user_id == self.user.id,
-                                       Vote.status == ACTIVE_STATUS)\
-                               .count()
+        rows = (self.query(RoundTaskCount.status,
+                           func.sum(RoundTaskCount.task_count))
+                    .filter(RoundTaskCount.user_id == self.user.id)
+                    .group_by(RoundTaskCount.status)
+                    .all())
+        task_count_map = _make_task_count_map([(st, int(c or 0)) for st, c in rows])
+        total_tasks = task_count_map['total_tasks']
+        total_open_tasks = task_count_map['total_open_tasks']
         return self._build_round_stats(re_count, total_tasks, total_open_tasks)
 
     def get_all_rounds_task_counts(self, only_active=False):
         entry_count = 'entry_count'
-        task_count = 'task_count'
         campaign_id = '_campaign_id'
         campaign_name = '_campaign_name'
         campaign_open_date = '_campaign_open_date'
@@ -2746,34 +3067,15 @@ class JurorDAO(object):
             users_rounds_query,
         )
 
-        def tasks_query(where):
-            return select(
-                [rounds_t.c.id, func.count(votes_t.c.id).label(task_count)],
-            ).select_from(
-                user_rounds_join.outerjoin(
-                    round_entries_t,
-                    onclause=(rounds_t.c.id == round_entries_t.c.round_id),
-                ).outerjoin(
-                    votes_t,
-                    onclause=(round_entries_t.c.id == votes_t.c.round_entry_id)
-                )
-            ).where(
-                (votes_t.c.user_id.in_([self.user.id, None])) & where
-            ).group_by(
-                rounds_t.c.id
-            ).order_by(
-                asc("id")
-            )
-
-        rounds_all_tasks_query = tasks_query(votes_t.c.status != CANCELLED_STATUS)
-        rounds_all_tasks = self.rdb_session.execute(rounds_all_tasks_query)
-        rounds_open_tasks_query = tasks_query(votes_t.c.status == ACTIVE_STATUS)
-        rounds_open_tasks = self.rdb_session.execute(rounds_open_tasks_query)
+        user_counts_query = select(
+            [round_task_counts_t.c.round_id,
+             round_task_counts_t.c.status,
+             round_task_counts_t.c.task_count]
+        ).where(round_task_counts_t.c.user_id == self.user.id)
+        round_status_counts = defaultdict(dict)
+        for row in self.rdb_session.execute(user_counts_query):
+            round_status_counts[row['round_id']][row['status']] = row['task_count']
 
-        rounds_to_total_tasks = {row['id']: row[task_count]
-                                 for row in rounds_all_tasks}
-        rounds_to_total_open_tasks = {row['id']: row[task_count]
-                                      for row in rounds_open_tasks}
         results = []
         for row in all_user_rounds:
             round_kwargs = dict(row)
@@ -2789,8 +3091,9 @@ class JurorDAO(object):
             round = Round(**round_kwargs)
             round.campaign = campaign
 
-            total_tasks = rounds_to_total_tasks.get(round.id, 0)
-            total_open_tasks = rounds_to_total_open_tasks.get(round.id, 0)
+            task_count_map = _make_task_count_map(round_status_counts[round.id])
+            total_tasks = task_count_map['total_tasks']
+            total_open_tasks = task_count_map['total_open_tasks']
 
             results.append(
                 (round,
@@ -2830,18 +3133,99 @@ class JurorDAO(object):
         return vote
 
     def edit_rating(self, task, value, review=''):
-        if not task.user == self.user:
-            raise PermissionDenied()
+        self.apply_ratings([{'vote': task, 'value': value, 'review': review}])
+        return task
+
+    def apply_ratings(self, ratings):
+        """Complete many of the juror's votes with a single executemany
+        UPDATE. *ratings* is a list of dicts with "vote" (a Vote),
+        "value" and an optional "review". All the votes are checked
+        before anything is written.
+
+        The counter and vote total changes come from the vote rows as
+        locked by lock_vote_rows(), not from the loaded Votes, so
+        concurrent submissions of the same votes are only counted once.
+        """
+        if not ratings:
+            return
+        self._write_ratings([(r_dict['vote'].id, r_dict['value'],
+                              r_dict.get('review')) for r_dict in ratings])
+
+        # the identity map doesn't see Core updates
+        for r_dict in ratings:
+            self.rdb_session.expire(r_dict['vote'])
+        return
+
+    def apply_leased_ratings(self, round_id, ratings):
+        """Like apply_ratings(), for votes from a task lease on
+        *round_id* (see juror_endpoints.get_tasks_from_round). Ratings
+        have a "vote_id" instead of a Vote.
+
+        The lease already vouches for the juror's place in the round,
+        so no Votes or Round are loaded. What's left is checking that
+        the round is still active, and that the locked vote rows are
+        the juror's, in that round.
+        """
+        if not ratings:
+            return
+        round_status = self.rdb_session.execute(
+            select([rounds_t.c.status]).where(rounds_t.c.id == round_id)).scalar()
+        if round_status != ACTIVE_STATUS:
+            raise InvalidAction('round %s is not active' % round_id)
+        vote_ids = self._write_ratings([(r_dict['vote_id'], r_dict['value'],
+                                         r_dict.get('review'))
+                                        for r_dict in ratings],
+                                       round_id=round_id)
+
+        identity_map = self.rdb_session.identity_map
+        for vote_id in vote_ids:
+            vote = identity_map.get(identity_key(Vote, vote_id))
+            if vote is not None:
+                self.rdb_session.expire(vote)
+        return
+
+    def _write_ratings(self, ratings, round_id=None):
+        # ratings are (vote_id, value, review) tuples. returns the vote ids.
+        vote_ids = [vote_id for vote_id, _, _ in ratings]
+        if len(set(vote_ids)) != len(vote_ids):
+            raise InvalidAction('each vote can only be rated once at a time')
+        prev_rows = lock_vote_rows(self.rdb_session, vote_ids)
+
         now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-        rating = self.rdb_session.query(Vote)\
-                                 .filter_by(id=task.id)\
-                                 .first()
-        rating.value = value
-        if review:
-            rating.flags['review'] = review
-        rating.modified_date = now
-        rating.status = COMPLETED_STATUS
-        return rating
+        rows = []
+        count_deltas = Counter()
+        rating_deltas = defaultdict(lambda: [0, 0])
+        for vote_id, value, review in ratings:
+            prev = prev_rows.get(vote_id)
+            if prev is None or prev.user_id != self.user.id:
+                raise PermissionDenied()
+            if round_id is not None and prev.round_id != round_id:
+                raise InvalidAction('vote %s is not in round %s'
+                                    % (vote_id, round_id))
+            _add_rating_delta(rating_deltas, prev.round_entry_id,
+                              prev.status, prev.value, -1)
+            _add_rating_delta(rating_deltas, prev.round_entry_id,
+                              COMPLETED_STATUS, value, 1)
+            flags = dict(prev.flags or {})
+            if review:
+                flags['review'] = review
+            rows.append({'_vote_id': vote_id,
+                         '_value': value,
+                         '_flags': flags})
+            if prev.status != COMPLETED_STATUS:
+                count_deltas[(prev.round_id, self.user.id, prev.status)] -= 1
+                count_deltas[(prev.round_id, self.user.id, COMPLETED_STATUS)] += 1
+
+        vote_update = (votes_t.update()
+                       .where(votes_t.c.id == bindparam('_vote_id'))
+                       .values(value=bindparam('_value'),
+                               flags=bindparam('_flags', type_=JSONEncodedDict),
+                               status=COMPLETED_STATUS,
+                               modified_date=now))
+        self.rdb_session.execute(vote_update, rows)
+        adjust_round_task_counts(self.rdb_session, count_deltas)
+        adjust_round_entry_ratings(self.rdb_session, rating_deltas)
+        return vote_ids
 
     def skip_voting(self, vote_id, round_id=None):
         vote = (
@@ -2861,23 +3245,7 @@ class JurorDAO(object):
         if not round_juror:
             return InvalidAction('round_juror not found')
 
-        if round_juror.flags is None:
-            round_juror.flags = {}
-
-        # Migrate legacy single-watermark to list format (#371)
-        skipped_ids = round_juror.flags.get('skipped_ids')
-        if skipped_ids is None:
-            legacy = round_juror.flags.get('skip')
-            skipped_ids = [legacy] if legacy is not None else []
-
-        if vote_id not in skipped_ids:
-            skipped_ids.append(vote_id)
-            round_juror.flags['skipped_ids'] = skipped_ids
-            # Remove legacy key if present to avoid confusion
-            round_juror.flags.pop('skip', None)
-
-            flag_modified(round_juror, 'flags')
-            self.rdb_session.add(round_juror)
+        self._add_vote_skip(vote_id, round_id)
 
         return
 
@@ -2892,17 +3260,7 @@ class JurorDAO(object):
         ballot can be in any order, with values representing
         ranks. ties are allowed.
         """
-        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
-        for r_dict in ballot:
-            vote = r_dict['vote']
-            review = r_dict.get('review') or ''
-            vote.value = r_dict['value']
-            if review:
-                vote.flags['review'] = review
-
-            vote.modified_date = now
-            vote.status = COMPLETED_STATUS
-            self.rdb_session.add(vote)
+        self.apply_ratings(ballot)
         return
 
     def fave(self, round_id, entry_id):
@@ -2953,6 +3311,59 @@ def lookup_user(rdb_session, username):
     return user
 
 
+USER_CACHE_TTL = 30  # seconds
+USER_CACHE_SIZE = 1024
+
+
+class UserCache(object):
+    """A small, process-local cache of user rows, by id, so that the
+    per-request user lookup doesn't have to hit the database.
+
+    Only plain column values are stored, never a session-bound
+    instance. Each get() builds a fresh User from that snapshot and
+    attaches it to the given session without a SELECT, so
+    relationships still lazy-load from the database as usual.
+
+    Entries expire after *ttl* seconds. Sessions carrying this cache in
+    their info dict (as UserMiddleware sets up) also drop the entries
+    of any users they modify, once the transaction ends. Changes made
+    elsewhere (e.g., other processes, tools/admin) show up within the
+    TTL.
+    """
+    def __init__(self, ttl=USER_CACHE_TTL, max_size=USER_CACHE_SIZE):
+        self.ttl = ttl
+        self._cache = LRU(max_size=max_size)
+        self._lock = threading.Lock()
+
+    def get(self, rdb_session, user_id):
+        with self._lock:
+            snapshot, expire_time = self._cache.get(user_id, (None, 0))
+        if snapshot is None or expire_time < time.time():
+            user = rdb_session.query(User).filter(User.id == user_id).first()
+            if user is not None:
+                self.put(user)
+            return user
+        user_kw = dict(snapshot)
+        user_kw['flags'] = copy.deepcopy(user_kw['flags'])
+        user = User(**user_kw)
+        make_transient_to_detached(user)
+        return rdb_session.merge(user, load=False)
+
+    def put(self, user):
+        snapshot = tuple([(c.key, copy.deepcopy(getattr(user, c.key)))
+                          for c in users_t.columns])
+        with self._lock:
+            self._cache[user.id] = (snapshot, time.time() + self.ttl)
+
+    def invalidate(self, user_ids=None):
+        with self._lock:
+            if user_ids is None:
+                self._cache.clear()
+                return
+            for user_id in user_ids:
+                self._cache.pop(user_id, None)
+
+
 def lookup_series(rdb_session, name):
     series = (rdb_session.query(Series)
               .filter_by(name=name)
@@ -2969,14 +3380,43 @@ def create_initial_tasks(rdb_session, rnd):
     return ret
 
 
-def create_ranking_tasks(rdb_session, rnd, jurors=None):
-    ret = []
+def make_insert_ignore(rdb_session, table):
+    """An INSERT for *table* which skips rows that would violate a
+    unique key, in the current dialect's spelling: MySQL's ON
+    DUPLICATE KEY UPDATE (with a no-op update), SQLite's INSERT OR
+    IGNORE, or PostgreSQL's ON CONFLICT DO NOTHING.
+    """
+    dialect_name = rdb_session.get_bind().dialect.name
+    if dialect_name == 'mysql':
+        stmt = mysql.insert(table)
+        pk_col = table.primary_key.columns.values()[0]
+        return stmt.on_duplicate_key_update(**{pk_col.name: pk_col})
+    elif dialect_name == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    elif dialect_name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    raise NotImplementedError('no insert-or-ignore for dialect %r'
+                              % dialect_name)
+
+
+ENTRY_ROW_COLS = [c.name for c in entries_t.columns
+                  if c.name not in ('id', 'create_date')]
+
+
+def _iter_csv_entries(entry_iter, csv_url):
+    try:
+        for entry in entry_iter:
+            yield entry
+    except ValueError:
+        raise InvalidAction('unable to load csv "%s"' % csv_url)
 
-    if jurors is None:
-        jurors = [rj.user for rj in rnd.round_jurors if rj.is_active]
-    if not jurors:
-        raise InvalidAction('expected round with active jurors')
 
+def _make_entry_row(entry):
+    return dict([(col, getattr(entry, col)) for col in ENTRY_ROW_COLS])
+
+
+def _get_shuffled_round_entry_ids(rdb_session, rnd):
+    # ids of qualified entries that don't have tasks yet, in random order
     rdb_type = rdb_session.bind.dialect.name
 
     if rdb_type == 'mysql':
@@ -2985,26 +3425,65 @@ def create_ranking_tasks(rdb_session, rnd, jurors=None):
         rand_func = func.random()
 
     # this does the shuffling in the database
-    shuffled_entries = (rdb_session.query(RoundEntry)
-                                   .filter(RoundEntry.round_id == rnd.id,
-                                           RoundEntry.dq_user_id == None,
-                                           RoundEntry.votes == None)
-                                   .order_by(rand_func).all())
-    if not shuffled_entries:
-        return []
-
-    for juror in jurors:
-        for entry in shuffled_entries:
-            vote = Vote(user=juror, round_entry=entry, status=ACTIVE_STATUS)
-            ret.append(vote)
+    rows = (rdb_session.query(RoundEntry.id)
+                       .filter(RoundEntry.round_id == rnd.id,
+                               RoundEntry.dq_user_id == None,
+                               RoundEntry.votes == None)
+                       .order_by(rand_func).all())
+    return [row[0] for row in rows]
 
-    return ret
 
+def insert_tasks(rdb_session, round_id, task_pairs):
+    """Bulk insert active tasks (votes) for an iterable of (user_id,
+    round_entry_id) pairs, executemany-style in chunks of
+    TASK_INSERT_CHUNK_SIZE, without building ORM objects. Keeps the
+    round_task_counts in step. Returns the number of tasks created.
+    """
+    task_count = 0
+    juror_task_counts = Counter()
+    for pair_chunk in chunked_iter(task_pairs, TASK_INSERT_CHUNK_SIZE):
+        rows = [{'user_id': user_id,
+                 'round_entry_id': round_entry_id,
+                 'status': ACTIVE_STATUS,
+                 'flags': {}} for user_id, round_entry_id in pair_chunk]
+        rdb_session.execute(votes_t.insert(), rows)
+        task_count += len(rows)
+        juror_task_counts.update([user_id for user_id, _ in pair_chunk])
+
+    if task_count:
+        adjust_round_task_counts(rdb_session,
+                                 dict([((round_id, user_id, ACTIVE_STATUS), count)
+                                       for user_id, count in juror_task_counts.items()]))
+        # loaded RoundEntry.votes collections no longer reflect the db
+        for obj in list(rdb_session.identity_map.values()):
+            if isinstance(obj, RoundEntry) and obj.round_id == round_id:
+                rdb_session.expire(obj, ['votes'])
+    return task_count
 
-def create_initial_rating_tasks(rdb_session, rnd, tasks_per_entry=None):
-    # Creates a specified number of tasks per entry.
 
-    ret = []
+def create_ranking_tasks(rdb_session, rnd, jurors=None):
+    # Every active juror ranks every entry. Returns the number of
+    # tasks created.
+    if jurors is None:
+        juror_ids = [rj.user_id for rj in rnd.round_jurors if rj.is_active]
+    else:
+        juror_ids = [j.id for j in jurors]
+    if not juror_ids:
+        raise InvalidAction('expected round with active jurors')
+
+    shuffled_entry_ids = _get_shuffled_round_entry_ids(rdb_session, rnd)
+    if not shuffled_entry_ids:
+        return 0
+
+    task_pairs = ((juror_id, entry_id)
+                  for juror_id in juror_ids
+                  for entry_id in shuffled_entry_ids)
+    return insert_tasks(rdb_session, rnd.id, task_pairs)
+
+
+def create_initial_rating_tasks(rdb_session, rnd, tasks_per_entry=None):
+    # Creates a specified number of tasks per entry. Returns the
+    # number of tasks created.
 
     if not tasks_per_entry:
         tasks_per_entry = rnd.quorum
@@ -3012,50 +3491,36 @@ def create_initial_rating_tasks(rdb_session, rnd, tasks_per_entry=None):
     if tasks_per_entry > len(rnd.round_jurors):
         raise InvalidAction('quorum cannot be greater than the number of jurors')
 
-    jurors = [rj.user for rj in rnd.round_jurors if rj.is_active]
-    if not jurors:
+    juror_ids = [rj.user_id for rj in rnd.round_jurors if rj.is_active]
+    if not juror_ids:
         raise InvalidAction('expected round with active jurors')
-    random.shuffle(jurors)
-
-    rdb_type = rdb_session.bind.dialect.name
+    random.shuffle(juror_ids)
 
-    if rdb_type == 'mysql':
-        rand_func = func.rand()
-    else:
-        rand_func = func.random()
-
-    # this does the shuffling in the database
-    shuffled_entries = (rdb_session.query(RoundEntry)
-                                   .filter(RoundEntry.round_id == rnd.id,
-                                           RoundEntry.dq_user_id == None,
-                                           RoundEntry.votes == None)
-                                   .order_by(rand_func).all())
-    if not shuffled_entries:
-        return []
+    shuffled_entry_ids = _get_shuffled_round_entry_ids(rdb_session, rnd)
+    if not shuffled_entry_ids:
+        return 0
     # Note: It's only creating tasks for entries with no tasks. A
     # better approach would be to check if each entry meets the
     # quorum, and create tasks accordingly
 
-    to_process = itertools.chain.from_iterable([shuffled_entries] * tasks_per_entry)
+    to_process = itertools.chain.from_iterable([shuffled_entry_ids] * tasks_per_entry)
     # some pictures may get more than quorum votes
     # it's either that or some get less
-    per_juror = int(ceil(len(shuffled_entries)
-                         * (float(tasks_per_entry) / len(jurors))))
+    per_juror = int(ceil(len(shuffled_entry_ids)
+                         * (float(tasks_per_entry) / len(juror_ids))))
 
     juror_iters = itertools.chain.from_iterable([itertools.repeat(j, per_juror)
-                                                 for j in jurors])
+                                                 for j in juror_ids])
 
-    pairs = zip_longest(to_process, juror_iters, fillvalue=None)
+    def _iter_task_pairs():
+        pairs = zip_longest(to_process, juror_iters, fillvalue=None)
+        for entry_id, juror_id in pairs:
+            assert juror_id is not None, 'should never run out of jurors first'
+            if entry_id is None:
+                break
+            yield juror_id, entry_id
 
-    for entry, juror in pairs:
-        assert juror is not None, 'should never run out of jurors first'
-        if entry is None:
-            break
-
-        # TODO: bulk_save_objects
-        vote = Vote(user=juror, round_entry=entry, status=ACTIVE_STATUS)
-        ret.append(vote)
-    return ret
+    return insert_tasks(rdb_session, rnd.id, _iter_task_pairs())
 
 
 def reassign_tasks(session, rnd, new_jurors, strategy=None):
@@ -3124,11 +3589,11 @@ def reassign_ranking_tasks(session, rnd, new_jurors, strategy=None):
             vote.status = CANCELLED_STATUS
             vote.modified_date = now
 
-    added_votes = []
+    added_vote_count = 0
     if added_jurors:
-        added_votes = create_ranking_tasks(session, rnd, jurors=added_jurors)
+        added_vote_count = create_ranking_tasks(session, rnd, jurors=added_jurors)
 
-    ret = {'reassigned_task_count': len(votes_to_cancel) + len(added_votes),
+    ret = {'reassigned_task_count': len(votes_to_cancel) + added_vote_count,
            'task_count_mean': -1}
 
     return ret
@@ -3232,10 +3697,415 @@ def reassign_rating_tasks(session, rnd, new_jurors, strategy=None,
             'task_count_mean': mean(list(vote_count_map.values()))}
 
 
+def get_task_status_counts(rdb_session, round_id, user_id=None):
+    """Returns a dict of vote status -> count for a round, read from
+    the round_task_counts table. Sums across jurors unless a user_id
+    is given.
+    """
+    query = (rdb_session.query(RoundTaskCount.status,
+                               func.sum(RoundTaskCount.task_count))
+                        .filter(RoundTaskCount.round_id == round_id))
+    if user_id is not None:
+        query = query.filter(RoundTaskCount.user_id == user_id)
+    rows = query.group_by(RoundTaskCount.status).all()
+    return dict([(status, int(count or 0)) for status, count in rows])
+
+
+def _make_task_count_map(status_counts):
+    status_counts = dict(status_counts)
+    cancelled_task_count = status_counts.pop(CANCELLED_STATUS, 0)
+    return {'total_tasks': sum(status_counts.values()),
+            'total_open_tasks': status_counts.get(ACTIVE_STATUS, 0),
+            'total_cancelled_tasks': cancelled_task_count}
+
+
+def adjust_round_task_counts(rdb_session, deltas):
+    """Apply a mapping of (round_id, user_id, status) -> change in count
+    to the round_task_counts table. Code that changes votes with bulk
+    statements (bypassing the ORM flush hook) must call this with the
+    equivalent deltas.
+    """
+    rows = [{'_round_id': round_id, '_user_id': user_id, '_status': status,
+             '_delta': delta}
+            for (round_id, user_id, status), delta in sorted(deltas.items())
+            if delta and round_id is not None and user_id is not None]
+    if not rows:
+        return
+    # Make sure every counter row exists, then increment them. A plain
+    # UPDATE-then-INSERT lets two transactions both try to create the
+    # same row, and the loser's IntegrityError would roll back a vote.
+    # Rows are sorted for a consistent lock order between writers.
+    insert_stmt = make_insert_ignore(rdb_session, round_task_counts_t)
+    rdb_session.execute(insert_stmt.values(round_id=bindparam('_round_id'),
+                                           user_id=bindparam('_user_id'),
+                                           status=bindparam('_status'),
+                                           task_count=0),
+                        rows)
+    count_col = round_task_counts_t.c.task_count
+    where = ((round_task_counts_t.c.round_id == bindparam('_round_id'))
+             & (round_task_counts_t.c.user_id == bindparam('_user_id'))
+             & (round_task_counts_t.c.status == bindparam('_status')))
+    rdb_session.execute(round_task_counts_t.update()
+                        .where(where)
+                        .values(task_count=count_col + bindparam('_delta')),
+                        rows)
+    return
+
+
+def rebuild_round_task_counts(rdb_session, round_id=None):
+    """Recompute round_task_counts from the votes table, for one round
+    or (by default) all of them. Returns the number of counter rows
+    written.
+    """
+    rdb_session.flush()
+    delete = round_task_counts_t.delete()
+    count_query = (select([round_entries_t.c.round_id,
+                           votes_t.c.user_id,
+                           votes_t.c.status,
+                           func.count(votes_t.c.id)])
+                   .select_from(votes_t.join(round_entries_t,
+                                             round_entries_t.c.id == votes_t.c.round_entry_id))
+                   .where(votes_t.c.user_id != None)
+                   .group_by(round_entries_t.c.round_id,
+                             votes_t.c.user_id,
+                             votes_t.c.status))
+    if round_id is not None:
+        delete = delete.where(round_task_counts_t.c.round_id == round_id)
+        count_query = count_query.where(round_entries_t.c.round_id == round_id)
+    rdb_session.execute(delete)
+    cols = ['round_id', 'user_id', 'status', 'task_count']
+    res = rdb_session.execute(round_task_counts_t.insert()
+                              .from_select(cols, count_query))
+    return res.rowcount
+
+
+def lock_vote_rows(rdb_session, vote_ids):
+    """Read the current state of votes, locking their rows (SELECT ...
+    FOR UPDATE, on backends that support it) until the transaction
+    ends. Returns a map of vote id -> row, with the vote's round_id,
+    user_id, status, round_entry_id, value and flags.
+
+    Counter deltas must be computed from these rows, not from loaded
+    Vote objects, so that two transactions changing the same vote
+    can't both apply the same transition.
+    """
+    ret = {}
+    # sorted, so that writers lock rows in a consistent order
+    for id_chunk in chunked(sorted(set(vote_ids)), IMPORT_CHUNK_SIZE):
+        rows = rdb_session.execute(
+            select([votes_t.c.id, round_entries_t.c.round_id,
+                    votes_t.c.user_id, votes_t.c.status,
+                    votes_t.c.round_entry_id, votes_t.c.value,
+                    votes_t.c.flags])
+            # MySQL also locks the joined round entry, which the vote
+            # totals update would lock anyway
+            .select_from(votes_t.join(round_entries_t,
+                                      round_entries_t.c.id == votes_t.c.round_entry_id))
+            .where(votes_t.c.id.in_(id_chunk))
+            .order_by(votes_t.c.id)
+            .with_for_update(of=votes_t))
+        ret.update([(row.id, row) for row in rows])
+    return ret
+
+
+def _add_rating_delta(rating_deltas, round_entry_id, status, value, sign):
+    # only completed votes with a value count toward the running
+    # average, just like AVG(value)
+    if status != COMPLETED_STATUS or value is None or round_entry_id is None:
+        return
+    rating_deltas[round_entry_id][0] += sign * value
+    rating_deltas[round_entry_id][1] += sign
+
+
+def adjust_round_entry_ratings(rdb_session, deltas):
+    """Apply a mapping of round_entry_id -> (change in vote_sum, change
+    in vote_count) to round_entries, in one executemany. Like
+    adjust_round_task_counts(), this must accompany any bulk statement
+    that completes, edits or cancels completed votes.
+    """
+    rows = [{'_re_id': re_id, '_sum': vote_sum, '_count': vote_count}
+            for re_id, (vote_sum, vote_count) in sorted(deltas.items())
+            if vote_sum or vote_count]
+    if not rows:
+        return
+    sum_col, count_col = round_entries_t.c.vote_sum, round_entries_t.c.vote_count
+    rdb_session.execute(round_entries_t.update()
+                        .where(round_entries_t.c.id == bindparam('_re_id'))
+                        .values(vote_sum=sum_col + bindparam('_sum'),
+                                vote_count=count_col + bindparam('_count')),
+                        rows)
+    return
+
+
+def rebuild_round_entry_ratings(rdb_session, round_id=None):
+    """Recompute the vote_sum and vote_count of round entries from the
+    votes table, for one round or (by default) all of them. Returns the
+    number of round entries updated.
+    """
+    rdb_session.flush()
+    completed = ((votes_t.c.round_entry_id == round_entries_t.c.id)
+                 & (votes_t.c.status == COMPLETED_STATUS))
+    sum_query = (select([func.coalesce(func.sum(votes_t.c.value), 0)])
+                 .where(completed).as_scalar())
+    count_query = (select([func.count(votes_t.c.value)])
+                   .where(completed).as_scalar())
+    update = round_entries_t.update().values(vote_sum=sum_query,
+                                             vote_count=count_query)
+    if round_id is not None:
+        update = update.where(round_entries_t.c.round_id == round_id)
+    res = rdb_session.execute(update)
+    return res.rowcount
+
+
+def _select_entry_campaigns():
+    first_round_entry_id = func.min(round_entries_t.c.id)
+    return (select([round_entries_t.c.entry_id,
+                    rounds_t.c.campaign_id,
+                    first_round_entry_id])
+            .select_from(round_entries_t.join(rounds_t,
+                                              rounds_t.c.id == round_entries_t.c.round_id))
+            .group_by(round_entries_t.c.entry_id, rounds_t.c.campaign_id))
+
+
+def index_entry_campaigns(rdb_session, round_id):
+    """Add the round's entries to entry_campaigns, for any campaign
+    they weren't already entered in. Returns the number of index rows
+    added.
+    """
+    query = _select_entry_campaigns().where(round_entries_t.c.round_id == round_id)
+    cols = ['entry_id', 'campaign_id', 'round_entry_id']
+    insert = make_insert_ignore(rdb_session, entry_campaigns_t)
+    res = rdb_session.execute(insert.from_select(cols, query))
+    return res.rowcount
+
+
+def rebuild_entry_campaigns(rdb_session, campaign_id=None):
+    """Recompute entry_campaigns from the round entries and published
+    reports, for one campaign or (by default) all of them. Returns the
+    number of index rows written.
+    """
+    rdb_session.flush()
+    delete = entry_campaigns_t.delete()
+    query = _select_entry_campaigns()
+    if campaign_id is not None:
+        delete = delete.where(entry_campaigns_t.c.campaign_id == campaign_id)
+        query = query.where(rounds_t.c.campaign_id == campaign_id)
+    rdb_session.execute(delete)
+    cols = ['entry_id', 'campaign_id', 'round_entry_id']
+    res = rdb_session.execute(entry_campaigns_t.insert().from_select(cols, query))
+
+    summaries_t = RoundResultsSummary.__table__
+    published = (select([summaries_t.c.campaign_id])
+                 .where(summaries_t.c.status == PUBLISHED_STATUS))
+    update = (entry_campaigns_t.update()
+              .where(entry_campaigns_t.c.campaign_id.in_(published))
+              .values(results_published=True))
+    if campaign_id is not None:
+        update = update.where(entry_campaigns_t.c.campaign_id == campaign_id)
+    rdb_session.execute(update)
+    return res.rowcount
+
+
+def migrate_legacy_vote_skips(rdb_session, round_id=None):
+    """Move skips from the legacy RoundJuror flags (a list of vote ids
+    under 'skipped_ids', or a single watermark under 'skip') into
+    vote_skips, for one round or (by default) all of them. Returns the
+    number of skips added.
+    """
+    flags_text = type_coerce(RoundJuror.flags, Text)
+    query = rdb_session.query(RoundJuror).filter(
+        or_(flags_text.like('%"skipped_ids"%'), flags_text.like('%"skip"%')))
+    if round_id is not None:
+        query = query.filter(RoundJuror.round_id == round_id)
+    skip_count = 0
+    for round_juror in query:
+        flags = round_juror.flags
+        if 'skipped_ids' not in flags and 'skip' not in flags:
+            continue
+        raw = flags.pop('skipped_ids', None)
+        legacy = flags.pop('skip', None)
+        if raw is None:
+            raw = legacy
+        if isinstance(raw, int):
+            raw = [raw]
+        flag_modified(round_juror, 'flags')
+        if not raw:
+            continue
+        vote_ids = [vote_id for (vote_id,) in
+                    rdb_session.query(Vote.id)
+                    .filter(Vote.id.in_(raw),
+                            Vote.user_id == round_juror.user_id)]
+        already_skipped = set([vote_id for (vote_id,) in
+                               rdb_session.query(VoteSkip.vote_id)
+                               .filter(VoteSkip.vote_id.in_(vote_ids))])
+        for vote_id in vote_ids:
+            if vote_id in already_skipped:
+                continue
+            rdb_session.add(VoteSkip(vote_id=vote_id,
+                                     user_id=round_juror.user_id,
+                                     round_id=round_juror.round_id))
+            skip_count += 1
+    return skip_count
+
+
+def _get_pending_user_id(vote):
+    # vote.user may have been (re)assigned without user_id being
+    # synced yet; that happens during the flush itself.
+    state = inspect(vote)
+    user_hist = state.attrs.user.history
+    if user_hist.added:
+        user = user_hist.added[0]
+        return user.id if user is not None else None
+    user = vote.__dict__.get('user')
+    if user is not None and user.id is not None:
+        return user.id
+    return vote.user_id
+
+
+def _get_pending_round_id(vote):
+    round_entry = vote.__dict__.get('round_entry')
+    if round_entry is None:
+        return None
+    if round_entry.round_id is not None:
+        return round_entry.round_id
+    rnd = round_entry.__dict__.get('round')
+    return rnd.id if rnd is not None else None
+
+
+def _get_pending_round_entry_id(vote):
+    round_entry = vote.__dict__.get('round_entry')
+    if round_entry is not None and round_entry.id is not None:
+        return round_entry.id
+    return vote.round_entry_id
+
+
+def _track_vote_count_changes(rdb_session, flush_context, instances):
+    """Session before_flush hook keeping round_task_counts and the
+    round entries' running vote totals in the same transaction as the
+    Vote inserts/updates/deletes that affect them.
+    """
+    new_votes = [v for v in rdb_session.new if isinstance(v, Vote)]
+    deleted_votes = [v for v in rdb_session.deleted if isinstance(v, Vote)]
+    changed_votes = []
+    for vote in rdb_session.dirty:
+        if not isinstance(vote, Vote):
+            continue
+        attrs = inspect(vote).attrs
+        if (attrs.status.history.has_changes()
+                or attrs.value.history.has_changes()
+                or attrs.user.history.has_changes()
+                or attrs.user_id.history.has_changes()):
+            changed_votes.append(vote)
+    if not (new_votes or deleted_votes or changed_votes):
+        return
+
+    # the pre-flush status/user/round of existing votes is read from
+    # the db, as the previous values aren't always loaded on the
+    # object. the rows stay locked until the transaction ends, so a
+    # concurrent flush of the same votes sees this one's changes.
+    prev_map = {}
+    prev_rating_map = {}
+    prev_ids = [v.id for v in changed_votes + deleted_votes]
+    for vote_id, row in lock_vote_rows(rdb_session, prev_ids).items():
+        prev_map[vote_id] = (row.round_id, row.user_id, row.status)
+        prev_rating_map[vote_id] = (row.round_entry_id, row.status, row.value)
+
+    new_round_entry_ids = set([v.round_entry_id for v in new_votes
+                               if _get_pending_round_id(v) is None
+                               and v.round_entry_id is not None])
+    re_round_map = {}
+    for id_chunk in chunked(sorted(new_round_entry_ids), IMPORT_CHUNK_SIZE):
+        rows = rdb_session.execute(
+            select([round_entries_t.c.id, round_entries_t.c.round_id])
+            .where(round_entries_t.c.id.in_(id_chunk)))
+        re_round_map.update([(row[0], row[1]) for row in rows])
+
+    deltas = Counter()
+    rating_deltas = defaultdict(lambda: [0, 0])
+    for vote in new_votes:
+        round_id = _get_pending_round_id(vote)
+        if round_id is None:
+            round_id = re_round_map.get(vote.round_entry_id)
+        deltas[(round_id, _get_pending_user_id(vote), vote.status)] += 1
+        _add_rating_delta(rating_deltas, _get_pending_round_entry_id(vote),
+                          vote.status, vote.value, 1)
+    for vote in changed_votes:
+        prev_key = prev_map.get(vote.id)
+        if prev_key is None:
+            continue
+        deltas[prev_key] -= 1
+        deltas[(prev_key[0], _get_pending_user_id(vote), vote.status)] += 1
+        _add_rating_delta(rating_deltas, *prev_rating_map[vote.id], sign=-1)
+        _add_rating_delta(rating_deltas, _get_pending_round_entry_id(vote),
+                          vote.status, vote.value, 1)
+    for vote in deleted_votes:
+        if vote.id in prev_map:
+            deltas[prev_map[vote.id]] -= 1
+            _add_rating_delta(rating_deltas, *prev_rating_map[vote.id], sign=-1)
+
+    adjust_round_task_counts(rdb_session, deltas)
+    adjust_round_entry_ratings(rdb_session, rating_deltas)
+    return
+
+
+def track_vote_counts(session_type):
+    """Register the hook keeping round_task_counts and the round
+    entries' vote totals current on sessions made by *session_type*
+    (a sessionmaker). Returns *session_type*, for convenience.
+    """
+    event.listen(session_type, 'before_flush', _track_vote_count_changes)
+    return session_type
+
+
+def _track_user_changes(rdb_session, flush_context):
+    """Session after_flush hook, noting which users were modified
+    (e.g., add_organizer), so the session's UserCache, if any, can drop
+    them when the transaction ends.
+    """
+    if rdb_session.info.get('user_cache') is None:
+        return
+    changed_ids = rdb_session.info.setdefault('changed_user_ids', set())
+    for obj in itertools.chain(rdb_session.dirty, rdb_session.deleted):
+        if isinstance(obj, User):
+            changed_ids.add(obj.id)
+    return
+
+
+def _invalidate_changed_users(rdb_session):
+    changed_ids = rdb_session.info.pop('changed_user_ids', None)
+    user_cache = rdb_session.info.get('user_cache')
+    if changed_ids and user_cache is not None:
+        user_cache.invalidate(changed_ids)
+    return
+
+
+event.listen(Session, 'after_flush', _track_user_changes)
+event.listen(Session, 'after_commit', _invalidate_changed_users)
+event.listen(Session, 'after_rollback', _invalidate_changed_users)
+
+
+def update_last_active_dates(conn, last_active_map):
+    """Writes a batch of {user_id: last_active_date}, without moving any
+    user's last_active_date backwards. Used by the background flush of
+    UserMiddleware's activity bookkeeping.
+    """
+    if not last_active_map:
+        return
+    stmt = (users_t.update()
+            .where(and_(users_t.c.id == bindparam('_user_id'),
+                        or_(users_t.c.last_active_date == None,
+                            users_t.c.last_active_date
+                            < bindparam('_last_active'))))
+            .values(last_active_date=bindparam('_last_active')))
+    conn.execute(stmt, [{'_user_id': user_id, '_last_active': last_active}
+                        for user_id, last_active
+                        in sorted(last_active_map.items())])
+    return
+
+
 def make_rdb_session(echo=True):
     from .utils import load_env_config
     from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
 
     try:
         config = load_env_config()
@@ -3247,7 +4117,7 @@ def make_rdb_session(echo=True):
 
     engine = create_engine(db_url, echo=echo, encoding='utf8')
 
-    session_type = sessionmaker()
+    session_type = track_vote_counts(sessionmaker())
     session_type.configure(bind=engine)
     session = session_type()
 
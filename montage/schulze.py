@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Schulze method ordering for Montage's ranking rounds.
+
+Final rankings are produced by the Schulze method, applied repeatedly
+("Schulze NPR"): pick the Schulze winner, remove it, and pick again
+among the remaining entries, until all entries are ordered.
+
+Pairwise preference counts between two entries don't change when
+some third entry is removed, so the pairwise matrix is built once from
+the ballots, and each round only recomputes the strongest paths
+(a Floyd-Warshall "widest path" pass) over the remaining candidates.
+NumPy is used for that pass when it's installed, with a pure-Python
+fallback otherwise.
+
+Ballots use the same grouping notation as python-vote-core's
+SchulzeNPR: a list of dicts with a 'count' and a 'ballot', where the
+ballot is a list of groups of candidates, most preferred first. Any
+candidate missing from a ballot is ranked below all of that ballot's
+listed candidates.
+"""
+
+from __future__ import absolute_import
+
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def get_candidates(ballots):
+    "Returns candidates in order of first appearance on the ballots."
+    ret, seen = [], set()
+    for ballot in ballots:
+        for group in ballot['ballot']:
+            for cand in group:
+                if cand not in seen:
+                    seen.add(cand)
+                    ret.append(cand)
+    return ret
+
+
+def get_pairwise_matrix(candidates, ballots):
+    """Returns a dense matrix (list of lists) where the value at [i][j]
+    is the number of voters who strictly prefer candidates[i] over
+    candidates[j].
+    """
+    index_map = dict([(cand, i) for i, cand in enumerate(candidates)])
+    size = len(candidates)
+    ret = [[0] * size for _ in range(size)]
+    for ballot in ballots:
+        count = ballot.get('count', 1)
+        groups = ballot['ballot']
+        ranks = [len(groups)] * size  # unlisted candidates rank last
+        for rank, group in enumerate(groups):
+            for cand in group:
+                ranks[index_map[cand]] = rank
+        for i, rank_i in enumerate(ranks):
+            row = ret[i]
+            for j, rank_j in enumerate(ranks):
+                if rank_i < rank_j:
+                    row[j] += count
+    return ret
+
+
+def _get_winner_idxs_py(pairwise, idxs):
+    size = len(idxs)
+    sub = [[pairwise[i][j] for j in idxs] for i in idxs]
+    # only keep the links where i beats j; ties and defeats are zero
+    paths = [[sub[i][j] if sub[i][j] > sub[j][i] else 0
+              for j in range(size)] for i in range(size)]
+    for k in range(size):
+        row_k = paths[k]
+        for i in range(size):
+            p_ik = paths[i][k]
+            if not p_ik or i == k:
+                continue
+            paths[i] = [p_ij if p_ij >= p_ik or p_ij >= p_kj
+                        else (p_ik if p_ik < p_kj else p_kj)
+                        for p_ij, p_kj in zip(paths[i], row_k)]
+    return [idxs[i] for i in range(size)
+            if all(paths[i][j] >= paths[j][i] for j in range(size))]
+
+
+def _get_winner_idxs_np(pairwise, idxs):
+    sub = pairwise[np.ix_(idxs, idxs)]
+    paths = np.where(sub > sub.T, sub, 0)
+    for k in range(len(idxs)):
+        paths = np.maximum(paths, np.minimum(paths[:, k:k + 1],
+                                             paths[k:k + 1, :]))
+    is_winner = (paths >= paths.T).all(axis=1)
+    return [idxs[i] for i in np.flatnonzero(is_winner).tolist()]
+
+
+def get_schwartz_idxs(pairwise, idxs):
+    """Returns the members of *idxs* in the Schwartz set: the union of
+    the smallest groups of candidates that are unbeaten, head-to-head,
+    by anyone outside the group.
+
+    The Schulze winners are always in the Schwartz set, and no beatpath
+    leaves the set and comes back, so the strongest paths only need to
+    be computed among its members.
+    """
+    beats = dict([(i, [j for j in idxs if pairwise[i][j] > pairwise[j][i]])
+                  for i in idxs])
+    beaten_by = dict([(i, []) for i in idxs])
+    for i in idxs:
+        for j in beats[i]:
+            beaten_by[j].append(i)
+
+    # Kosaraju's algorithm, iteratively, for the strongly connected
+    # components of the "beats" graph.
+    finished, visited = [], set()
+    for start in idxs:
+        if start in visited:
+            continue
+        visited.add(start)
+        stack = [(start, iter(beats[start]))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if child not in visited:
+                    visited.add(child)
+                    stack.append((child, iter(beats[child])))
+                    break
+            else:
+                stack.pop()
+                finished.append(node)
+    comp_map = {}
+    for start in reversed(finished):
+        if start in comp_map:
+            continue
+        comp_map[start] = start
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for parent in beaten_by[node]:
+                if parent not in comp_map:
+                    comp_map[parent] = start
+                    stack.append(parent)
+
+    beaten_comps = set([comp_map[j] for i in idxs for j in beats[i]
+                        if comp_map[i] != comp_map[j]])
+    return [i for i in idxs if comp_map[i] not in beaten_comps]
+
+
+def get_schulze_npr_order(ballots, tie_breaker=None):
+    """Returns a list of all the candidates on *ballots*, from first
+    place to last.
+
+    When several candidates are tied for a place, the one appearing
+    earliest in *tie_breaker* is chosen. *tie_breaker* defaults to a
+    random ordering of the candidates, fixed for the whole tally, same
+    as python-vote-core.
+    """
+    candidates = get_candidates(ballots)
+    if not candidates:
+        return []
+    if tie_breaker is None:
+        tie_breaker = list(candidates)
+        random.shuffle(tie_breaker)
+    index_map = dict([(cand, i) for i, cand in enumerate(candidates)])
+    priority = [index_map[cand] for cand in tie_breaker if cand in index_map]
+    priority.extend(sorted(set(index_map.values()) - set(priority)))
+
+    pairwise = get_pairwise_matrix(candidates, ballots)
+    if np is not None:
+        pw_arr = np.array(pairwise, dtype=np.int64)
+        get_winner_idxs = lambda idxs: _get_winner_idxs_np(pw_arr, idxs)
+    else:
+        # without numpy, the Python-level bookkeeping to trim the
+        # candidates down to the Schwartz set first is well worth it
+        get_winner_idxs = lambda idxs: _get_winner_idxs_py(
+            pairwise, get_schwartz_idxs(pairwise, idxs))
+
+    ret = []
+    remaining = list(range(len(candidates)))
+    while len(remaining) > 1:
+        winner_idxs = set(get_winner_idxs(remaining))
+        winner = [i for i in priority if i in winner_idxs][0]
+        ret.append(candidates[winner])
+        remaining.remove(winner)
+    ret.append(candidates[remaining[0]])
+    return ret
@@ -2,8 +2,12 @@
 from __future__ import absolute_import
 import json
 import datetime
+from collections.abc import Mapping, Sized, Iterable
 
-from .utils import json_serial
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from sqlalchemy import inspect
 from sqlalchemy.types import TypeDecorator, Text
@@ -13,6 +17,39 @@ from sqlalchemy.ext.mutable import Mutable
 from sqlalchemy.orm.state import InstanceState
 
 
+def json_default(obj):
+    """Converts the values JSON can't represent directly: dates and
+    datetimes become ISO 8601 strings, sets and other sized iterables
+    become lists, and models (anything with a to_dict()) become dicts.
+    """
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, Sized) and isinstance(obj, Iterable):
+        return list(obj)
+    if not isinstance(obj, type) and callable(getattr(obj, 'to_dict', None)):
+        return obj.to_dict()
+    raise TypeError('type %s not serializable' % type(obj))
+
+
+if orjson is not None:
+    _ORJSON_OPTS = orjson.OPT_NON_STR_KEYS
+
+    def json_dumps(obj, default=json_default):
+        "Serializes *obj* to UTF-8 encoded JSON bytes."
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTS)
+
+    json_loads = orjson.loads
+else:
+    def json_dumps(obj, default=json_default):
+        "Serializes *obj* to UTF-8 encoded JSON bytes."
+        return json.dumps(obj, default=default, ensure_ascii=False,
+                          separators=(',', ':')).encode('utf8')
+
+    json_loads = json.loads
+
+
 class EntityJSONEncoder(json.JSONEncoder):
     """ JSON encoder for custom classes:
 
@@ -115,12 +152,12 @@ class JSONEncodedDict(TypeDecorator):
     def process_bind_param(self, value, dialect):
         if value is None:
             value = {}
-        return json.dumps(value, default=json_serial)
+        return json_dumps(value).decode('utf8')
 
     def process_result_value(self, value, dialect):
         if value is None:
             value = '{}'
-        return json.loads(value)
+        return json_loads(value)
 
 
 class MutableDict(Mutable, dict):
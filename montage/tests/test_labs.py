@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import sqlite3
+
+import pytest
+
+from montage import labs
+
+
+class CountingConnector(object):
+    """A stand-in for the wikireplica: fresh in-memory SQLite connections,
+    counting how many get opened."""
+    def __init__(self):
+        self.connections = []
+
+    def __call__(self):
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.connections.append(conn)
+        return conn
+
+
+@pytest.fixture
+def replica_connector():
+    connector = CountingConnector()
+    labs.configure_replica_pool(connect=connector, size=2)
+    yield connector
+    labs.configure_replica_pool()
+
+
+def test_replica_pool_reuses_connections(replica_connector):
+    for i in range(10):
+        res = labs.fetchall_from_commonswiki('SELECT ? AS img_name, ? AS file_id',
+                                             (b'Example.jpg', i))
+        assert res == [{'img_name': 'Example.jpg', 'file_id': i}]
+    assert len(replica_connector.connections) == 1
+
+
+def test_replica_pool_replaces_dead_connections(replica_connector):
+    labs.fetchall_from_commonswiki('SELECT 1', ())
+    # e.g., the replica closed an idle connection
+    replica_connector.connections[0].close()
+
+    res = labs.fetchall_from_commonswiki('SELECT 2 AS two', ())
+    assert res == [{'two': 2}]
+    assert len(replica_connector.connections) == 2
+
+
+def test_get_files_info_batches(monkeypatch):
+    queries = []
+
+    def fake_fetchall(query, params):
+        queries.append(params)
+        return [{'img_name': name} for name in params if name != 'Missing.jpg']
+
+    monkeypatch.setattr(labs, 'fetchall_from_commonswiki', fake_fetchall)
+    names = ['C c.jpg', 'Missing.jpg', 'A.jpg', 'B.jpg', 'C_c.jpg']
+    file_infos, no_info = labs.get_files_info(names, chunk_size=2)
+
+    assert len(queries) == 2
+    assert [fi['img_name'] for fi in file_infos] == ['C_c.jpg', 'A.jpg', 'B.jpg']
+    assert no_info == ['Missing.jpg']
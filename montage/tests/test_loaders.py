@@ -4,12 +4,16 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 import os
+import json
 
 import pytest
 import responses
 from pytest import raises
 
-from montage.loaders import get_entries_from_gsheet, make_entry
+from montage.loaders import (get_entries_from_gsheet,
+                             get_by_filename_remote,
+                             iter_entries_from_lines,
+                             make_entry)
 
 from .conftest import (
     FIXTURE_FILE_INFOS,
@@ -56,8 +60,8 @@ def test_load_filenames():
         status=200,
         content_type='text/csv',
     )
-    # The filename-only CSV triggers load_partial_csv -> load_name_list
-    # -> get_by_filename_remote -> POST to Toolforge /file endpoint.
+    # The filename-only CSV triggers a lookup through
+    # get_by_filename_remote -> POST to Toolforge /file endpoint.
     responses.add(
         responses.POST,
         TOOLFORGE_FILE_URL,
@@ -96,6 +100,52 @@ def test_no_persmission():
         get_entries_from_gsheet(FORBIDDEN_SHEET, source='remote')
 
 
+@responses.activate
+def test_get_by_filename_remote_chunks():
+    """Chunks are fetched concurrently, retried on server errors, and
+    returned in request order."""
+    failed = set()
+
+    def _file_callback(request):
+        names = json.loads(request.body)['names']
+        if names[0] not in failed:
+            failed.add(names[0])
+            return (503, {}, 'try again')
+        infos = [{'img_name': name} for name in names if name != 'Missing.jpg']
+        no_info = [name for name in names if name == 'Missing.jpg']
+        return (200, {}, json.dumps({'file_infos': infos, 'no_info': no_info}))
+
+    responses.add_callback(responses.POST, TOOLFORGE_FILE_URL,
+                           callback=_file_callback,
+                           content_type='application/json')
+    names = ['%s.jpg' % i for i in range(7)] + ['Missing.jpg']
+    file_infos, warnings = get_by_filename_remote(names, chunk_size=3,
+                                                  backoff=0)
+    assert [fi['img_name'] for fi in file_infos] == names[:-1]
+    assert warnings == ['Missing.jpg']
+    assert len(responses.calls) == 6
+
+
+def test_iter_entries_from_lines():
+    """Entries are generated lazily, with bad rows turned into warnings."""
+    lines = [line.encode('utf8') + b'\n'
+             for line in FIXTURE_FULL_CSV.splitlines()]
+    lines.insert(2, b'Bad.jpg,image,jpeg,wide,tall,1,Someone,20160101000000\n')
+    progress = []
+    warnings = []
+    entry_iter = iter_entries_from_lines(iter(lines),
+                                         warnings=warnings,
+                                         on_progress=progress.append)
+    first_entry = next(entry_iter)
+    assert first_entry.name == FIXTURE_FILE_INFOS[0]['img_name']
+    assert not warnings
+
+    entries = [first_entry] + list(entry_iter)
+    assert len(entries) == len(FIXTURE_FILE_INFOS)
+    assert len(warnings) == 1
+    assert progress[-1] == len(FIXTURE_FILE_INFOS) + 1
+
+
 def test_make_entry_reupload():
     """make_entry() correctly handles a reuploaded file."""
     entry = make_entry(REUPLOAD_FILE_INFO)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import json
+import threading
+
+import pytest
+
+from montage.mw import logwriter
+from montage.mw.logwriter import BufferedLogWriter
+
+
+def test_buffered_log_writer(tmpdir):
+    log_path = str(tmpdir.join('test.log'))
+    writer = BufferedLogWriter(log_path)
+    writer.write(u'first ☃\n')
+    writer.write(b'second\n')
+    writer.close()
+    with open(log_path, 'rb') as f:
+        assert f.read().decode('utf8') == u'first ☃\nsecond\n'
+    assert writer.get_stats()['written'] == 2
+
+
+def test_buffered_log_writer_drops(tmpdir):
+    log_path = str(tmpdir.join('replay.log'))
+    unblocked = threading.Event()
+
+    def serialize(data):
+        unblocked.wait()
+        return json.dumps(data) + '\n'
+
+    writer = BufferedLogWriter(log_path, serialize=serialize,
+                               max_size=2, batch_size=1)
+    for i in range(10):
+        writer.write({'i': i})  # never blocks, even with the writer stuck
+    unblocked.set()
+    writer.close()
+
+    with open(log_path) as f:
+        written = [json.loads(line)['i'] for line in f]
+    stats = writer.get_stats()
+    assert stats['dropped'] > 0
+    assert stats['written'] == len(written) == 10 - stats['dropped']
+    assert written == sorted(written)
+
+
+def test_buffered_log_writer_starts_lazily(tmpdir):
+    log_path = str(tmpdir.join('lazy.log'))
+    writer = BufferedLogWriter(log_path)
+    assert writer._thread is None
+    assert not os.path.exists(log_path)
+    writer.close()  # closing a writer that never wrote is fine
+    assert writer.get_stats()['queued'] == 0
+
+
+def test_buffered_log_writer_after_fake_fork(tmpdir, monkeypatch):
+    log_path = str(tmpdir.join('fake_fork.log'))
+    writer = BufferedLogWriter(log_path)
+    writer.write('parent\n')
+    writer.close()
+    parent_thread = writer._thread
+
+    # pretend write() is being called from a forked worker
+    parent_pid = os.getpid()
+    monkeypatch.setattr(logwriter.os, 'getpid', lambda: parent_pid + 1)
+    writer.write('child\n')
+    assert writer._thread is not parent_thread
+    assert writer._thread.is_alive()
+    writer.close()
+    assert not writer._thread.is_alive()
+    assert writer.get_stats()['written'] == 1
+
+    with open(log_path) as f:
+        assert f.read() == 'parent\nchild\n'
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires os.fork')
+def test_buffered_log_writer_after_fork(tmpdir):
+    log_path = str(tmpdir.join('fork.log'))
+    writer = BufferedLogWriter(log_path)
+    writer.write('parent\n')
+    writer.close()
+
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover - runs in the child
+        ok = False
+        try:
+            writer.write('child\n')
+            writer.close()
+            ok = writer.get_stats()['written'] == 1
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+
+    with open(log_path) as f:
+        assert f.read() == 'parent\nchild\n'
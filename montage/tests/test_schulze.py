@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import copy
+import random
+
+from py3votecore.schulze_npr import SchulzeNPR
+
+from montage import schulze
+from montage.schulze import get_schulze_npr_order, get_schwartz_idxs
+
+
+def _make_ballots(rng, cand_count, juror_count):
+    cands = list(range(100, 100 + cand_count))
+    ret = []
+    for _ in range(juror_count):
+        ranked = list(cands)
+        rng.shuffle(ranked)
+        if rng.random() < 0.2:
+            ranked = ranked[:rng.randint(1, cand_count)]  # partial ballot
+        ballot = []
+        while ranked:
+            group_size = rng.choice((1, 1, 1, 2))
+            ballot.append(ranked[:group_size])
+            ranked = ranked[group_size:]
+        if rng.random() < 0.2:
+            ballot.insert(rng.randint(0, len(ballot)), [])  # skipped rank
+        ret.append({'count': rng.randint(1, 2), 'ballot': ballot})
+    return ret
+
+
+def _get_votecore_order(ballots, tie_breaker):
+    snpr = SchulzeNPR(copy.deepcopy(ballots),
+                      ballot_notation=SchulzeNPR.BALLOT_NOTATION_GROUPING,
+                      tie_breaker=list(tie_breaker))
+    return snpr.as_dict()['order']
+
+
+def _check_against_votecore(trial_count=150):
+    rng = random.Random(0)
+    for _ in range(trial_count):
+        ballots = _make_ballots(rng, rng.randint(2, 9), rng.randint(1, 6))
+        candidates = schulze.get_candidates(ballots)
+        if len(candidates) < 2:
+            continue  # votecore can't order a single candidate
+        tie_breaker = sorted(candidates)
+        rng.shuffle(tie_breaker)
+        expected = _get_votecore_order(ballots, tie_breaker)
+        assert get_schulze_npr_order(ballots, tie_breaker) == expected
+
+
+def test_schulze_npr_matches_votecore():
+    _check_against_votecore()
+
+
+def test_schulze_npr_without_numpy(monkeypatch):
+    monkeypatch.setattr(schulze, 'np', None)
+    _check_against_votecore()
+
+
+def test_schwartz_set():
+    # 0, 1, and 2 beat each other in a cycle, and all beat 3
+    pairwise = [[0, 2, 1, 3],
+                [1, 0, 2, 3],
+                [2, 1, 0, 3],
+                [0, 0, 0, 0]]
+    assert get_schwartz_idxs(pairwise, [0, 1, 2, 3]) == [0, 1, 2]
+    assert get_schwartz_idxs(pairwise, [1, 2, 3]) == [1]
+    assert get_schulze_npr_order([]) == []
+    assert get_schulze_npr_order([{'count': 1, 'ballot': [['a']]}]) == ['a']
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import random
+
+from montage import utils
+from montage.utils import (get_threshold_map,
+                           get_advancing_count,
+                           get_advancing_counts)
+
+
+def _get_threshold_map_naive(ratings_map):
+    thresh_counts = {}
+    ratings_map = dict([(float(k), int(v)) for k, v in ratings_map.items()])
+    ratings_map[0.0] = ratings_map.get(0.0, 0)
+    ratings_map[1.0] = ratings_map.get(1.0, 0)
+    for rating in sorted(ratings_map.keys()):
+        total_gte = sum([v for k, v in ratings_map.items() if k >= rating])
+        thresh_counts[int(rating * 1000) / 1000.0] = total_gte
+    return thresh_counts
+
+
+def _make_ratings_map(quorum=7, entry_count=500):
+    rng = random.Random(quorum)
+    ratings = [sum(rng.choice((0.0, 0.25, 0.5, 0.75, 1.0))
+                   for _ in range(quorum)) / quorum
+               for _ in range(entry_count)]
+    ratings_map = {}
+    for rating in ratings:
+        ratings_map[rating] = ratings_map.get(rating, 0) + 1
+    return ratings_map
+
+
+def test_threshold_map():
+    for quorum in (1, 3, 7):
+        ratings_map = _make_ratings_map(quorum)
+        assert get_threshold_map(ratings_map) == _get_threshold_map_naive(ratings_map)
+    assert get_threshold_map({}) == {0.0: 0, 1.0: 0}
+
+
+def test_advancing_counts():
+    ratings_map = {0.25: 3, 0.5: 2, 1.0: 1}
+    assert get_advancing_count(ratings_map, 0.5) == 3
+    assert get_advancing_counts(ratings_map, [0.0, 0.3, 1.0, 1.1]) == [6, 3, 1, 0]
+
+
+def test_threshold_map_without_numpy(monkeypatch):
+    ratings_map = _make_ratings_map()
+    expected = _get_threshold_map_naive(ratings_map)
+    monkeypatch.setattr(utils, 'np', None)
+    assert get_threshold_map(ratings_map) == expected
+    assert get_advancing_counts(ratings_map, [0.5]) == [expected[0.5]]
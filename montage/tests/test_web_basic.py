@@ -3,6 +3,7 @@
 from __future__ import print_function
 
 from __future__ import absolute_import
+import io
 import os
 import json
 from unittest.mock import patch
@@ -129,10 +130,69 @@ def _create_schema(db_url, echo=True):
     return
 
 
+def _assert_task_counts_consistent(db_url):
+    """The denormalized round_task_counts table should match a fresh
+    count over the votes table."""
+    from sqlalchemy import create_engine, select, func
+    from montage.rdb import round_task_counts_t, votes_t, round_entries_t
+
+    engine = create_engine(db_url)
+    counter_rows = engine.execute(select([round_task_counts_t.c.round_id,
+                                          round_task_counts_t.c.user_id,
+                                          round_task_counts_t.c.status,
+                                          round_task_counts_t.c.task_count]))
+    counters = dict([(tuple(r[:3]), r[3]) for r in counter_rows if r[3]])
+    vote_rows = engine.execute(
+        select([round_entries_t.c.round_id, votes_t.c.user_id,
+                votes_t.c.status, func.count(votes_t.c.id)])
+        .select_from(votes_t.join(round_entries_t,
+                                  round_entries_t.c.id == votes_t.c.round_entry_id))
+        .group_by(round_entries_t.c.round_id, votes_t.c.user_id,
+                  votes_t.c.status))
+    expected = dict([(tuple(r[:3]), r[3]) for r in vote_rows])
+    assert expected
+    assert counters == expected
+
+    # likewise the running vote totals on round_entries
+    completed = ((votes_t.c.round_entry_id == round_entries_t.c.id)
+                 & (votes_t.c.status == 'completed'))
+    rating_rows = engine.execute(
+        select([round_entries_t.c.id,
+                round_entries_t.c.vote_sum,
+                round_entries_t.c.vote_count,
+                func.coalesce(func.sum(votes_t.c.value), 0),
+                func.count(votes_t.c.value)])
+        .select_from(round_entries_t.outerjoin(votes_t, completed))
+        .group_by(round_entries_t.c.id))
+    mismatched = [r for r in rating_rows if (r[1], r[2]) != (r[3], r[4])]
+    assert not mismatched
+
+
+def _assert_entry_campaigns_consistent(db_url):
+    """The entry_campaigns index should match one rebuilt from scratch."""
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import sessionmaker
+    from montage.rdb import entry_campaigns_t, rebuild_entry_campaigns
+
+    engine = create_engine(db_url)
+    index_query = select([entry_campaigns_t.c.entry_id,
+                          entry_campaigns_t.c.campaign_id,
+                          entry_campaigns_t.c.round_entry_id,
+                          entry_campaigns_t.c.results_published])
+    index_rows = set(map(tuple, engine.execute(index_query)))
+    assert index_rows
+
+    rdb_session = sessionmaker(bind=engine)()
+    rebuild_entry_campaigns(rdb_session)
+    assert set(map(tuple, rdb_session.execute(index_query))) == index_rows
+    rdb_session.rollback()
+
+
 @pytest.fixture
 def montage_app(tmpdir):
     config = utils.load_env_config(env_name='devtest')
     config['db_url'] = config['db_url'].replace('///', '///' + str(tmpdir) + '/')
+    config['report_html_path'] = str(tmpdir.join('reports'))
     db_url = config['db_url']
     _create_schema(db_url=db_url)
 
@@ -166,7 +226,7 @@ def api_client(montage_app):
     return api_client
 
 
-def test_home_client(base_client, api_client, mock_external_apis):
+def test_home_client(montage_app, base_client, api_client, mock_external_apis):
 
     resp = base_client.fetch('organizer: home', '/')
     #resp = base_client.fetch('public: login', '/login')
@@ -451,6 +511,27 @@ def test_home_client(base_client, api_client, mock_external_apis):
     returned_vote_id = [task['id'] for task in task_after_skip]
     assert skip_vote_id not in returned_vote_id
 
+    resp = fetch('juror: get all open tasks',
+                 '/juror/round/%s/tasks?count=100' % round_id,
+                 as_user='Jimbo Wales')
+    open_ids = [task['id'] for task in resp['data']['tasks']]
+    assert len(open_ids) > 2 and skip_vote_id not in open_ids
+
+    # page through two at a time: the open tasks, then the skipped one
+    paged_ids, after = [], None
+    for _ in range(len(open_ids) + 3):
+        url = '/juror/round/%s/tasks?count=2' % round_id
+        if after:
+            url += '&after=%s' % after
+        resp = fetch('juror: get the next page of tasks', url,
+                     as_user='Jimbo Wales')
+        page_ids = [task['id'] for task in resp['data']['tasks']]
+        if not page_ids:
+            break
+        paged_ids.extend(page_ids)
+        after = page_ids[-1]
+    assert paged_ids == open_ids + [skip_vote_id]
+
     entry_id = tasks[-1]['entry']['id']
     resp = fetch('juror: mark an entry as favorite',
                  '/juror/round/%s/%s/fave' % (round_id, entry_id),
@@ -801,6 +882,13 @@ def test_home_client(base_client, api_client, mock_external_apis):
                  as_user='LilyOfTheWest')
 
     pprint(resp['data'])
+    autodq_actions = set([a['action'] for a in resp['data']
+                          if a['action'].startswith('autodisqualify')])
+    assert 'autodisqualify_by_date' in autodq_actions
+    assert autodq_actions <= set(['autodisqualify_by_date',
+                                  'autodisqualify_by_resolution',
+                                  'autodisqualify_by_uploader',
+                                  'autodisqualify_by_filetype'])
 
 
     # maintainer stuff
@@ -817,10 +905,30 @@ def test_home_client(base_client, api_client, mock_external_apis):
 
     resp = base_client.fetch('public: view report', '/campaign/1')
 
+    # republishing replaced the pre-rendered report, and repeat
+    # visitors get a 304 until the report changes again
+    config = montage_app.resources['config']
+    assert len(os.listdir(config['report_html_path'])) == 1
+    report_url = '/campaign/%s' % campaign_id
+    resp = base_client.fetch('public: view report', report_url)
+    assert resp.headers['ETag'] and resp.headers['Last-Modified']
+    resp = base_client._test_client.get(
+        report_url, headers={'If-None-Match': resp.headers['ETag']})
+    assert resp.status_code == 304
+
+    resp = fetch('public: view entry info',
+                 '/entry/Test_WLM_2015_image_001.jpg')
+    entry_campaigns = resp['data']['campaigns']
+    assert [c['campaign_id'] for c in entry_campaigns] == [campaign_id]
+    assert entry_campaigns[0]['campaign_results_published'] is True
+
     resp = base_client.fetch('meta: view base meta', '/meta/')
 
     #resp = base_client.fetch('public: logout', '/logout')
 
+    _assert_task_counts_consistent(montage_app.resources['config']['db_url'])
+    _assert_entry_campaigns_consistent(montage_app.resources['config']['db_url'])
+
 
 def test_multiple_jurors(api_client, mock_external_apis):
     # This is copied from above. What's the best way to break up the tests into
@@ -867,7 +975,8 @@ def test_multiple_jurors(api_client, mock_external_apis):
 def test_get_files_info_by_name(api_client):
     """GET /utils/file returns file_infos with file_id populated."""
     from .conftest import SELECTED_FILE_INFO
-    with patch('montage.public_endpoints.get_file_info', return_value=SELECTED_FILE_INFO):
+    with patch('montage.public_endpoints.get_files_info',
+               return_value=([SELECTED_FILE_INFO], [])):
         resp = api_client.fetch(
             'public: get file info by name',
             '/utils/file',
@@ -1033,6 +1142,14 @@ def submit_ratings(client, round_id, coord_user='Yarl'):
 
                 ratings.append(rating_dict)
 
+            if r_dict['vote_method'] == 'ranking':
+                # a repeated vote can't stand in for one of the entries
+                resp = fetch('juror: submit ranking with a repeated vote (should fail)',
+                             '/juror/round/%s/tasks/submit' % round_id,
+                             data={'ratings': ratings + ratings[:1]},
+                             as_user=j_username, error_code=400)
+                assert b'only be submitted once' in resp.get_data()
+
             data = {'ratings': ratings}
             t_resp = fetch('juror: submit ratings and reviews',
                            '/juror/round/%s/tasks/submit' % round_id,
@@ -1047,7 +1164,66 @@ def submit_ratings(client, round_id, coord_user='Yarl'):
     # submit random valid votes until there are no more tasks
 
 
-def test_vote_later_reappears(api_client, mock_external_apis):
+def test_stale_ratings_counted_once(montage_app, api_client, mock_external_apis):
+    # two submissions of the same open tasks, e.g., from two tabs,
+    # should only move them from active to completed once
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from montage.rdb import User, UserDAO, JurorDAO, track_vote_counts
+
+    fetch = api_client.fetch
+    series_id = fetch('get default series', '/series')['data'][0]['id']
+    fetch('organizer: create campaign for stale ratings test',
+          '/admin/add_campaign',
+          {'name': 'Stale Ratings Test',
+           'coordinators': [u'LilyOfTheWest'],
+           'open_date': '2015-09-01 17:00:00',
+           'close_date': '2015-10-01 17:00:00',
+           'url': 'http://hatnote.com',
+           'series_id': series_id},
+          as_user='Yarl')
+    campaign_id = fetch('coordinator: get admin view', '/admin',
+                        as_user='LilyOfTheWest')['data'][-1]['id']
+    resp = fetch('coordinator: add yesno round',
+                 '/admin/campaign/%s/add_round' % campaign_id,
+                 {'name': 'Stale Ratings Round',
+                  'vote_method': 'yesno',
+                  'quorum': 1,
+                  'deadline_date': '2025-10-20T00:00:00',
+                  'jurors': [u'Slaporte']},
+                 as_user='LilyOfTheWest')
+    round_id = resp['data']['id']
+    fetch('coordinator: import entries',
+          '/admin/round/%s/import' % round_id,
+          {'import_method': 'category',
+           'category': 'Images_from_Wiki_Loves_Monuments_2015_in_Albania'},
+          as_user='LilyOfTheWest')
+    fetch('coordinator: activate round',
+          '/admin/round/%s/activate' % round_id,
+          {'post': True}, as_user='LilyOfTheWest')
+    task_ids = [t['id'] for t in fetch('juror: get tasks',
+                                       '/juror/round/%s/tasks' % round_id,
+                                       as_user='Slaporte')['data']['tasks']]
+
+    db_url = montage_app.resources['config']['db_url']
+    session_type = track_vote_counts(sessionmaker(bind=create_engine(db_url)))
+    juror_daos = []
+    for rdb_session in (session_type(), session_type()):
+        user = rdb_session.query(User).filter_by(username='Slaporte').one()
+        juror_daos.append(JurorDAO(UserDAO(rdb_session=rdb_session, user=user)))
+    # both load the tasks while they're still active
+    ratings_list = [[{'vote': t, 'value': 1.0}
+                     for t in juror_dao.get_tasks_by_id(task_ids)]
+                    for juror_dao in juror_daos]
+    assert all(r['vote'].status == 'active' for r in ratings_list[1])
+    for juror_dao, ratings in zip(juror_daos, ratings_list):
+        juror_dao.apply_ratings(ratings)
+        juror_dao.rdb_session.commit()
+
+    _assert_task_counts_consistent(db_url)
+
+
+def test_vote_later_reappears(montage_app, api_client, mock_external_apis):
     """
     Regression test for #371 / #372: skipped tasks ("Vote Later") should
     reappear after the juror exhausts all remaining non-skipped tasks.
@@ -1109,12 +1285,32 @@ def test_vote_later_reappears(api_client, mock_external_apis):
           {'vote_id': skip_vote_id},
           as_user='Slaporte')
 
+    # skips stored in the legacy round juror flags are moved over by
+    # the migrate-skips admin command
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from montage.rdb import RoundJuror, migrate_legacy_vote_skips
+
+    legacy_skip_id = all_tasks[1]['id']
+    engine = create_engine(montage_app.resources['config']['db_url'])
+    rdb_session = sessionmaker(bind=engine)()
+    round_juror = rdb_session.query(RoundJuror).filter_by(round_id=round_id).one()
+    round_juror.flags = dict(round_juror.flags or {},
+                             skipped_ids=[skip_vote_id, legacy_skip_id])
+    rdb_session.commit()
+    assert migrate_legacy_vote_skips(rdb_session) == 1
+    rdb_session.commit()
+    assert 'skipped_ids' not in round_juror.flags
+    assert migrate_legacy_vote_skips(rdb_session) == 0
+    rdb_session.close()
+
     # Skipped task must not appear immediately
     resp = fetch('juror: get tasks right after skip',
                  '/juror/round/%s/tasks' % round_id,
                  as_user='Slaporte')
     assert skip_vote_id not in [t['id'] for t in resp['data']['tasks']], (
         'skipped task appeared immediately — should be deferred')
+    assert legacy_skip_id not in [t['id'] for t in resp['data']['tasks']]
 
     # Vote on all remaining non-skipped tasks until the skipped one reappears
     found_skipped = False
@@ -1138,3 +1334,309 @@ def test_vote_later_reappears(api_client, mock_external_apis):
         'BUG #371: skipped task (vote_id=%s) never reappeared after all '
         'non-skipped tasks were completed.' % skip_vote_id
     )
+
+
+def test_task_lease(montage_app, api_client, mock_external_apis):
+    """A leased batch of tasks can be rated and submitted against its
+    lease_token, and votes outside the lease are rejected."""
+    fetch = api_client.fetch
+
+    resp = fetch('get default series', '/series')
+    series_id = resp['data'][0]['id']
+
+    fetch('organizer: create campaign for lease test',
+          '/admin/add_campaign',
+          {'name': 'Task Lease Test',
+           'coordinators': [u'LilyOfTheWest'],
+           'open_date': '2015-09-01 17:00:00',
+           'close_date': '2015-10-01 17:00:00',
+           'url': 'http://hatnote.com',
+           'series_id': series_id},
+          as_user='Yarl')
+    resp = fetch('coordinator: get admin view', '/admin', as_user='LilyOfTheWest')
+    campaign_id = resp['data'][-1]['id']
+
+    resp = fetch('coordinator: add yesno round',
+                 '/admin/campaign/%s/add_round' % campaign_id,
+                 {'name': 'Task Lease Test Round',
+                  'vote_method': 'yesno',
+                  'quorum': 1,
+                  'deadline_date': '2025-10-20T00:00:00',
+                  'jurors': [u'Slaporte']},
+                 as_user='LilyOfTheWest')
+    round_id = resp['data']['id']
+
+    fetch('coordinator: import entries',
+          '/admin/round/%s/import' % round_id,
+          {'import_method': 'category',
+           'category': 'Images_from_Wiki_Loves_Monuments_2015_in_Albania'},
+          as_user='LilyOfTheWest')
+    fetch('coordinator: activate round',
+          '/admin/round/%s/activate' % round_id,
+          {'post': True}, as_user='LilyOfTheWest')
+
+    resp = fetch('juror: lease a batch of tasks',
+                 '/juror/round/%s/tasks?lease=true' % round_id,
+                 as_user='Slaporte')
+    tasks = resp['data']['tasks']
+    lease_token = resp['data']['lease_token']
+    assert len(tasks) > 15
+
+    ratings = [{'vote_id': t['id'], 'value': 1.0} for t in tasks[:5]]
+    resp = fetch('juror: submit leased ratings',
+                 '/juror/round/%s/tasks/submit' % round_id,
+                 {'ratings': ratings, 'lease_token': lease_token},
+                 as_user='Slaporte')
+    assert resp['data']['acknowledged'] == sorted(r['vote_id'] for r in ratings)
+    leased_queries = resp['timings']['db_queries']
+
+    # the lease saves loading the round and the votes
+    ratings = [{'vote_id': t['id'], 'value': 0.0} for t in tasks[5:10]]
+    resp = fetch('juror: submit the same number of unleased ratings',
+                 '/juror/round/%s/tasks/submit' % round_id,
+                 {'ratings': ratings}, as_user='Slaporte')
+    assert leased_queries < resp['timings']['db_queries']
+
+    resp = fetch('juror: lease the last task',
+                 '/juror/round/%s/tasks?lease=true&after=%s'
+                 % (round_id, tasks[-2]['id']),
+                 as_user='Slaporte')
+    assert [t['id'] for t in resp['data']['tasks']] == [tasks[-1]['id']]
+    last_lease_token = resp['data']['lease_token']
+
+    fetch('juror: submit a task outside the lease',
+          '/juror/round/%s/tasks/submit' % round_id,
+          {'ratings': [{'vote_id': tasks[10]['id'], 'value': 1.0}],
+           'lease_token': last_lease_token},
+          as_user='Slaporte', error_code=400)
+    fetch('juror: submit with a tampered lease',
+          '/juror/round/%s/tasks/submit' % round_id,
+          {'ratings': [{'vote_id': tasks[10]['id'], 'value': 1.0}],
+           'lease_token': 'x' + lease_token},
+          as_user='Slaporte', error_code=400)
+    # leases are signed with their own key, so session cookies don't
+    # work as leases, even when they have the right fields
+    config = montage_app.resources['config']
+    fake_lease = JSONCookie({'user_id': 6024474,
+                             'round_id': round_id,
+                             'vote_method': 'yesno',
+                             'vote_ids': [tasks[-1]['id']]},
+                            secret_key=config['cookie_secret'])
+    fetch('juror: submit with a session-signed lease',
+          '/juror/round/%s/tasks/submit' % round_id,
+          {'ratings': [{'vote_id': tasks[-1]['id'], 'value': 1.0}],
+           'lease_token': fake_lease.serialize().decode('ascii')},
+          as_user='Slaporte', error_code=400)
+
+    fetch('coordinator: pause round',
+          '/admin/round/%s/pause' % round_id,
+          {'post': True}, as_user='LilyOfTheWest')
+    fetch('juror: submit leased ratings to a paused round',
+          '/juror/round/%s/tasks/submit' % round_id,
+          {'ratings': [{'vote_id': tasks[-1]['id'], 'value': 1.0}],
+           'lease_token': last_lease_token},
+          as_user='Slaporte', error_code=400)
+
+
+def test_user_cache(montage_app):
+    import datetime
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+    from montage.rdb import User, UserCache
+    from montage.mw import LastActiveFlusher
+
+    engine = create_engine(montage_app.resources['config']['db_url'])
+    session_type = sessionmaker(bind=engine)
+    user_cache = UserCache()
+    statements = []
+    event.listen(engine, 'before_cursor_execute',
+                 lambda conn, cursor, stmt, *a: statements.append(stmt))
+
+    def get_user(**kw):
+        rdb_session = session_type()
+        rdb_session.info['user_cache'] = user_cache
+        user = user_cache.get(rdb_session, 6024474)
+        for key, value in kw.items():
+            setattr(user, key, value)
+        user_dict = user.to_dict()
+        rdb_session.commit()
+        rdb_session.close()
+        return user_dict
+
+    assert get_user()['username'] == 'Slaporte'
+    query_count = len(statements)
+    assert get_user()['username'] == 'Slaporte'
+    assert len(statements) == query_count  # served from the cache
+
+    get_user(username='Slaporte (renamed)')  # invalidates on commit
+    assert get_user()['username'] == 'Slaporte (renamed)'
+
+    flusher = LastActiveFlusher()
+    new_date = datetime.datetime(2020, 1, 2, 3, 4, 5)
+    flusher.record(engine, 6024474, new_date)
+    flusher.record(engine, 6024474, new_date - datetime.timedelta(days=1))
+    flusher.flush()
+    flusher.record(engine, 6024474, new_date - datetime.timedelta(days=2))
+    flusher.flush()  # never moves backwards
+    last_active = engine.execute('SELECT last_active_date FROM users'
+                                 ' WHERE id = 6024474').scalar()
+    assert str(last_active).startswith('2020-01-02 03:04:05')
+
+
+def test_lazy_request_dict():
+    from werkzeug.test import EnvironBuilder
+    from werkzeug.wrappers import Request
+    from clastic.errors import RequestEntityTooLarge
+    from montage.mw import LazyRequestDict, _snapshot_request_dict
+
+    def make_request(**kw):
+        return Request(EnvironBuilder(**kw).get_environ())
+
+    request = make_request(method='POST', query_string={'su_to': 'Yarl'},
+                           data=json.dumps({'su_to': 'x', 'ratings': [1]}))
+    request_dict = LazyRequestDict(request)
+    assert not request_dict.is_loaded
+    assert dict(request_dict) == {'su_to': 'Yarl', 'ratings': [1]}
+    assert request_dict.is_loaded
+
+    assert not LazyRequestDict(make_request(data='[1, 2]'))
+    assert not LazyRequestDict(make_request(data='{not json'))
+
+    request_dict = LazyRequestDict(make_request(data='{"a": 1}'),
+                                   max_body_size=4)
+    with pytest.raises(RequestEntityTooLarge):
+        request_dict.get('a')
+
+    # chunked bodies have no Content-Length
+    def make_chunked_request(body):
+        environ = EnvironBuilder(method='POST').get_environ()
+        environ.pop('CONTENT_LENGTH', None)
+        environ.update({'wsgi.input': io.BytesIO(body),
+                        'wsgi.input_terminated': True})
+        return Request(environ)
+
+    request = make_chunked_request(b'{"a": 1}')
+    assert request.content_length is None
+    assert dict(LazyRequestDict(request)) == {'a': 1}
+    assert dict(LazyRequestDict(make_chunked_request(b'{"a": 1}'),
+                                max_body_size=8)) == {'a': 1}
+    request_dict = LazyRequestDict(make_chunked_request(b'{"a": 1}'),
+                                   max_body_size=7)
+    with pytest.raises(RequestEntityTooLarge):
+        request_dict.get('a')
+
+    # the replay log only includes bodies the endpoint already read
+    request = make_request(method='POST', query_string={'su_to': 'Yarl'},
+                           data=json.dumps({'ratings': [1]}))
+    request_dict = LazyRequestDict(request)
+    assert _snapshot_request_dict(request_dict, request) == {'su_to': 'Yarl'}
+    assert not request_dict.is_loaded
+    request_dict.get('ratings')
+    assert _snapshot_request_dict(request_dict, request) == {'su_to': 'Yarl',
+                                                            'ratings': [1]}
+
+
+def test_db_timings(api_client):
+    from montage.mw import TimingMiddleware, RequestDBStats
+
+    resp = api_client.fetch('public: list series', '/series')
+    assert resp['timings']['db_queries'] > 0
+    assert resp['timings']['db_time'] >= 0
+
+    db_stats = RequestDBStats()
+    db_stats.query_count = 4
+    db_stats.statement_counts.update(['SELECT 1\n  FROM votes'] * 3
+                                     + ['SELECT 2'])
+    api_act = {}
+    TimingMiddleware(n_plus_one_threshold=2)._log_db_stats(api_act, db_stats)
+    assert api_act['db_queries'] == 4
+    assert api_act['n_plus_one_suspected'] == '3x SELECT 1 FROM votes'
+
+
+def test_vote_count_hook_scope(montage_app):
+    # only the app's (and the admin tools') sessions keep counters
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session, sessionmaker
+    from montage.rdb import _track_vote_count_changes, track_vote_counts
+
+    assert not event.contains(Session, 'before_flush',
+                              _track_vote_count_changes)
+    assert not event.contains(sessionmaker(), 'before_flush',
+                              _track_vote_count_changes)
+    session_type = track_vote_counts(sessionmaker())
+    assert event.contains(session_type, 'before_flush',
+                          _track_vote_count_changes)
+
+
+def test_streaming_entry_import(montage_app, api_client, monkeypatch):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from montage import rdb
+    from montage.loaders import make_entry
+    from montage.tests.conftest import FIXTURE_FILE_INFOS
+
+    api_client.fetch('maintainer: add organizer', '/admin/add_organizer',
+                     {'username': 'Yarl'})
+    api_client.fetch('maintainer: create series', '/admin/add_series',
+                     {'name': 'Test Series', 'description': 'desc',
+                      'url': 'http://hatnote.com'})
+    series_id = api_client.fetch('get series', '/series')['data'][0]['id']
+    resp = api_client.fetch('organizer: create campaign', '/admin/add_campaign',
+                            {'name': 'streaming import test',
+                             'coordinators': ['Yarl'],
+                             'open_date': '2015-01-01T00:00:00',
+                             'close_date': '2016-01-01T00:00:00',
+                             'url': 'http://hatnote.com',
+                             'series_id': series_id}, as_user='Yarl')
+    resp = api_client.fetch('coordinator: create round',
+                            '/admin/campaign/%s/add_round' % resp['data']['id'],
+                            {'name': 'Test round',
+                             'vote_method': 'yesno',
+                             'deadline_date': '2016-10-15T00:00:00',
+                             'jurors': ['Slaporte']}, as_user='Yarl')
+    round_id = resp['data']['id']
+
+    engine = create_engine(montage_app.resources['config']['db_url'])
+    rdb_session = sessionmaker(bind=engine)()
+    user = rdb_session.query(rdb.User).filter_by(username='Yarl').one()
+    user_dao = rdb.UserDAO(rdb_session=rdb_session, user=user)
+    coord_dao = rdb.CoordinatorDAO.from_round(user_dao, round_id)
+
+    monkeypatch.setattr(rdb, 'ENTRY_UPSERT_CHUNK_SIZE', 3)
+    pulled = []
+
+    # a case variant of the first entry, three chunks later, is still
+    # a duplicate
+    first_info = FIXTURE_FILE_INFOS[0]
+    case_variant = dict(first_info, img_name=first_info['img_name'].upper())
+    assert case_variant['img_name'] != first_info['img_name']
+
+    def iter_entries():
+        for file_info in FIXTURE_FILE_INFOS[:7] + [case_variant] + FIXTURE_FILE_INFOS[:2]:
+            pulled.append(file_info['img_name'])
+            yield make_entry(file_info)
+
+    entry_rows = coord_dao.add_entries(coord_dao.get_round(round_id),
+                                       iter_entries(), source_desc='a test')
+    first_row = next(entry_rows)
+    assert len(pulled) == 3  # only the first chunk has been read
+    assert first_row.name == FIXTURE_FILE_INFOS[0]['img_name']
+
+    stats = coord_dao.add_round_entries(round_id, entry_rows,
+                                        method='selected', params={})
+    assert len(pulled) == 10
+    assert stats['new_entry_count'] == 6  # the first row was already taken
+    assert stats['new_round_entry_count'] == 6
+    assert stats['total_entries'] == 6
+
+    stats = coord_dao.add_round_entries(round_id, iter([first_row]),
+                                        method='selected', params={})
+    assert stats['new_round_entry_count'] == 1
+    assert stats['total_entries'] == 7
+    stats = coord_dao.add_round_entries(round_id, iter([first_row]),
+                                        method='selected', params={})
+    assert stats['new_round_entry_count'] == 0
+    assert stats['total_entries'] == 7
+    entry_names = [name for (name,) in rdb_session.query(rdb.Entry.name)]
+    assert case_variant['img_name'] not in entry_names
+    rdb_session.commit()
@@ -8,6 +8,7 @@ import random
 import getpass
 import os.path
 import datetime
+from itertools import accumulate
 from six.moves.urllib.parse import urlencode
 
 
@@ -21,6 +22,11 @@ from boltons.timeutils import isoparse
 from .check_rdb import get_schema_errors
 import six
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 try:
     unicode = unicode
     basestring = basestring
@@ -53,6 +59,15 @@ def requests_post(url, **kwargs):
     return requests.post(url, headers=headers, **kwargs)
 
 
+def make_requests_session():
+    """A requests.Session with the User-Agent header set, for reusing
+    keep-alive connections across many requests to the same host.
+    Sessions may be shared between threads."""
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
 class MontageError(Exception):
     "A base type for expected errors."
 
@@ -119,19 +134,55 @@ def get_mw_userid(username):
     return user_id
 
 
+def _get_rating_totals(ratings_map):
+    """Returns the distinct ratings in ascending order, and for each
+    one, the number of entries rated at least that much."""
+    ratings = sorted(ratings_map.keys())
+    counts = [ratings_map[r] for r in ratings]
+    if np is not None:
+        totals = np.cumsum(np.array(counts[::-1], dtype=np.int64))[::-1]
+        return ratings, totals.tolist()
+    return ratings, list(accumulate(counts[::-1]))[::-1]
+
+
+def _coerce_ratings_map(ratings_map):
+    return dict([(float(k), int(v)) for k, v in ratings_map.items()])
+
+
 def get_threshold_map(ratings_map):
+    """Takes a map of average rating -> number of entries with that
+    average, and returns a map of threshold -> number of entries at or
+    above that threshold, with thresholds truncated to three decimal
+    places."""
     thresh_counts = {}
     # coerce some types
-    ratings_map = dict([(float(k), int(v)) for k, v in ratings_map.items()])
+    ratings_map = _coerce_ratings_map(ratings_map)
     ratings_map[0.0] = ratings_map.get(0.0, 0)
     ratings_map[1.0] = ratings_map.get(1.0, 0)
-    for rating in sorted(ratings_map.keys()):
-        total_gte = sum([v for k, v in ratings_map.items() if k >= rating])
+    ratings, totals = _get_rating_totals(ratings_map)
+    for rating, total_gte in zip(ratings, totals):
         rating_key = int(rating * 1000) / 1000.0
         thresh_counts[rating_key] = total_gte
     return thresh_counts
 
 
+def get_advancing_counts(ratings_map, thresholds):
+    """Returns how many entries would advance at each of the given
+    thresholds, for a map of average rating -> number of entries, as
+    returned by CoordinatorDAO.get_round_average_rating_map()."""
+    ratings, totals = _get_rating_totals(_coerce_ratings_map(ratings_map))
+    totals.append(0)  # for thresholds above every rating
+    if np is not None:
+        indexes = np.searchsorted(ratings, thresholds, side='left').tolist()
+    else:
+        indexes = [bisect.bisect_left(ratings, t) for t in thresholds]
+    return [totals[i] for i in indexes]
+
+
+def get_advancing_count(ratings_map, threshold):
+    return get_advancing_counts(ratings_map, [threshold])[0]
+
+
 def get_env_name():
     username = getpass.getuser()
     return USER_ENV_MAP.get(username, DEFAULT_ENV_NAME)
@@ -37,11 +37,13 @@ from montage.rdb import (make_rdb_session,
                          MaintainerDAO,
                          CoordinatorDAO,
                          reassign_rating_tasks,
-                         lookup_user)
-from montage.utils import get_threshold_map
-
-
-RANKING_MAX = 40
+                         rebuild_round_task_counts,
+                         rebuild_round_entry_ratings,
+                         migrate_legacy_vote_skips,
+                         rebuild_entry_campaigns,
+                         lookup_user,
+                         RANKING_MAX)
+from montage.utils import get_threshold_map, get_advancing_count
 
 
 def warn(msg, force=False):
@@ -72,6 +74,7 @@ def main():
     cmd.add('--round-id', parse_as=int, missing=ERROR)
     cmd.add('--csv-path', missing=ERROR)
     cmd.add('--url', missing=ERROR)
+    cmd.add('--threshold', parse_as=float, doc='minimum average rating to advance')
 
     cmd.add(add_organizer)  # , posargs={'count': 1, 'name': 'username'})  # TODO: figure out if we want posarg/flag overriding
 
@@ -86,6 +89,7 @@ def main():
     cmp_cmd.add(add_coordinator, name='add-coordinator')
     cmp_cmd.add(cancel_campaign, name='cancel')
     cmp_cmd.add(backfill_series)
+    cmp_cmd.add(reindex_entries, name='reindex-entries')
 
     cmd.add(cmp_cmd)
 
@@ -102,6 +106,9 @@ def main():
     rnd_cmd.add(shuffle_round_assignments, name='shuffle-tasks')
     rnd_cmd.add(cancel_round, name='cancel')
     rnd_cmd.add(unfinalize_rating_round, name='unfinalize-rating-round')
+    rnd_cmd.add(reconcile_task_counts, name='reconcile-counts')
+    rnd_cmd.add(migrate_vote_skips, name='migrate-skips')
+    rnd_cmd.add(show_round_thresholds, name='thresholds')
 
     cmd.add(rnd_cmd)
 
@@ -223,9 +230,11 @@ def create_round(user_dao, campaign_id, advance=False, debug=False):
         # GIST_URL = 'https://gist.githubusercontent.com/slaporte/7433943491098d770a8e9c41252e5424/raw/ca394147a841ea5f238502ffd07cbba54b9b1a6a/wlm2015_fr_500.csv'
         # entries = maint_dao.add_entries_from_csv_gist(rnd, GIST_URL)
         # source = GIST_URL
-        print(('++ prepared %s entries from %r' %
-               (len(entries), source)))
-        coord_dao.add_round_entries(rnd.id, entries)
+        stats = coord_dao.add_round_entries(rnd.id, entries,
+                                            method='category',
+                                            params={'category': category_name})
+        print(('++ added %s entries from %r' %
+               (stats['new_entry_count'], source)))
     else:
         final_rnds = [r for r in campaign.rounds if r.status == 'finalized']
         last_successful_rnd = final_rnds[-1]
@@ -258,6 +267,14 @@ def cancel_campaign(user_dao, org_dao, campaign_id, force=False):
            % (campaign_id, campaign.name, len(campaign.rounds))))
 
 
+def reindex_entries(user_dao, maint_dao, campaign_id):
+    "rebuild the campaign's rows in the public entry -> campaign index"
+    campaign = user_dao.get_campaign(campaign_id)
+    row_count = rebuild_entry_campaigns(maint_dao.rdb_session, campaign.id)
+    print(('++ indexed %s entries for campaign %s (%r)'
+           % (row_count, campaign.id, campaign.name)))
+    return
+
 
 def pause_round(maint_dao, round_id):
     'pause a round to make edits and perform other maintenance'
@@ -400,14 +417,17 @@ def apply_round_ratings(maint_dao, rdb_session, round_id, csv_path):
     return
 
 
-def show_round_thresholds(user_dao, round_id):
+def show_round_thresholds(user_dao, round_id, threshold):
     'get the threshold map (based on average ratings) for a specified round'
-    # TODO: may not work (had nameerrors before porting)
     coord_dao = CoordinatorDAO.from_round(user_dao, round_id)
+    rnd = coord_dao.get_round(round_id)
     avg_ratings_map = coord_dao.get_round_average_rating_map(round_id)
     thresh_map = get_threshold_map(avg_ratings_map)
-    print('-- Round threshold map for round %s (%r) ...' % round_id)
+    print('-- Round threshold map for round %s (%r) ...' % (rnd.id, rnd.name))
     pprint(thresh_map)
+    if threshold is not None:
+        advancing_count = get_advancing_count(avg_ratings_map, threshold)
+        print('-- %s entries advance at threshold %s' % (advancing_count, threshold))
 
 
 def shuffle_round_assignments(user_dao, round_id):
@@ -469,7 +489,11 @@ def check_round_dupes(user_dao, round_id):
 def import_gist(user_dao, round_id, url):
     "import round entries from a csv list"
     coord_dao = CoordinatorDAO.from_round(user_dao, round_id)
-    entries, warnings = coord_dao.add_entries_from_csv(round_id, url)
+    def _print_progress(row_count):
+        print('.. read %s rows' % row_count)
+
+    entries, warnings = coord_dao.add_entries_from_csv(round_id, url,
+                                                       on_progress=_print_progress)
     stats = coord_dao.add_round_entries(round_id, entries,
                                         method='gistcsv',
                                         params={'gist_url': url})
@@ -556,6 +580,27 @@ def unfinalize_rating_round(user_dao, round_id, force):
            % (round_id, rnd.name)))
     return rnd
 
+def reconcile_task_counts(maint_dao, round_id):
+    """rebuild the denormalized per-juror task counters and per-entry
+    vote totals of a round from its votes."""
+    rnd = maint_dao.user_dao.get_round(round_id)
+    row_count = rebuild_round_task_counts(maint_dao.rdb_session, rnd.id)
+    print(('++ rebuilt %s task counters for round %s (%r)'
+           % (row_count, rnd.id, rnd.name)))
+    entry_count = rebuild_round_entry_ratings(maint_dao.rdb_session, rnd.id)
+    print(('++ rebuilt vote totals for %s entries in round %s'
+           % (entry_count, rnd.id)))
+    return
+
+
+def migrate_vote_skips(maint_dao):
+    """move "vote later" skips stored in the legacy round juror flags
+    of all rounds into the vote_skips table. safe to rerun."""
+    skip_count = migrate_legacy_vote_skips(maint_dao.rdb_session)
+    print('++ migrated %s skipped tasks' % skip_count)
+    return
+
+
 def list_campaigns(user_dao):
     "list details about all campaigns"
     # TODO: flags for names-only, w/details, machine-readable
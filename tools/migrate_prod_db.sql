@@ -1,4 +1,4 @@
--- Production migration: add file_id column to entries table.
+-- Production migrations, applied in order.
 -- Companion to revert_prod_db.sql (exact reverse).
 -- Idempotent: safe to run more than once.
 --
@@ -9,3 +9,76 @@
 
 ALTER TABLE entries ADD COLUMN IF NOT EXISTS file_id BIGINT NULL;
 CREATE INDEX IF NOT EXISTS ix_entries_file_id ON entries (file_id);
+
+-- round_task_counts: denormalized per-round, per-juror vote counts by status,
+-- maintained by the application. Backfilled here from votes; rebuild any time
+-- with `tools/admin.py round reconcile-counts --round-id <id>`.
+CREATE TABLE IF NOT EXISTS round_task_counts (
+    round_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    status VARCHAR(255) NOT NULL,
+    task_count INTEGER NOT NULL,
+    PRIMARY KEY (round_id, user_id, status),
+    FOREIGN KEY (round_id) REFERENCES rounds (id),
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+INSERT IGNORE INTO round_task_counts (round_id, user_id, status, task_count)
+    SELECT round_entries.round_id, votes.user_id, votes.status, COUNT(votes.id)
+    FROM votes JOIN round_entries ON round_entries.id = votes.round_entry_id
+    WHERE votes.user_id IS NOT NULL
+    GROUP BY round_entries.round_id, votes.user_id, votes.status;
+
+-- vote_skips: tasks a juror chose to "vote later", replacing the skipped_ids
+-- list in round_jurors.flags. After creating the table, move the existing
+-- skips over with `tools/admin.py round migrate-skips`.
+CREATE TABLE IF NOT EXISTS vote_skips (
+    vote_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    round_id INTEGER NOT NULL,
+    create_date TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (vote_id),
+    FOREIGN KEY (vote_id) REFERENCES votes (id),
+    FOREIGN KEY (user_id) REFERENCES users (id),
+    FOREIGN KEY (round_id) REFERENCES rounds (id)
+);
+CREATE INDEX IF NOT EXISTS ix_vote_skips_user_round ON vote_skips (user_id, round_id, vote_id);
+CREATE INDEX IF NOT EXISTS ix_votes_user_status_round_entry ON votes (user_id, status, round_entry_id);
+
+-- round_entries.vote_sum/vote_count: running totals of each entry's completed
+-- votes, maintained by the application. Backfilled here; rebuild any time with
+-- `tools/admin.py round reconcile-counts --round-id <id>`.
+ALTER TABLE round_entries ADD COLUMN IF NOT EXISTS vote_sum DOUBLE NOT NULL DEFAULT 0;
+ALTER TABLE round_entries ADD COLUMN IF NOT EXISTS vote_count INTEGER NOT NULL DEFAULT 0;
+UPDATE round_entries
+    JOIN (SELECT round_entry_id, SUM(value) AS vote_sum, COUNT(value) AS vote_count
+          FROM votes
+          WHERE status = 'completed'
+          GROUP BY round_entry_id) AS totals ON totals.round_entry_id = round_entries.id
+    SET round_entries.vote_sum = totals.vote_sum,
+        round_entries.vote_count = totals.vote_count;
+
+-- entry_campaigns: index of the campaigns each entry was entered in, for the
+-- public /entry/<name> lookup. Maintained by the application; backfilled here.
+-- Rebuild a campaign's rows with
+-- `tools/admin.py campaign reindex-entries --campaign-id <id>`.
+CREATE TABLE IF NOT EXISTS entry_campaigns (
+    entry_id INTEGER NOT NULL,
+    campaign_id INTEGER NOT NULL,
+    round_entry_id INTEGER NOT NULL,
+    results_published BOOL NOT NULL DEFAULT 0,
+    create_date TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (entry_id, campaign_id),
+    FOREIGN KEY (entry_id) REFERENCES entries (id),
+    FOREIGN KEY (campaign_id) REFERENCES campaigns (id),
+    FOREIGN KEY (round_entry_id) REFERENCES round_entries (id)
+);
+CREATE INDEX IF NOT EXISTS ix_entry_campaigns_campaign_id ON entry_campaigns (campaign_id);
+INSERT IGNORE INTO entry_campaigns (entry_id, campaign_id, round_entry_id)
+    SELECT round_entries.entry_id, rounds.campaign_id, MIN(round_entries.id)
+    FROM round_entries
+    JOIN rounds ON rounds.id = round_entries.round_id
+    GROUP BY round_entries.entry_id, rounds.campaign_id;
+UPDATE entry_campaigns
+    JOIN results_summaries ON results_summaries.campaign_id = entry_campaigns.campaign_id
+    SET entry_campaigns.results_published = 1
+    WHERE results_summaries.status = 'published';
@@ -1,4 +1,4 @@
--- Production revert: remove file_id column from entries table.
+-- Production reverts, applied in reverse order of migrate_prod_db.sql.
 -- Exact reverse of migrate_prod_db.sql.
 -- Idempotent: safe to run more than once.
 --
@@ -7,5 +7,17 @@
 --
 -- Part of hatnote/montage#505 (image/oldimage → file/filerevision migration).
 
+DROP INDEX IF EXISTS ix_entry_campaigns_campaign_id ON entry_campaigns;
+DROP TABLE IF EXISTS entry_campaigns;
+
+ALTER TABLE round_entries DROP COLUMN IF EXISTS vote_count;
+ALTER TABLE round_entries DROP COLUMN IF EXISTS vote_sum;
+
+DROP INDEX IF EXISTS ix_votes_user_status_round_entry ON votes;
+DROP INDEX IF EXISTS ix_vote_skips_user_round ON vote_skips;
+DROP TABLE IF EXISTS vote_skips;
+
+DROP TABLE IF EXISTS round_task_counts;
+
 DROP INDEX IF EXISTS ix_entries_file_id ON entries;
 ALTER TABLE entries DROP COLUMN IF EXISTS file_id;